@@ -7,6 +7,7 @@ from mongodb_config import db
 from bson import ObjectId
 from datetime import datetime
 from role_manager import RoleManager, UserRole, UserStatus
+from auth_service import invalidate_user_cache
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
@@ -97,6 +98,7 @@ def update_user_role(user_id):
         
         if result.matched_count == 0:
             return jsonify({'error': 'User not found'}), 404
+        invalidate_user_cache(user_id)
         
         return jsonify({'message': f'User role updated to {RoleManager.get_role_display_name(new_role)}'})
         
@@ -127,6 +129,7 @@ def update_user_status(user_id):
         
         if result.matched_count == 0:
             return jsonify({'error': 'User not found'}), 404
+        invalidate_user_cache(user_id)
         
         return jsonify({'message': f'User status updated to {new_status}'})
         
@@ -162,6 +165,7 @@ def delete_user(user_id):
         
         # Delete user
         db.users.delete_one({'_id': object_id})
+        invalidate_user_cache(user_id)
         
         return jsonify({'message': 'User and associated data deleted successfully'})
         
@@ -216,6 +220,21 @@ def get_admin_stats():
     except Exception as e:
         return jsonify({'error': f'Failed to get stats: {str(e)}'}), 500
 
+@admin_bp.route('/ai-gateway/stats', methods=['GET'])
+@requireAdmin
+def get_ai_gateway_stats():
+    """Per-caller AI latency, token usage and rate-limit counters for this worker"""
+    import os
+    from ai_gateway import gateway_stats
+    return jsonify({'pid': os.getpid(), 'callers': gateway_stats()})
+
+@admin_bp.route('/db/pool-stats', methods=['GET'])
+@requireAdmin
+def get_db_pool_stats():
+    """MongoDB connection pool size, checkouts and checkout wait times for this worker"""
+    from mongodb_config import pool_stats
+    return jsonify(pool_stats())
+
 @admin_bp.route('/roles', methods=['GET'])
 @requireAdmin
 def get_role_hierarchy():
@@ -271,6 +290,8 @@ def bulk_update_users():
             {'_id': {'$in': object_ids}},
             {'$set': {update_type: new_value, 'updatedAt': datetime.utcnow()}}
         )
+        for uid in user_ids:
+            invalidate_user_cache(uid)
         
         return jsonify({
             'message': f'Updated {result.modified_count} users',
@@ -837,12 +858,14 @@ def set_user_back_button(user_id):
 
         if use_global:
             db.users.update_one({'_id': oid}, {'$unset': {'back_button_enabled': ''}})
+            invalidate_user_cache(user_id)
             return jsonify({'message': 'User back button reset to global default'})
 
         db.users.update_one(
             {'_id': oid},
             {'$set': {'back_button_enabled': enabled}}
         )
+        invalidate_user_cache(user_id)
         return jsonify({'message': 'User back button updated', 'back_button_enabled': enabled})
     except Exception as e:
         return jsonify({'error': f'Failed to update: {str(e)}'}), 500
@@ -1043,6 +1066,10 @@ def get_surveys_paginated():
                  'moustache_status': 1, 'moustache_questions': 1}
             ).sort('created_at', -1))
             funnel_total = len(all_funnels)
+            from funnel_scoring_engine import get_funnel_session_totals
+            session_totals = get_funnel_session_totals(
+                [str(f.get('funnel_id') or f.get('_id', '')) for f in all_funnels]
+            ) if all_funnels else {}
             for f in all_funnels:
                 fid = str(f.get('funnel_id') or f.get('_id', ''))
                 f['_id'] = fid
@@ -1050,7 +1077,7 @@ def get_surveys_paginated():
                 f['id'] = fid
                 f['title'] = f.get('name', 'Untitled Funnel')
                 f['source_type'] = 'funnel'
-                f['total_sessions'] = db.funnel_sessions.count_documents({'funnel_id': fid})
+                f['total_sessions'] = session_totals.get(fid, 0)
                 f['total_responses'] = 0
                 funnel_rows.append(f)
 
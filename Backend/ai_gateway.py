@@ -0,0 +1,548 @@
+"""
+AI Gateway
+Every OpenAI chat completion goes through here.
+
+    pooling      one keep-alive requests.Session per process
+    scheduling   token buckets per API key (requests and tokens per minute)
+                 and per user (requests per minute); background work leaves a
+                 reserve for interactive calls and yields to waiting ones
+    concurrency  at most AI_GATEWAY_MAX_CONCURRENCY calls in flight, of which
+                 at most AI_GATEWAY_MAX_BACKGROUND are background
+    retries      429 / 5xx / connection errors are retried with full jitter,
+                 never sooner than Retry-After; a 429 also pauses every other
+                 call on the same key until the reset
+    caching      opt-in per call (cache_ttl) through ai_response_cache
+    streaming    opt-in per call (on_delta) — reply text is handed over as it
+                 arrives; a call is not retried once any text has been handed over
+    metrics      latency, token usage and cache hits per caller tag (gateway_stats)
+
+Limits are per process; divide the account's limits by the number of workers.
+
+Config (env):
+    AI_GATEWAY_RPM                  requests per minute per key (default 500)
+    AI_GATEWAY_TPM                  tokens per minute per key (default 200000)
+    AI_GATEWAY_USER_RPM             requests per minute per user (default 30)
+    AI_GATEWAY_BACKGROUND_RESERVE   share of each bucket kept for interactive calls (0.2)
+    AI_GATEWAY_MAX_CONCURRENCY      in-flight calls (default 8)
+    AI_GATEWAY_MAX_BACKGROUND       in-flight background calls (default 4)
+    AI_GATEWAY_MAX_RETRIES          retries after the first attempt (default 4)
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.ttl_cache import TTLCache
+
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+RPM = int(os.environ.get("AI_GATEWAY_RPM", "500"))
+TPM = int(os.environ.get("AI_GATEWAY_TPM", "200000"))
+USER_RPM = int(os.environ.get("AI_GATEWAY_USER_RPM", "30"))
+BACKGROUND_RESERVE = float(os.environ.get("AI_GATEWAY_BACKGROUND_RESERVE", "0.2"))
+MAX_CONCURRENCY = int(os.environ.get("AI_GATEWAY_MAX_CONCURRENCY", "8"))
+MAX_BACKGROUND = int(os.environ.get("AI_GATEWAY_MAX_BACKGROUND", "4"))
+MAX_RETRIES = int(os.environ.get("AI_GATEWAY_MAX_RETRIES", "4"))
+
+# How long a call may wait for capacity (scheduling + retries) before giving up
+MAX_WAIT = {INTERACTIVE: 20.0, BACKGROUND: 300.0}
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AIGatewayError(Exception):
+    """The model call failed; status_code is the upstream HTTP status if there was one."""
+
+    def __init__(self, message: str, status_code: int = None, body: str = "",
+                 retry_after: float = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+    def upstream_message(self) -> str:
+        """The error message OpenAI returned, falling back to str(self)."""
+        try:
+            return json.loads(self.body).get("error", {}).get("message") or str(self)
+        except Exception:
+            return str(self)
+
+
+class AIRateLimited(AIGatewayError):
+    """No capacity within the caller's wait budget (locally or upstream)."""
+
+    def __init__(self, retry_after: float, body: str = ""):
+        super().__init__("AI rate limit reached, please retry shortly", 429, body, retry_after)
+
+
+# ─── Token buckets ───────────────────────────────────────────────────────────
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(max(per_minute, 1))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float, reserve: float = 0.0) -> float:
+        """Seconds until `amount` can be taken while leaving `reserve` of capacity."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        needed = amount + reserve * self.capacity - self.tokens
+        return 0.0 if needed <= 0 else needed / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Return (positive) or charge (negative) tokens after the real usage is known."""
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class KeyScheduler:
+    """Admission for one API key."""
+
+    def __init__(self):
+        self.requests = TokenBucket(RPM)
+        self.tokens = TokenBucket(TPM)
+        self.users = TTLCache(maxsize=4096, ttl=600)
+        self.cooldown_until = 0.0
+        self.interactive_waiting = 0
+        self.cond = threading.Condition()
+
+    def _user_bucket(self, user_key: str) -> TokenBucket:
+        bucket = self.users.get(user_key)
+        if bucket is None:
+            bucket = TokenBucket(USER_RPM)
+            self.users.set(user_key, bucket)
+        return bucket
+
+    def acquire(self, cost: int, user_key: Optional[str], priority: str, deadline: float):
+        with self.cond:
+            interactive = priority == INTERACTIVE
+            # Background calls yield to interactive ones only while those wait
+            # on the key itself, not on their own per-user bucket
+            counted = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    reserve = 0.0 if interactive else BACKGROUND_RESERVE
+                    user = self._user_bucket(user_key) if user_key else None
+                    key_wait = max(
+                        self.cooldown_until - now,
+                        self.requests.wait_time(1, now, reserve),
+                        self.tokens.wait_time(cost, now, reserve),
+                    )
+                    wait = max(key_wait, user.wait_time(1, now) if user else 0.0)
+                    if interactive and (key_wait > 0) != counted:
+                        counted = key_wait > 0
+                        self.interactive_waiting += 1 if counted else -1
+                    if not interactive and self.interactive_waiting:
+                        wait = max(wait, 0.05)
+                    if wait <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(cost)
+                        if user:
+                            user.take(1)
+                        return
+                    if now + wait > deadline:
+                        raise AIRateLimited(retry_after=wait)
+                    self.cond.wait(min(wait, 1.0))
+            finally:
+                if counted:
+                    self.interactive_waiting -= 1
+                self.cond.notify_all()
+
+    def settle(self, estimated: int, actual: int):
+        with self.cond:
+            self.tokens.adjust(estimated - actual)
+            self.cond.notify_all()
+
+    def pause(self, seconds: float):
+        with self.cond:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+
+
+_schedulers: Dict[str, KeyScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def _scheduler_for(api_key: str) -> KeyScheduler:
+    fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    with _schedulers_lock:
+        scheduler = _schedulers.get(fingerprint)
+        if scheduler is None:
+            scheduler = _schedulers[fingerprint] = KeyScheduler()
+        return scheduler
+
+
+_in_flight = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_background_in_flight = threading.BoundedSemaphore(MAX_BACKGROUND)
+
+
+# ─── Connection pool ─────────────────────────────────────────────────────────
+
+_session = None
+_session_pid = None
+
+
+def _get_session() -> requests.Session:
+    # Pools are per process; don't reuse sockets inherited across gunicorn's fork
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENCY, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _session, _session_pid = session, os.getpid()
+    return _session
+
+
+# ─── Metrics ─────────────────────────────────────────────────────────────────
+
+class _TagMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.queued_seconds = 0.0
+        self.latencies = deque(maxlen=500)
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000) if latencies else 0
+
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "queued_seconds": round(self.queued_seconds, 2),
+            "latency_ms": {"p50": pct(0.5), "p95": pct(0.95)},
+        }
+
+
+_metrics: Dict[str, _TagMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def _record(tag: str, **fields):
+    with _metrics_lock:
+        metrics = _metrics.setdefault(tag, _TagMetrics())
+        for name, value in fields.items():
+            if name == "latency":
+                metrics.latencies.append(value)
+            else:
+                setattr(metrics, name, getattr(metrics, name) + value)
+
+
+def gateway_stats() -> dict:
+    with _metrics_lock:
+        return {tag: metrics.snapshot() for tag, metrics in sorted(_metrics.items())}
+
+
+# ─── Helpers ─────────────────────────────────────────────────────────────────
+
+_DURATION_RE = re.compile(r"([\d.]+)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """'1.5', '20ms', '6m0s' → seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts) if parts else None
+
+
+def retry_after(headers, status_code: int = None) -> Optional[float]:
+    """
+    How long upstream asked us to wait. Retry-After(-ms) counts on any response;
+    OpenAI's x-ratelimit-reset-* headers only on a 429, and only for a limit
+    whose x-ratelimit-remaining-* is 0 (otherwise they just say when a
+    partly used window refills).
+    """
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    seconds = _parse_duration(headers.get("Retry-After", ""))
+    if seconds is not None or status_code != 429:
+        return seconds
+    waits = [
+        _parse_duration(headers.get(f"x-ratelimit-reset-{limit}", ""))
+        for limit in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{limit}", "").strip() == "0"
+    ]
+    waits = [w for w in waits if w is not None]
+    return max(waits) if waits else None
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def estimate_tokens(messages: List[dict], max_tokens: int) -> int:
+    """Rough prompt size (~4 chars per token) plus the completion budget."""
+    chars = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return chars // 4 + (max_tokens or 0)
+
+
+def _current_user_key() -> Optional[str]:
+    try:
+        from flask import g, has_request_context
+        if has_request_context():
+            user = getattr(g, "current_user", None)
+            if user:
+                return str(user.get("_id", ""))
+    except ImportError:
+        pass
+    return None
+
+
+def default_api_key() -> str:
+    return os.environ.get("OPENAI_API_KEY") or os.environ.get("AI_API_KEY", "")
+
+
+class _StreamBroken(Exception):
+    """The connection failed after part of a streamed reply was handed over."""
+
+
+def _read_stream(resp, on_delta: Callable[[str], None]):
+    """Consume a streamed completion; returns (content, usage)."""
+    parts = []
+    usage = {}
+    try:
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    parts.append(text)
+                    on_delta(text)
+    except requests.exceptions.RequestException as e:
+        if parts:
+            raise _StreamBroken(str(e))
+        raise
+    finally:
+        resp.close()
+    return "".join(parts), usage
+
+
+# ─── Public API ──────────────────────────────────────────────────────────────
+
+def chat_completion(
+    messages: List[dict],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.7,
+    max_tokens: int = 1024,
+    response_format: dict = None,
+    timeout: float = 30,
+    priority: str = INTERACTIVE,
+    tag: str = "default",
+    api_key: str = None,
+    user_id: str = None,
+    cache_ttl: float = None,
+    on_delta: Callable[[str], None] = None,
+) -> str:
+    """
+    Run one chat completion and return the reply text.
+
+    Args:
+        temperature: None leaves the model default
+        priority: INTERACTIVE for calls a user is waiting on, BACKGROUND otherwise
+        tag: Caller name used for metrics
+        api_key: Overrides the environment key (e.g. a user's own key)
+        user_id: Per-user bucket; defaults to g.current_user inside a request
+        cache_ttl: Serve identical requests from ai_response_cache for this
+            many seconds (opt-in; for deterministic structured prompts only)
+        on_delta: Stream the reply, calling on_delta with each piece of text
+            as it arrives; the full text is still returned
+
+    Raises:
+        AIRateLimited: No capacity within the priority's wait budget
+        AIGatewayError: Any other failure (status_code set for HTTP errors)
+    """
+    api_key = api_key or default_api_key()
+    if not api_key:
+        raise AIGatewayError("AI service not configured")
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+    }
+    if temperature is not None:
+        payload["temperature"] = temperature
+    if response_format:
+        payload["response_format"] = response_format
+
+    if cache_ttl:
+        import ai_response_cache
+        cache_key = ai_response_cache.response_key(payload)
+        cached = ai_response_cache.get(cache_key)
+        if cached is not None:
+            _record(tag, calls=1, cache_hits=1)
+            if on_delta:
+                on_delta(cached)
+            return cached
+    if on_delta:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+
+    scheduler = _scheduler_for(api_key)
+    user_key = user_id or _current_user_key()
+    estimated = estimate_tokens(messages, max_tokens)
+    started = time.monotonic()
+    deadline = started + MAX_WAIT.get(priority, MAX_WAIT[INTERACTIVE])
+    background = priority == BACKGROUND
+
+    _record(tag, calls=1)
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            scheduler.acquire(estimated, user_key, priority, deadline)
+        except AIRateLimited:
+            _record(tag, errors=1, rate_limited=1)
+            raise
+
+        remaining = max(deadline - time.monotonic(), 0.1)
+        if background and not _background_in_flight.acquire(timeout=remaining):
+            _record(tag, errors=1, rate_limited=1)
+            raise AIRateLimited(retry_after=1)
+        try:
+            if not _in_flight.acquire(timeout=remaining):
+                _record(tag, errors=1, rate_limited=1)
+                raise AIRateLimited(retry_after=1)
+            try:
+                sent = time.monotonic()
+                if attempt == 0:
+                    _record(tag, queued_seconds=sent - started)
+                resp = _get_session().post(
+                    f"{OPENAI_BASE_URL}/chat/completions",
+                    headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+                    json=payload,
+                    timeout=timeout,
+                    stream=bool(on_delta),
+                )
+                streamed = None
+                # A streamed reply is read while the call still holds its slot
+                if on_delta and resp.status_code == 200:
+                    streamed = _read_stream(resp, on_delta)
+                _record(tag, latency=time.monotonic() - sent)
+            finally:
+                _in_flight.release()
+        except _StreamBroken as e:
+            _record(tag, errors=1)
+            raise AIGatewayError(f"AI stream interrupted: {e}")
+        except requests.exceptions.RequestException as e:
+            # Timeouts are only retried for background work; a user is waiting otherwise
+            retryable = not isinstance(e, requests.exceptions.Timeout) or background
+            if retryable and attempt < MAX_RETRIES and time.monotonic() + 1 < deadline:
+                _record(tag, retries=1)
+                time.sleep(_backoff(attempt))
+                continue
+            _record(tag, errors=1)
+            raise AIGatewayError(f"AI request failed: {e}")
+        except ValueError as e:
+            # A streamed chunk that is not valid JSON
+            _record(tag, errors=1)
+            raise AIGatewayError(f"AI returned a malformed stream: {e}")
+        finally:
+            if background:
+                _background_in_flight.release()
+
+        if resp.status_code == 200:
+            if streamed is not None:
+                content, usage = streamed
+            else:
+                try:
+                    data = resp.json()
+                    usage = data.get("usage") or {}
+                    content = data["choices"][0]["message"]["content"]
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    _record(tag, errors=1)
+                    raise AIGatewayError(f"AI returned a malformed response: {e}", resp.status_code, resp.text)
+            scheduler.settle(estimated, usage.get("total_tokens", estimated))
+            _record(
+                tag,
+                prompt_tokens=usage.get("prompt_tokens", 0),
+                completion_tokens=usage.get("completion_tokens", 0),
+            )
+            if cache_ttl:
+                ai_response_cache.put(cache_key, content, cache_ttl, model=model, tag=tag)
+            return content
+
+        wait = retry_after(resp.headers, resp.status_code)
+        if resp.status_code == 429:
+            _record(tag, rate_limited=1)
+            if "insufficient_quota" in resp.text:
+                _record(tag, errors=1)
+                raise AIGatewayError("OpenAI quota exhausted", 429, resp.text)
+            # Everyone on this key backs off, not just this call
+            scheduler.pause(wait if wait is not None else _backoff(attempt))
+
+        if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            delay = max(wait or 0.0, _backoff(attempt))
+            if time.monotonic() + delay < deadline:
+                _record(tag, retries=1)
+                print(f"⚠️ [AIGateway] {tag}: {resp.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+        _record(tag, errors=1)
+        if resp.status_code == 429:
+            raise AIRateLimited(retry_after=wait or 1, body=resp.text)
+        raise AIGatewayError(
+            f"AI API error {resp.status_code}: {resp.text[:200]}", resp.status_code, resp.text, wait
+        )
+
+    _record(tag, errors=1)
+    raise AIGatewayError("AI request failed after retries")
+
+
+def complete(prompt: str, **kwargs) -> str:
+    """chat_completion for a single user message."""
+    return chat_completion([{"role": "user", "content": prompt}], **kwargs)
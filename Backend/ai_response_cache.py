@@ -0,0 +1,88 @@
+"""
+AI Response Cache
+Content-addressed cache for deterministic, structured chat completions.
+
+The key is a hash of everything sent to the model (model, messages,
+temperature, max_tokens, response_format), so an identical request returns
+the stored reply without an API call. Only the reply text is stored, never
+the prompt. Entries are served from an in-process LRU first and from the
+`ai_response_cache` collection second, and expire after the TTL the call site
+asked for.
+
+Caching is opt-in per call: pass cache_ttl to ai_gateway.chat_completion. It
+suits low-temperature extractions (branching rules, titles, funnel detection),
+not creative generations where a retry is meant to give a different answer.
+
+Config (env):
+    AI_RESPONSE_CACHE_ENTRIES     in-process entries (default 1024)
+    AI_RESPONSE_CACHE_MAX_BYTES   larger replies are not cached (default 64 KB)
+    AI_RESPONSE_CACHE_TTL_SECONDS TTL used by the structured call sites (default 1 day)
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+from mongodb_config import db
+from utils.ttl_cache import TTLCache
+
+MAX_ENTRY_BYTES = int(os.environ.get("AI_RESPONSE_CACHE_MAX_BYTES", str(64 * 1024)))
+# Upper bound on any call site's TTL
+MAX_TTL_SECONDS = 30 * 24 * 3600
+# TTL the structured-extraction call sites opt in with
+STRUCTURED_TTL_SECONDS = int(os.environ.get("AI_RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+_front = TTLCache(maxsize=int(os.environ.get("AI_RESPONSE_CACHE_ENTRIES", "1024")))
+
+
+def response_key(payload: dict) -> str:
+    raw = json.dumps(
+        [payload.get(k) for k in ("model", "messages", "temperature", "max_tokens", "response_format")],
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    content = _front.get(key)
+    if content is not None:
+        return content
+    try:
+        entry = db.ai_response_cache.find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.utcnow()}}, {"content": 1, "expires_at": 1}
+        )
+    except Exception as e:
+        print(f"⚠️ AI response cache read failed: {e}")
+        return None
+    if not entry:
+        return None
+    remaining = (entry["expires_at"] - datetime.utcnow()).total_seconds()
+    _front.set(key, entry["content"], ttl=max(remaining, 1))
+    return entry["content"]
+
+
+def put(key: str, content: str, ttl: float, model: str = None, tag: str = None):
+    if not content or len(content.encode("utf-8")) > MAX_ENTRY_BYTES:
+        return
+    ttl = min(ttl, MAX_TTL_SECONDS)
+    _front.set(key, content, ttl=ttl)
+    now = datetime.utcnow()
+    try:
+        db.ai_response_cache.replace_one(
+            {"_id": key},
+            {
+                "_id": key,
+                "content": content,
+                "model": model,
+                "tag": tag,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=ttl),
+            },
+            upsert=True
+        )
+    except Exception as e:
+        print(f"⚠️ AI response cache write failed: {e}")
+
+
+def cache_stats() -> dict:
+    return _front.stats()
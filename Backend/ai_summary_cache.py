@@ -0,0 +1,153 @@
+"""
+AI Summary Cache
+Content-addressed cache for analytics AI summaries and careful/rushed insights.
+
+An entry is keyed by a hash of everything that shapes the model output:
+(kind, question text, answer distribution, tier, model, prompt version). Hits
+are served from an in-process LRU first and from the `ai_summary_cache`
+collection second, so reopening a dashboard with no new responses never calls
+the model.
+
+With a drift tolerance (max_drift_pct > 0) a result generated for an older
+distribution of the same question is reused as long as the answer shares have
+not moved more than that many percentage points (total variation distance).
+"""
+import hashlib
+import json
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+from mongodb_config import db
+from utils.ttl_cache import TTLCache
+
+# Entries live in Mongo for this long after they were last generated
+CACHE_RETENTION_SECONDS = 30 * 24 * 3600
+
+_front = TTLCache(maxsize=512, ttl=3600)
+
+# A distribution is {group: {answer: count}}; summaries use a single group
+Distribution = Dict[str, Dict[str, int]]
+
+
+def _digest(payload) -> str:
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _label_hash(label) -> str:
+    return hashlib.sha256(str(label).encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(distribution: Distribution) -> Distribution:
+    """Drop empty answers and hash labels so free-text answers are not stored."""
+    return {
+        group: {_label_hash(k): int(v or 0) for k, v in (counts or {}).items() if v}
+        for group, counts in distribution.items()
+    }
+
+
+def question_key(kind: str, question_text: str, tier: str, model: str, prompt_version: int) -> str:
+    """Identifies the prompt independent of the answers it is filled with."""
+    return _digest([kind, question_text, tier, model, prompt_version])
+
+
+def cache_key(q_key: str, distribution: Distribution) -> str:
+    """Key for a prompt filled with a normalized distribution."""
+    return _digest([q_key, distribution])
+
+
+def distribution_drift(old: Distribution, new: Distribution) -> float:
+    """Largest total variation distance between matching groups, in percentage points."""
+    drift = 0.0
+    for group in set(old) | set(new):
+        a, b = old.get(group) or {}, new.get(group) or {}
+        total_a, total_b = sum(a.values()), sum(b.values())
+        if not total_a or not total_b:
+            if total_a != total_b:
+                return 100.0
+            continue
+        tvd = sum(abs(a.get(k, 0) / total_a - b.get(k, 0) / total_b) for k in set(a) | set(b)) / 2
+        drift = max(drift, tvd * 100)
+    return drift
+
+
+def _lookup(survey_id: str, q_key: str, key: str, distribution: Distribution,
+            max_drift_pct: float) -> Tuple[Optional[dict], Optional[float]]:
+    entry = _front.get(key)
+    if entry is not None:
+        return entry, 0.0
+
+    entry = db.ai_summary_cache.find_one({"_id": key}, {"result": 1})
+    if entry:
+        _front.set(key, entry["result"])
+        return entry["result"], 0.0
+
+    if max_drift_pct and max_drift_pct > 0:
+        latest = db.ai_summary_cache.find_one(
+            {"survey_id": survey_id, "question_key": q_key},
+            {"result": 1, "distribution": 1},
+            sort=[("created_at", -1)]
+        )
+        if latest:
+            drift = distribution_drift(latest.get("distribution") or {}, distribution)
+            if drift <= max_drift_pct:
+                _front.set(key, latest["result"])
+                return latest["result"], round(drift, 2)
+    return None, None
+
+
+def cached_ai_result(kind: str, survey_id: str, question_text: str, distribution: Distribution,
+                     tier: str, model: str, prompt_version: int,
+                     generate: Callable[[], Optional[dict]],
+                     max_drift_pct: float = 0, refresh: bool = False) -> Tuple[Optional[dict], dict]:
+    """
+    Return a cached AI result or generate and store a new one.
+
+    Args:
+        kind: "summary" or "insights"
+        generate: Calls the model; returns the result dict, or None when it
+            fell back to a non-AI answer (those are not cached)
+        max_drift_pct: Reuse a result for an older distribution of the same
+            question if the answers moved at most this many points
+        refresh: Skip lookups and regenerate
+
+    Returns:
+        (result, cache_info) where cache_info has 'cached' and 'drift_pct'
+    """
+    distribution = _normalize(distribution)
+    q_key = question_key(kind, question_text, tier, model, prompt_version)
+    key = cache_key(q_key, distribution)
+
+    if not refresh:
+        result, drift = _lookup(survey_id, q_key, key, distribution, max_drift_pct)
+        if result is not None:
+            return result, {"cached": True, "drift_pct": drift}
+
+    result = generate()
+    if result is None:
+        return None, {"cached": False, "drift_pct": None}
+
+    _front.set(key, result)
+    try:
+        db.ai_summary_cache.replace_one(
+            {"_id": key},
+            {
+                "_id": key,
+                "survey_id": survey_id,
+                "question_key": q_key,
+                "kind": kind,
+                "tier": tier,
+                "model": model,
+                "prompt_version": prompt_version,
+                "distribution": distribution,
+                "result": result,
+                "created_at": datetime.utcnow(),
+            },
+            upsert=True
+        )
+    except Exception as e:
+        print(f"⚠️ AI summary cache write failed: {e}")
+    return result, {"cached": False, "drift_pct": None}
+
+
+def cache_stats() -> dict:
+    return _front.stats()
@@ -9,6 +9,10 @@ from datetime import datetime, timezone
 from pii_stripper import strip_pii_from_answers, strip_pii_from_prompt
 from mongodb_config import db
 from auth_middleware import requireAuth
+from segment_analytics import run_segment_query
+from ai_summary_cache import cached_ai_result
+from ai_gateway import complete, default_api_key, AIGatewayError
+from utils.user_agent import classify, classify_many
 import os
 import requests as http_requests
 import json
@@ -18,6 +22,13 @@ analytics_bp = Blueprint('analytics', __name__)
 # Fixed threshold: < 3 seconds per question = rushed
 RUSHED_THRESHOLD_SECONDS = 3.0
 
+AI_SUMMARY_MODEL = "gpt-3.5-turbo"
+# Bump when a prompt below changes so cached results are regenerated
+SUMMARY_PROMPT_VERSION = 1
+INSIGHTS_PROMPT_VERSION = 1
+# Reuse a cached summary while answer shares moved at most this many points
+DEFAULT_MAX_DRIFT_PCT = float(os.environ.get("AI_SUMMARY_MAX_DRIFT_PCT", "0"))
+
 
 def get_user_surveys(user_id):
     """Get all surveys owned by a user"""
@@ -77,18 +88,30 @@ def calculate_survey_stats(survey_id):
     }
 
 
+def get_question_metadata(survey):
+    """Normalised id/text/type/options for each question in a survey"""
+    metadata = []
+    for q_index, question in enumerate(survey.get("questions", [])):
+        metadata.append({
+            "question_id": question.get("id", f"q{q_index}"),
+            "question_text": question.get("question", f"Question {q_index + 1}"),
+            "question_type": question.get("type", "text"),
+            "options": question.get("options", []),
+        })
+    return metadata
+
+
 def get_question_breakdown(survey_id, survey):
     """Get per-question answer distribution and timing stats"""
     responses = list(db.responses.find({"survey_id": survey_id}))
-    questions = survey.get("questions", [])
     
     breakdown = []
     
-    for q_index, question in enumerate(questions):
-        q_id = question.get("id", f"q{q_index}")
-        q_text = question.get("question", f"Question {q_index + 1}")
-        q_type = question.get("type", "text")
-        q_options = question.get("options", [])
+    for meta in get_question_metadata(survey):
+        q_id = meta["question_id"]
+        q_text = meta["question_text"]
+        q_type = meta["question_type"]
+        q_options = meta["options"]
         
         # Collect answers and timings for this question
         answer_counts = {}
@@ -185,8 +208,9 @@ def get_individual_responses(survey_id, survey):
     questions = survey.get("questions", [])
     
     individual = []
+    devices = classify_many(r.get("user_info", {}).get("user_agent", "") for r in responses)
     
-    for resp in responses:
+    for resp, ua_info in zip(responses, devices):
         user_info = resp.get("user_info", {})
         question_timings = resp.get("question_timings", {})
         resp_answers = resp.get("responses", {})
@@ -224,7 +248,7 @@ def get_individual_responses(survey_id, survey):
             "submitted_at": resp.get("submitted_at", "").isoformat() if isinstance(resp.get("submitted_at"), datetime) else str(resp.get("submitted_at", "")),
             "ip_address": user_info.get("ip_address", ""),
             "user_agent": user_info.get("user_agent", ""),
-            "device": detect_device(user_info.get("user_agent", "")),
+            "device": ua_info.device.value.capitalize(),
             "location": resp.get("location") or user_info.get("location", "") or get_location_from_ip(user_info.get("ip_address", "")),
             "total_time": total_time,
             "avg_time_per_question": avg_time_per_q,
@@ -237,12 +261,7 @@ def get_individual_responses(survey_id, survey):
 
 def detect_device(user_agent):
     """Simple device detection from user agent"""
-    ua = user_agent.lower()
-    if "mobile" in ua or "android" in ua or "iphone" in ua:
-        return "Mobile"
-    elif "tablet" in ua or "ipad" in ua:
-        return "Tablet"
-    return "Desktop"
+    return classify(user_agent).device.value.capitalize()
 
 
 def get_location_from_ip(ip_address):
@@ -263,13 +282,29 @@ def get_location_from_ip(ip_address):
     return ""
 
 
-def generate_ai_summary(question_text, answer_distribution, tier="free"):
-    """Generate AI summary for a question's responses"""
+def _chat_completion(prompt, max_tokens):
+    """Call the chat model; returns the reply text or None if unavailable"""
+    if not default_api_key():
+        return None
+    
+    try:
+        content = complete(
+            prompt,
+            model=AI_SUMMARY_MODEL,
+            max_tokens=max_tokens,
+            temperature=0.7,
+            timeout=10,
+            tag="analytics.summary",
+        )
+    except AIGatewayError as e:
+        print(f"⚠️ AI summary request failed: {e}")
+        return None
+    return content.strip()
+
+
+def request_ai_summary(question_text, answer_distribution, tier="free"):
+    """Ask the model for a question summary; None if it could not answer"""
     try:
-        api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("AI_API_KEY")
-        if not api_key:
-            return generate_fallback_summary(question_text, answer_distribution)
-        
         # Build prompt based on tier
         answers_text = "\n".join([
             f"- {strip_pii_from_answers(item['answer'])}: {item['percentage']}% ({item['count']} responses)"
@@ -291,29 +326,16 @@ Top answers: {answers_text}
 
 Two sentences max:"""
         
-        response = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 50,
-                "temperature": 0.7
-            },
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data["choices"][0]["message"]["content"].strip()
-        else:
-            return generate_fallback_summary(question_text, answer_distribution)
+        return _chat_completion(prompt, 50)
     except Exception as e:
         print(f"AI Summary error: {e}")
-        return generate_fallback_summary(question_text, answer_distribution)
+        return None
+
+
+def generate_ai_summary(question_text, answer_distribution, tier="free"):
+    """Generate AI summary for a question's responses"""
+    return (request_ai_summary(question_text, answer_distribution, tier)
+            or generate_fallback_summary(question_text, answer_distribution))
 
 
 def generate_fallback_summary(question_text, answer_distribution):
@@ -328,16 +350,15 @@ def generate_fallback_summary(question_text, answer_distribution):
     return f"{top['answer']} — {top['percentage']}% of responses."
 
 
-def generate_careful_rushed_insights(question_text, careful_answers, rushed_answers):
-    """Generate AI insights for careful vs rushed respondents"""
+FALLBACK_INSIGHTS = {
+    "careful_insight": "Careful respondents show more thoughtful, varied answers.",
+    "rushed_insight": "Rushed respondents tend to pick familiar, top-of-mind options."
+}
+
+
+def request_careful_rushed_insights(question_text, careful_answers, rushed_answers):
+    """Ask the model to compare careful vs rushed respondents; None if it could not answer"""
     try:
-        api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("AI_API_KEY")
-        if not api_key:
-            return {
-                "careful_insight": "Careful respondents show more thoughtful, varied answers.",
-                "rushed_insight": "Rushed respondents tend to pick familiar, top-of-mind options."
-            }
-        
         careful_text = "\n".join([f"- {strip_pii_from_answers(k)}: {v}" for k, v in list(careful_answers.items())[:5]])
         rushed_text = "\n".join([f"- {strip_pii_from_answers(k)}: {v}" for k, v in list(rushed_answers.items())[:5]])
         
@@ -355,50 +376,33 @@ Provide two separate insights:
 1. CAREFUL: One sentence about what careful respondents prefer and why.
 2. RUSHED: One sentence about what rushed respondents prefer and why."""
         
-        response = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 200,
-                "temperature": 0.7
-            },
-            timeout=10
-        )
+        content = _chat_completion(prompt, 200)
+        if not content:
+            return None
         
-        if response.status_code == 200:
-            data = response.json()
-            content = data["choices"][0]["message"]["content"].strip()
-            
-            # Try to split into careful/rushed
-            lines = content.split("\n")
-            careful_insight = ""
-            rushed_insight = ""
-            for line in lines:
-                if "careful" in line.lower() or "1." in line:
-                    careful_insight = line.replace("1.", "").replace("CAREFUL:", "").strip()
-                elif "rushed" in line.lower() or "2." in line:
-                    rushed_insight = line.replace("2.", "").replace("RUSHED:", "").strip()
-            
-            return {
-                "careful_insight": careful_insight or content[:len(content)//2],
-                "rushed_insight": rushed_insight or content[len(content)//2:]
-            }
+        # Try to split into careful/rushed
+        lines = content.split("\n")
+        careful_insight = ""
+        rushed_insight = ""
+        for line in lines:
+            if "careful" in line.lower() or "1." in line:
+                careful_insight = line.replace("1.", "").replace("CAREFUL:", "").strip()
+            elif "rushed" in line.lower() or "2." in line:
+                rushed_insight = line.replace("2.", "").replace("RUSHED:", "").strip()
         
         return {
-            "careful_insight": "Careful respondents show more thoughtful, varied answers.",
-            "rushed_insight": "Rushed respondents tend to pick familiar, top-of-mind options."
+            "careful_insight": careful_insight or content[:len(content)//2],
+            "rushed_insight": rushed_insight or content[len(content)//2:]
         }
     except Exception as e:
         print(f"AI Insight error: {e}")
-        return {
-            "careful_insight": "Careful respondents show more thoughtful, varied answers.",
-            "rushed_insight": "Rushed respondents tend to pick familiar, top-of-mind options."
-        }
+        return None
+
+
+def generate_careful_rushed_insights(question_text, careful_answers, rushed_answers):
+    """Generate AI insights for careful vs rushed respondents"""
+    return (request_careful_rushed_insights(question_text, careful_answers, rushed_answers)
+            or dict(FALLBACK_INSIGHTS))
 
 
 # ============ API ROUTES ============
@@ -530,14 +534,31 @@ def get_survey_individual_responses(survey_id):
 def get_ai_summary(survey_id):
     """Generate AI summary for a question"""
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         question_text = data.get("question_text", "")
         answer_distribution = data.get("answer_distribution", [])
         tier = data.get("tier", "free")
+        try:
+            max_drift_pct = float(data.get("max_drift_pct", DEFAULT_MAX_DRIFT_PCT) or 0)
+        except (TypeError, ValueError):
+            max_drift_pct = None
+        if max_drift_pct is None or not 0 <= max_drift_pct <= 100:
+            return jsonify({"error": "max_drift_pct must be a number between 0 and 100"}), 400
+        refresh = bool(data.get("refresh", False))
+        
+        def _summary():
+            text = request_ai_summary(question_text, answer_distribution, tier)
+            return {"summary": text} if text else None
+        
+        cached, cache_info = cached_ai_result(
+            "summary", survey_id, question_text,
+            {"answers": {item.get("answer"): item.get("count", 0) for item in answer_distribution}},
+            tier, AI_SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, _summary,
+            max_drift_pct=max_drift_pct, refresh=refresh
+        )
+        summary = cached["summary"] if cached else generate_fallback_summary(question_text, answer_distribution)
         
-        summary = generate_ai_summary(question_text, answer_distribution, tier)
-        
-        result = {"summary": summary}
+        result = {"summary": summary, "cache": cache_info}
         
         # For premium+ tiers, also generate careful/rushed insights
         if tier in ["premium", "enterprise"]:
@@ -545,9 +566,14 @@ def get_ai_summary(survey_id):
             rushed_answers = data.get("rushed_answers", {})
             
             if careful_answers or rushed_answers:
-                insights = generate_careful_rushed_insights(
-                    question_text, careful_answers, rushed_answers
+                insights, _ = cached_ai_result(
+                    "insights", survey_id, question_text,
+                    {"careful": careful_answers, "rushed": rushed_answers},
+                    tier, AI_SUMMARY_MODEL, INSIGHTS_PROMPT_VERSION,
+                    lambda: request_careful_rushed_insights(question_text, careful_answers, rushed_answers),
+                    max_drift_pct=max_drift_pct, refresh=refresh
                 )
+                insights = insights or FALLBACK_INSIGHTS
                 result["careful_insight"] = insights["careful_insight"]
                 result["rushed_insight"] = insights["rushed_insight"]
         
@@ -555,3 +581,36 @@ def get_ai_summary(survey_id):
     except Exception as e:
         print(f"Error generating AI summary: {e}")
         return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route('/api/analytics/survey/<survey_id>/query', methods=['POST'])
+@requireAuth
+def query_survey_segments(survey_id):
+    """
+    Cross-tab and segment-filter query over a survey's responses.
+
+    Body:
+        filters: filter spec, e.g. [{"field": "q2", "op": "in", "values": ["X"]},
+                 {"field": "device", "op": "eq", "value": "Mobile"}]
+        distributions: fields to return answer distributions for within the segment
+        crosstab: {"rows": "q2", "columns": "q5"}
+    """
+    try:
+        survey = db.surveys.find_one({
+            "$or": [
+                {"short_id": survey_id},
+                {"_id": survey_id},
+                {"id": survey_id}
+            ]
+        })
+        
+        if not survey:
+            return jsonify({"error": "Survey not found"}), 404
+        
+        result = run_segment_query(survey_id, survey, request.get_json() or {})
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error running segment query: {e}")
+        return jsonify({"error": str(e)}), 500
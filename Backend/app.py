@@ -2,6 +2,7 @@ from flask import Flask, request, jsonify, redirect, send_from_directory
 
 import uuid
 from link_masking import link_handler
+from link_proxy import proxy_link, ProxyTooLarge
 
 
 from flask_cors import CORS, cross_origin
@@ -66,7 +67,12 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
-from utils.short_id import generate_short_id, is_valid_short_id
+from utils.short_id import is_valid_short_id
+from id_allocator import id_allocator
+from ai_gateway import chat_completion, complete, AIGatewayError
+from ai_response_cache import STRUCTURED_TTL_SECONDS
+import generation_stream
+from utils.sse import wants_event_stream
 
 
 from auth_middleware import requireAuth
@@ -341,8 +347,8 @@ else:
     print("⚠️ WARNING: OPENAI_API_KEY not set! Survey generation will fail.")
 
 
-def generate_ai_content(prompt_text, temperature=0.7, max_tokens=1024):
-    """Generate content using OpenAI API"""
+def generate_ai_content(prompt_text, temperature=0.7, max_tokens=1024, cache_ttl=None, on_delta=None):
+    """Generate content using OpenAI API (cache_ttl opts into the AI response cache, on_delta streams the reply)"""
 
     if not OPENAI_API_KEY:
 
@@ -350,48 +356,39 @@ def generate_ai_content(prompt_text, temperature=0.7, max_tokens=1024):
             "OpenAI API key is not configured. Set OPENAI_API_KEY in environment variables."
         )
 
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [{"role": "user", "content": strip_pii_from_prompt(prompt_text)}],
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-    }
-
-    resp = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers=headers,
-        json=payload,
-        timeout=60,
-    )
-
-    if resp.status_code == 401:
+    try:
 
-        raise ValueError(
-            "OpenAI API key is invalid or expired. Please update your OPENAI_API_KEY."
+        return complete(
+            strip_pii_from_prompt(prompt_text),
+            model="gpt-4o-mini",
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=60,
+            api_key=OPENAI_API_KEY,
+            tag="survey.generate",
+            cache_ttl=cache_ttl,
+            on_delta=on_delta,
         )
 
-    if resp.status_code == 402 or resp.status_code == 400:
+    except AIGatewayError as e:
 
-        error_msg = resp.json().get("error", {}).get("message", "Unknown error")
+        if e.status_code == 401:
 
-        raise ValueError(f"OpenAI API error: {error_msg}")
+            raise ValueError(
+                "OpenAI API key is invalid or expired. Please update your OPENAI_API_KEY."
+            )
 
-    if resp.status_code == 429:
+        if e.status_code == 402 or e.status_code == 400:
 
-        raise ValueError(
-            "OpenAI API rate limit reached. Please try again in a few minutes."
-        )
+            raise ValueError(f"OpenAI API error: {e.upstream_message()}")
 
-    resp.raise_for_status()
+        if e.status_code == 429:
 
-    data = resp.json()
+            raise ValueError(
+                "OpenAI API rate limit reached. Please try again in a few minutes."
+            )
 
-    return data["choices"][0]["message"]["content"]
+        raise
 
 
 print("✅ OpenAI API configured successfully")
@@ -430,13 +427,13 @@ try:
     from email_trigger_api import email_trigger_bp
     from session_insights_api import session_insights_bp
     from analytics_api import analytics_bp
-    from user_tracking_api import user_tracking_bp, setup_tracking_indexes
+    from user_tracking_api import user_tracking_bp
     from redirect_rules_api import redirect_rules_bp
-    from referral_api import referral_bp, setup_referral_indexes
+    from referral_api import referral_bp
     from branch_flow_api import branch_flow_bp, parse_branching_instructions_from_prompt, apply_prompt_branching_rules
     from funnel_api import funnel_bp
     from survey_invite_api import survey_invite_bp
-    from survey_sharing_api import survey_sharing_bp, setup_sharing_indexes
+    from survey_sharing_api import survey_sharing_bp
     from location_control_api import location_bp    # Location control admin API
     from plan_features_api import plan_features_bp  # Plan features config API
     from resubmit_control_api import resubmit_bp   # Survey resubmit policy API
@@ -482,10 +479,12 @@ try:
     app.register_blueprint(location_bp)          # Location control at /api/admin/location
     app.register_blueprint(resubmit_bp)          # Resubmit policy at /api/admin/resubmit
 
-    # Setup tracking TTL indexes for 15-day auto-delete
-    setup_tracking_indexes()
-    setup_referral_indexes()
-    setup_sharing_indexes()
+    # Log any registered index that is missing; the release step creates them (see index_registry.py)
+    from index_registry import warn_missing_indexes
+    warn_missing_indexes()
+    # Under --preload this ran in the gunicorn master; workers open their own client
+    from mongodb_config import close_client
+    close_client()
 
     print("✅ All blueprints registered successfully")
 
@@ -1026,20 +1025,13 @@ def parse_image():
 
         # Use OpenAI with vision model to extract text from image
 
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json",
-        }
-
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Look at this image of a survey/questionnaire. Extract EVERY question with its answer options.
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": """Look at this image of a survey/questionnaire. Extract EVERY question with its answer options.
 
 Return ONLY a JSON array (no markdown, no backticks). Each item:
 {"question": "exact question text", "type": "multiple_choice or short_answer or yes_no or rating", "options": ["option1", "option2", ...]}
@@ -1053,26 +1045,21 @@ Rules:
 - Include EVERY option exactly as written in the image
 
 Return valid JSON only.""",
-                        },
-                        {"type": "image_url", "image_url": {"url": image_data}},
-                    ],
-                }
-            ],
-            "max_tokens": 4096,
-        }
+                    },
+                    {"type": "image_url", "image_url": {"url": image_data}},
+                ],
+            }
+        ]
 
-        resp = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
+        extracted_text = chat_completion(
+            messages,
+            model="gpt-4o-mini",
+            temperature=None,
+            max_tokens=4096,
             timeout=60,
+            api_key=OPENAI_API_KEY,
+            tag="survey.parse_image",
         )
-
-        resp.raise_for_status()
-
-        result = resp.json()
-
-        extracted_text = result["choices"][0]["message"]["content"]
         
         # Try to parse as JSON for structured extraction
         structured_questions = None
@@ -1178,6 +1165,72 @@ def get_ml_insights():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _normalize_ai_question(q, i):
+    """Map one question from the smart builder's JSON reply to the stored question shape."""
+    raw_type = q.get("type", "short_answer")
+    allow_multiple = q.get("allowMultiple", False)
+
+    # Normalize new types to existing storage types
+    if raw_type == "multi_select":
+        normalized_type = "multiple_choice"
+        allow_multiple = True
+    elif raw_type == "likert":
+        normalized_type = "multiple_choice"
+    elif raw_type == "ranking":
+        normalized_type = "multiple_choice"
+    elif raw_type == "dropdown":
+        normalized_type = "dropdown"  # keep as-is, frontend handles it
+    elif raw_type == "numeric":
+        normalized_type = "short_answer"
+    else:
+        normalized_type = raw_type
+
+    return {
+        "id": q.get("id", f"q{i+1}"),
+        "question": q.get("text", ""),
+        "type": normalized_type,
+        "rawType": raw_type,  # preserve original for frontend rendering
+        "options": q.get("options", []),
+        "required": q.get("required", True),
+        "show_if": _normalize_show_if(q.get("show_if")),
+        "questionDescription": q.get("questionDescription") or None,
+        "allowMultiple": allow_multiple,
+        "numericMin": q.get("min"),
+        "numericMax": q.get("max"),
+    }
+
+
+def _fill_default_options(q):
+    """Give choice questions the model left without options a default set."""
+    qtype = q.get("type", "")
+    raw_type = q.get("rawType", qtype)
+    if qtype == "yes_no" and not q.get("options"):
+        q["options"] = ["Yes", "No"]
+    if qtype == "multiple_choice" and not q.get("options"):
+        if raw_type == "likert":
+            q["options"] = ["Strongly Agree", "Agree", "Neutral", "Disagree", "Strongly Disagree"]
+        else:
+            q["options"] = ["Option A", "Option B", "Option C", "Option D"]
+    if qtype == "dropdown" and not q.get("options"):
+        q["options"] = ["Option 1", "Option 2", "Option 3", "Option 4", "Option 5"]
+    return q
+
+
+# Streaming mode previews (see generation_stream)
+
+def _parse_streamed_json_question(item, i):
+    question = _normalize_ai_question(item, i)
+    return _fill_default_options(question) if question["question"] else None
+
+
+def _parse_streamed_text_question(block, i):
+    parsed = parse_survey_response(block)
+    if not parsed:
+        return None
+    parsed[0]["id"] = f"q{i + 1}"
+    return _fill_default_options(parsed[0])
+
+
 @app.route("/generate", methods=["POST", "OPTIONS"])
 @cross_origin(supports_credentials=True, origins="*")
 def generate_survey():
@@ -1186,6 +1239,11 @@ def generate_survey():
 
         return "", 200
 
+    # Streaming mode: run this same handler on a thread and relay its progress as SSE
+    if wants_event_stream() and generation_stream.current() is None:
+
+        return generation_stream.stream_view(generate_survey)
+
     # Optional auth: try to authenticate user but don't fail if not present
     auth_header = request.headers.get("Authorization")
     print(f"DEBUG: Auth header present: {bool(auth_header)}, value: {auth_header[:30] if auth_header else 'None'}")
@@ -2032,23 +2090,37 @@ def generate_survey():
 
         last_error = None
 
+        stream = generation_stream.current()
+
         for attempt in range(max_retries):
 
             try:
 
                 print(f"Attempt {attempt + 1} for template: {template_type}")
 
+                if stream:
+                    stream.begin_attempt(
+                        attempt + 1,
+                        json_mode=use_smart_builder,
+                        parse=_parse_streamed_json_question if use_smart_builder else _parse_streamed_text_question,
+                    )
+
                 # Generate content via OpenAI
                 if use_smart_builder:
                     # Smart builder uses JSON output, higher token limit
                     raw_response = generate_ai_content(
-                        ai_prompt, temperature=0.7, max_tokens=4096
+                        ai_prompt, temperature=0.7, max_tokens=4096,
+                        on_delta=stream.delta if stream else None
                     )
                 else:
                     raw_response = generate_ai_content(
-                        ai_prompt, temperature=0.7, max_tokens=1024
+                        ai_prompt, temperature=0.7, max_tokens=1024,
+                        on_delta=stream.delta if stream else None
                     )
 
+                if stream:
+                    stream.end_attempt()
+
                 if not raw_response:
 
                     raise ValueError("Empty response from AI model")
@@ -2081,37 +2153,7 @@ def generate_survey():
                         if isinstance(parsed_json, list):
                             questions = []
                             for i, q in enumerate(parsed_json):
-                                raw_type = q.get("type", "short_answer")
-                                allow_multiple = q.get("allowMultiple", False)
-
-                                # Normalize new types to existing storage types
-                                if raw_type == "multi_select":
-                                    normalized_type = "multiple_choice"
-                                    allow_multiple = True
-                                elif raw_type == "likert":
-                                    normalized_type = "multiple_choice"
-                                elif raw_type == "ranking":
-                                    normalized_type = "multiple_choice"
-                                elif raw_type == "dropdown":
-                                    normalized_type = "dropdown"  # keep as-is, frontend handles it
-                                elif raw_type == "numeric":
-                                    normalized_type = "short_answer"
-                                else:
-                                    normalized_type = raw_type
-
-                                question_obj = {
-                                    "id": q.get("id", f"q{i+1}"),
-                                    "question": q.get("text", ""),
-                                    "type": normalized_type,
-                                    "rawType": raw_type,  # preserve original for frontend rendering
-                                    "options": q.get("options", []),
-                                    "required": q.get("required", True),
-                                    "show_if": _normalize_show_if(q.get("show_if")),
-                                    "questionDescription": q.get("questionDescription") or None,
-                                    "allowMultiple": allow_multiple,
-                                    "numericMin": q.get("min"),
-                                    "numericMax": q.get("max"),
-                                }
+                                question_obj = _normalize_ai_question(q, i)
                                 if question_obj["question"]:
                                     questions.append(question_obj)
                             # Store the AI-suggested title for later use if available
@@ -2131,17 +2173,7 @@ def generate_survey():
 
                 # Post-process: ensure yes_no questions have options
                 for q in questions:
-                    qtype = q.get("type", "")
-                    raw_type = q.get("rawType", qtype)
-                    if qtype == "yes_no" and not q.get("options"):
-                        q["options"] = ["Yes", "No"]
-                    if qtype == "multiple_choice" and not q.get("options"):
-                        if raw_type == "likert":
-                            q["options"] = ["Strongly Agree", "Agree", "Neutral", "Disagree", "Strongly Disagree"]
-                        else:
-                            q["options"] = ["Option A", "Option B", "Option C", "Option D"]
-                    if qtype == "dropdown" and not q.get("options"):
-                        q["options"] = ["Option 1", "Option 2", "Option 3", "Option 4", "Option 5"]
+                    _fill_default_options(q)
 
                 if len(questions) >= max(3, question_count // 2):
 
@@ -2271,23 +2303,6 @@ def generate_survey():
 
             print(f"DEBUG: About to create survey with db object: {db}")
 
-            # Generate a short ID (5 characters) for the survey
-
-            while True:
-
-                short_id = generate_short_id(5)
-                
-
-                # Check if this ID already exists
-
-                if not db.surveys.find_one(
-                    {"$or": [{"_id": short_id}, {"id": short_id}]}
-                ):
-
-                    break
-            
-            survey_id = short_id
-
             # Get authenticated user if available, otherwise create temporary user
             current_user = getattr(g, "current_user", None)
 
@@ -2325,7 +2340,7 @@ def generate_survey():
                 import uuid
                 temp_user_id = str(uuid.uuid4())
                 simple_user_id = 0
-                username = f"temp_{short_id[:5]}"
+                username = f"temp_{temp_user_id[:5]}"
                 user_id_str = temp_user_id
                 creator_email = ""
                 creator_name = "Temporary User"
@@ -2349,14 +2364,14 @@ def generate_survey():
             else:
                 title_prompt = f"Summarize this survey topic into a short title of maximum 5-7 words. Only return the title, nothing else: {prompt}"
                 try:
-                    survey_title = generate_ai_content(title_prompt, temperature=0.3, max_tokens=20)
+                    survey_title = generate_ai_content(
+                        title_prompt, temperature=0.3, max_tokens=20, cache_ttl=STRUCTURED_TTL_SECONDS
+                    )
                     survey_title = survey_title.strip().strip('"').strip("'")
                 except:
                     survey_title = " ".join(prompt.split()[:6])  # fallback if AI fails
 
             survey_data = {
-                "_id": survey_id,
-                "id": survey_id,
                 "title": survey_title,
                 "subtitle": "",
                 "prompt": prompt,
@@ -2365,16 +2380,9 @@ def generate_survey():
                 "questions": questions,
                 "theme": complete_theme,
                 "created_at": datetime.utcnow(),
-                "shareable_link": f"{FRONTEND_URL}/survey?offer_id={survey_id}&user_id={simple_user_id}&sub1={username}",
-                "public_link": f"{FRONTEND_URL}/survey?offer_id={survey_id}&user_id={simple_user_id}&sub1={username}",
                 "is_short_id": True,  # Mark that this survey uses a short ID
             }
 
-            print(
-                f"DEBUG: Generated links with user_id={simple_user_id} and sub1={username}"
-            )
-
-            print(f"DEBUG: Shareable link: {survey_data['shareable_link']}")
             # Link survey to user (authenticated or temporary)
             survey_data["ownerUserId"] = user_id_str
             survey_data["user_id"] = user_id_str
@@ -2402,12 +2410,22 @@ def generate_survey():
                 }
                 print(f"Survey created for temporary user (ID: {user_id_str})")
 
-            print(f"Shareable: {survey_data['shareable_link']}")
-            print(f"Public: {survey_data['public_link']}")
+            def add_links(doc, new_id):
+                link = f"{FRONTEND_URL}/survey?offer_id={new_id}&user_id={simple_user_id}&sub1={username}"
+                doc["shareable_link"] = link
+                doc["public_link"] = link
 
-            # Save to database without timeout parameter
+            # Save under a 5-character short ID as _id (and id); the links carry
+            # the ID, so they are rebuilt if a legacy survey already has it
+            survey_id = id_allocator.insert_with_id(
+                "survey", "surveys", survey_data, "_id", mirror=("id",), derive=add_links
+            )
 
-            db["surveys"].insert_one(survey_data)
+            print(
+                f"DEBUG: Generated links with user_id={simple_user_id} and sub1={username}"
+            )
+            print(f"Shareable: {survey_data['shareable_link']}")
+            print(f"Public: {survey_data['public_link']}")
 
             # ── Extract and apply any branching instructions from the prompt ──
             # e.g. "redirect to https://x.com after Q3 if Yes" or "end after Q5 if No"
@@ -3253,7 +3271,7 @@ def test_email():
 @app.route("/api/process-scheduled-emails", methods=["POST"])
 @cross_origin(supports_credentials=True, origins="*")
 def process_scheduled_emails():
-    """Process scheduled emails that are due to be sent"""
+    """Send one batch of due scheduled emails (safe to call alongside the worker)"""
 
     try:
 
@@ -3626,7 +3644,7 @@ def create_masked_link():
 @app.route("/l/<short_id>", methods=["GET"])
 @cross_origin(supports_credentials=True, origins="*")
 def redirect_masked_link(short_id):
-    """True backend proxy - fetches destination server-side, strips blocking headers"""
+    """True backend proxy - streams destination server-side, strips blocking headers"""
 
     try:
         link = link_handler.db.masked_links.find_one({"short_id": short_id, "is_active": True})
@@ -3634,89 +3652,20 @@ def redirect_masked_link(short_id):
         if not link:
             return "<h2 style='font-family:sans-serif;text-align:center;margin-top:20%'>Link not found or inactive</h2>", 404
 
-        original_url = link["original_url"]
-
         # Track click silently
         try:
             link_handler._track_click(link, request)
         except Exception:
             pass
 
-        # Fetch the destination page server-side with real browser headers
-        fetch_headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Accept-Encoding": "identity",
-            "Connection": "keep-alive",
-            "Upgrade-Insecure-Requests": "1",
-            "Sec-Fetch-Dest": "document",
-            "Sec-Fetch-Mode": "navigate",
-            "Sec-Fetch-Site": "none",
-            "Cache-Control": "max-age=0",
-        }
-
-        session = requests.Session()
-        resp = session.get(
-            original_url,
-            headers=fetch_headers,
-            timeout=15,
-            allow_redirects=True,
-            verify=True
-        )
-
-        content_type = resp.headers.get("Content-Type", "text/html")
-        final_url = resp.url  # after redirects
-
-        # Non-HTML assets — pass through directly
-        if "text/html" not in content_type:
-            from flask import Response
-            return Response(resp.content, status=resp.status_code, content_type=content_type)
-
-        html = resp.text
-
-        # Inject <base> tag so all relative URLs (CSS, JS, images) resolve correctly
-        base_tag = f'<base href="{final_url}">'
-        lower = html.lower()
-        head_pos = lower.find("<head>")
-        if head_pos != -1:
-            insert_at = head_pos + 6
-            html = html[:insert_at] + base_tag + html[insert_at:]
-        else:
-            html = base_tag + html
-
-        from flask import Response
-        response = Response(html, status=200, content_type="text/html; charset=utf-8")
-
-        # Strip ALL headers that block display or framing
-        for h in ["X-Frame-Options", "Content-Security-Policy",
-                  "X-Content-Type-Options", "Strict-Transport-Security",
-                  "Permissions-Policy", "Cross-Origin-Opener-Policy",
-                  "Cross-Origin-Embedder-Policy", "Cross-Origin-Resource-Policy"]:
-            response.headers.remove(h)
+        # Stream the destination through the shared upstream pool
+        return proxy_link(link)
 
-        return response
+    except ProxyTooLarge as e:
+        return f"<h2 style='font-family:sans-serif;text-align:center;margin-top:20%'>{str(e)}</h2>", 502
 
-    except requests.exceptions.SSLError:
-        # Retry without SSL verification
-        try:
-            resp = requests.get(original_url, headers=fetch_headers, timeout=15,
-                                allow_redirects=True, verify=False)
-            html = resp.text
-            base_tag = f'<base href="{resp.url}">'
-            lower = html.lower()
-            head_pos = lower.find("<head>")
-            if head_pos != -1:
-                html = html[:head_pos+6] + base_tag + html[head_pos+6:]
-            else:
-                html = base_tag + html
-            from flask import Response
-            response = Response(html, status=200, content_type="text/html; charset=utf-8")
-            for h in ["X-Frame-Options", "Content-Security-Policy", "X-Content-Type-Options"]:
-                response.headers.remove(h)
-            return response
-        except Exception as e2:
-            return f"<h2 style='font-family:sans-serif;text-align:center;margin-top:20%'>SSL Error: {str(e2)}</h2>", 502
+    except requests.exceptions.SSLError as e2:
+        return f"<h2 style='font-family:sans-serif;text-align:center;margin-top:20%'>SSL Error: {str(e2)}</h2>", 502
 
     except requests.exceptions.ConnectionError as e:
         return f"<h2 style='font-family:sans-serif;text-align:center;margin-top:20%'>Cannot reach destination: {str(e)}</h2>", 502
@@ -5430,24 +5379,15 @@ RULES:
 
 User instruction: {prompt}"""
 
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [{"role": "user", "content": system_prompt}],
-            "temperature": 0.1,
-            "max_tokens": 800,
-        }
-
-        resp = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers, json=payload, timeout=25
-        )
-        resp.raise_for_status()
-
-        content = resp.json()["choices"][0]["message"]["content"].strip()
+        content = complete(
+            system_prompt,
+            model="gpt-4o-mini",
+            temperature=0.1,
+            max_tokens=800,
+            timeout=25,
+            api_key=OPENAI_API_KEY,
+            tag="survey.editor_ops",
+        ).strip()
         # Strip markdown fences if present
         if content.startswith("```"):
             content = content.split("```")[1]
@@ -14,6 +14,15 @@ def get_token_from_request():
         return None
     return auth_header.split(' ')[1]
 
+def resolve_user(token):
+    """Resolve a token to its user once per request; later calls reuse the result"""
+    memo = g.get('_auth_principal')
+    if memo is not None and memo[0] == token:
+        return memo[1]
+    user = auth_service.get_user_from_token(token)
+    g._auth_principal = (token, user)
+    return user
+
 def requireAuth(f):
     """Decorator to require valid JWT token"""
     @wraps(f)
@@ -23,7 +32,7 @@ def requireAuth(f):
             if not token:
                 return jsonify({'error': 'Authorization token required'}), 401
             
-            user = auth_service.get_user_from_token(token)
+            user = resolve_user(token)
             if not user:
                 return jsonify({'error': 'Invalid or expired token'}), 401
             
@@ -45,7 +54,7 @@ def requireAdmin(f):
             if not token:
                 return jsonify({'error': 'Authorization token required'}), 401
             
-            user = auth_service.get_user_from_token(token)
+            user = resolve_user(token)
             if not user:
                 return jsonify({'error': 'Invalid or expired token'}), 401
             
@@ -71,7 +80,7 @@ def requireFeature(feature_name):
                 if not token:
                     return jsonify({'error': 'Authorization token required'}), 401
                 
-                user = auth_service.get_user_from_token(token)
+                user = resolve_user(token)
                 if not user:
                     return jsonify({'error': 'Invalid or expired token'}), 401
                 
@@ -103,7 +112,7 @@ def requireRole(minimum_role):
                 if not token:
                     return jsonify({'error': 'Authorization token required'}), 401
                 
-                user = auth_service.get_user_from_token(token)
+                user = resolve_user(token)
                 if not user:
                     return jsonify({'error': 'Invalid or expired token'}), 401
                 
@@ -145,7 +154,7 @@ def optionalAuth(f):
         try:
             token = get_token_from_request()
             if token:
-                user = auth_service.get_user_from_token(token)
+                user = resolve_user(token)
                 g.current_user = user
             else:
                 g.current_user = None
@@ -171,7 +180,7 @@ def get_current_user():
         if not token:
             return None
         
-        user = auth_service.get_user_from_token(token)
+        user = resolve_user(token)
         return user
     except Exception:
         return None
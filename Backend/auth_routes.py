@@ -2,7 +2,7 @@
 Authentication routes for Flask app 
 """
 from flask import Blueprint, request, jsonify, make_response, g
-from auth_service import AuthService
+from auth_service import AuthService, HasherBusy, invalidate_user_cache
 from auth_middleware import requireAuth, optionalAuth
 from feature_middleware import get_user_permissions
 from datetime import datetime, timedelta
@@ -11,6 +11,13 @@ from mongodb_config import db
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 auth_service = AuthService()
 
+
+def _too_busy(e):
+    """429 when the password hashing queue is full"""
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
 @auth_bp.route('/register', methods=['POST', 'OPTIONS'])
 def register():
     """Register a new user"""
@@ -96,6 +103,8 @@ def register():
             }
         })
         
+    except HasherBusy as e:
+        return _too_busy(e)
     except ValueError as e:
         print(f"❌ ValueError: {str(e)}")
         print(f"🔐 === REGISTRATION ENDPOINT ERROR ===\n")
@@ -138,6 +147,7 @@ def confirm_email():
                     {'_id': user['_id']},
                     {'$unset': {'pending_ref_code': ''}}
                 )
+                invalidate_user_cache(user['_id'])
                 print(f"✅ Referral attribution applied after email confirmation: {pending_ref}")
         except Exception as ref_err:
             print(f"⚠️ Post-confirmation referral attribution failed (non-critical): {ref_err}")
@@ -200,6 +210,8 @@ def reset_password():
         auth_service.reset_password(token, new_password)
         
         return jsonify({'message': 'Password reset successfully. You can now login.'})
+    except HasherBusy as e:
+        return _too_busy(e)
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
@@ -297,6 +309,8 @@ def login():
             }
         })
         
+    except HasherBusy as e:
+        return _too_busy(e)
     except ValueError as e:
         return jsonify({'error': str(e)}), 401
     except Exception as e:
@@ -392,16 +406,15 @@ def check_auth():
         plan_features = []
         if user:
             try:
-                from plan_features_api import _get_plan_features_config, _config_to_role_features
-                config = _get_plan_features_config()
-                role_features = _config_to_role_features(config)
+                from plan_features_api import get_plan_feature_table
+                role_features = get_plan_feature_table().role_features
                 user_role = user.get('role', 'basic')
                 # Map 'basic' to 'free' for the config key
                 config_role = 'free' if user_role == 'basic' else user_role
-                plan_features = role_features.get(config_role, [])
+                plan_features = list(role_features.get(config_role, []))
                 # Admin always gets all features
                 if user_role == 'admin':
-                    plan_features = role_features.get('admin', [])
+                    plan_features = list(role_features.get('admin', []))
                 # Always include core keys so old feature checks still work
                 always_on = ['create', 'survey', 'analytics']
                 for key in always_on:
@@ -465,7 +478,7 @@ def firebase_login():
         
         from mongodb_config import db
         from role_manager import UserRole, UserStatus
-        from utils.short_id import generate_simple_user_id
+        from id_allocator import id_allocator
         
         # Check if user already exists
         users_collection = db.users
@@ -559,17 +572,10 @@ def firebase_login():
             # New user - create account (auto-confirmed since OAuth verified email)
             print(f"🆕 Creating new user via {provider}: {email}")
             
-            # Generate unique simple user ID
-            while True:
-                simple_user_id = generate_simple_user_id()
-                if not users_collection.find_one({'simpleUserId': simple_user_id}):
-                    break
-            
             user_data = {
                 'email': email,
                 'passwordHash': '',  # No password for OAuth users
                 'name': name or email.split('@')[0],
-                'simpleUserId': simple_user_id,
                 'role': UserRole.BASIC.value,
                 'status': UserStatus.APPROVED.value,  # Auto-approve OAuth users
                 'authProvider': provider,
@@ -577,8 +583,8 @@ def firebase_login():
                 'lastLogin': datetime.utcnow()
             }
             
-            result = users_collection.insert_one(user_data)
-            user_data['_id'] = result.inserted_id
+            # Unique simple numeric user ID, allocated on insert
+            id_allocator.insert_with_id('user', 'users', user_data, 'simpleUserId')
             
             print(f"✅ New OAuth user created: {email} (ID: {user_data['_id']})")
             
@@ -640,10 +646,14 @@ def request_account_deletion():
         data = request.json or {}
         password = data.get('password', '')
         
+        # The token user carries no password hash; read it for this check only
+        stored = db.users.find_one({'_id': user['_id']}, {'passwordHash': 1}) or {}
+        if stored.get('passwordHash'):
+            user['passwordHash'] = stored['passwordHash']
+        
         # Verify password for email/password users
         if user.get('passwordHash') and password:
-            import bcrypt
-            if not bcrypt.checkpw(password.encode('utf-8'), user['passwordHash'].encode('utf-8')):
+            if not auth_service.verify_password(password, user['passwordHash']):
                 return jsonify({'error': 'Incorrect password'}), 401
         elif user.get('passwordHash') and not password:
             return jsonify({'error': 'Password confirmation required'}), 400
@@ -697,6 +707,7 @@ def request_account_deletion():
             {'_id': user['_id']},
             {'$set': {'deletion_pending': True, 'deletion_scheduled_at': delete_after}}
         )
+        invalidate_user_cache(user['_id'])
         
         # Send deletion confirmation email
         try:
@@ -774,6 +785,8 @@ def request_account_deletion():
             'timeline': timeline_text
         })
         
+    except HasherBusy as e:
+        return _too_busy(e)
     except Exception as e:
         print(f"❌ Account deletion error: {e}")
         return jsonify({'error': f'Failed to request deletion: {str(e)}'}), 500
@@ -815,6 +828,7 @@ def cancel_account_deletion():
             {'_id': user['_id']},
             {'$unset': {'deletion_pending': '', 'deletion_scheduled_at': ''}}
         )
+        invalidate_user_cache(user['_id'])
         
         print(f"✅ Account deletion cancelled: {user.get('email')}")
         return jsonify({'message': 'Account deletion cancelled. Your account is safe.'})
@@ -1,7 +1,6 @@
 """Authentication service using MongoDB + JWT"""
 import os
 import jwt
-import bcrypt
 import uuid
 import smtplib
 from email.mime.text import MIMEText
@@ -11,11 +10,34 @@ from typing import Optional, Dict, Any
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import re
-from utils.short_id import generate_simple_user_id
+from id_allocator import id_allocator
+from utils.ttl_cache import TTLCache
+from utils.password_hasher import password_hasher, HasherBusy
 from role_manager import RoleManager, UserRole, UserStatus
 
 load_dotenv()
 
+# Authenticated users by id. Each worker keeps its own copy: writers in this
+# process call invalidate_user_cache(), the TTL bounds staleness for the rest.
+USER_CACHE_TTL_SECONDS = float(os.getenv('AUTH_USER_CACHE_TTL_SECONDS', '60'))
+_user_cache = TTLCache(maxsize=4096, ttl=USER_CACHE_TTL_SECONDS)
+
+# Secrets a request never needs once the token is verified
+PRINCIPAL_PROJECTION = {
+    'passwordHash': 0,
+    'confirmationToken': 0,
+    'resetPasswordToken': 0,
+    'resetPasswordExpiry': 0,
+}
+
+
+def invalidate_user_cache(user_id=None):
+    """Drop a cached user (or every user) after their document changed"""
+    if user_id is None:
+        _user_cache.clear()
+    else:
+        _user_cache.pop(str(user_id))
+
 class AuthService:
     def __init__(self):
         # Force reload environment variables
@@ -51,14 +73,12 @@ class AuthService:
         return re.match(pattern, email) is not None
     
     def hash_password(self, password: str) -> str:
-        """Hash password using bcrypt"""
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-        return hashed.decode('utf-8')
+        """Hash password using bcrypt (on the bounded hashing pool; raises HasherBusy)"""
+        return password_hasher.hash(password)
     
     def verify_password(self, password: str, hashed: str) -> bool:
-        """Verify password against hash"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        """Verify password against hash (on the bounded hashing pool; raises HasherBusy)"""
+        return password_hasher.verify(password, hashed)
     
     def generate_jwt_token(self, user_data: Dict[str, Any]) -> str:
         """Generate JWT token for user"""
@@ -105,13 +125,6 @@ class AuthService:
         # Hash password
         password_hash = self.hash_password(password)
         
-        # Generate unique simple user ID
-        while True:
-            simple_user_id = generate_simple_user_id()
-            # Check if this ID already exists
-            if not users_collection.find_one({'simpleUserId': simple_user_id}):
-                break
-        
         # Generate confirmation token
         confirmation_token = str(uuid.uuid4())
         
@@ -124,7 +137,6 @@ class AuthService:
             'email': email,
             'passwordHash': password_hash,
             'name': name or email.split('@')[0],
-            'simpleUserId': simple_user_id,  # Add simple numeric user ID
             'role': UserRole.BASIC.value,  # Default role is basic
             'status': UserStatus.PENDING_CONFIRMATION.value,  # Default status is pending confirmation
             'confirmationToken': confirmation_token,
@@ -132,8 +144,8 @@ class AuthService:
             'lastLogin': None
         }
         
-        result = users_collection.insert_one(user_data)
-        user_data['_id'] = result.inserted_id
+        # Unique simple numeric user ID, allocated on insert
+        id_allocator.insert_with_id('user', 'users', user_data, 'simpleUserId')
         
         print(f"🔐 User created in database with ID: {user_data['_id']}")
         print(f"🔐 User status: {user_data['status']}")
@@ -299,6 +311,8 @@ class AuthService:
             }
         )
         
+        invalidate_user_cache(user['_id'])
+        
         # Return updated user
         user['status'] = UserStatus.APPROVED.value
         return user
@@ -354,6 +368,7 @@ class AuthService:
                 '$unset': {'resetPasswordToken': "", 'resetPasswordExpiry': ""}
             }
         )
+        invalidate_user_cache(user['_id'])
         
         return True
     
@@ -449,10 +464,19 @@ class AuthService:
         if not can_login:
             raise ValueError(status_message.message)
         
+        update = {'lastLogin': datetime.utcnow()}
+        
+        # Upgrade hashes made with a different BCRYPT_ROUNDS while we have the plaintext
+        if password_hasher.needs_rehash(user['passwordHash']):
+            try:
+                update['passwordHash'] = self.hash_password(password)
+            except HasherBusy:
+                pass  # Try again on a later login
+        
         # Update last login
         users_collection.update_one(
             {'_id': user['_id']},
-            {'$set': {'lastLogin': datetime.utcnow()}}
+            {'$set': update}
         )
         
         return user
@@ -469,6 +493,22 @@ class AuthService:
         except:
             return None
     
+    def get_principal(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get the lean user document used to authorize requests (cached)"""
+        cached = _user_cache.get(user_id)
+        if cached is None:
+            db = self.get_db_connection()
+            from bson import ObjectId
+            try:
+                cached = db.users.find_one({'_id': ObjectId(user_id)}, PRINCIPAL_PROJECTION)
+            except:
+                return None
+            if not cached:
+                return None
+            _user_cache.set(user_id, cached)
+        # Callers annotate the user dict, so never hand out the cached one
+        return dict(cached)
+    
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """Get user by email"""
         db = self.get_db_connection()
@@ -482,7 +522,7 @@ class AuthService:
             payload = self.verify_jwt_token(token)
             user_id = payload.get('user_id')
             if user_id:
-                user = self.get_user_by_id(user_id)
+                user = self.get_principal(user_id)
                 if user:
                     # Add JWT payload data to user object (including simpleUserId)
                     user['simpleUserId'] = payload.get('simpleUserId', user.get('simpleUserId', 0))
@@ -0,0 +1,83 @@
+"""
+Benchmark: login vs non-login latency under a burst of concurrent logins.
+
+Simulates one threaded worker (REQUEST_THREADS request threads) receiving a
+burst of logins mixed with ordinary API requests, once with bcrypt on the
+request thread and once through utils.password_hasher. Prints p50/p95
+latencies and how many logins were turned away with 429.
+
+Usage:
+    python benchmark_password_hashing.py [logins] [other_requests] [rounds]
+"""
+import sys
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from utils.password_hasher import PasswordHasher, HasherBusy
+
+REQUEST_THREADS = 8
+
+
+def _other_request():
+    # A typical non-login call: a little Python work plus a DB round trip
+    sum(i * i for i in range(20000))
+    time.sleep(0.005)
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def run(mode, logins, others, rounds, stored_hash):
+    hasher = PasswordHasher(rounds=rounds, workers=2, queue_size=4, wait_seconds=10)
+    login_ms, other_ms, rejected = [], [], 0
+
+    def login():
+        nonlocal rejected
+        start = time.perf_counter()
+        try:
+            if mode == 'inline':
+                bcrypt.checkpw(b'correct horse', stored_hash)
+            else:
+                hasher.verify('correct horse', stored_hash.decode())
+            login_ms.append(time.perf_counter() - start)
+        except HasherBusy:
+            rejected += 1
+
+    def other():
+        start = time.perf_counter()
+        _other_request()
+        other_ms.append(time.perf_counter() - start)
+
+    login_jobs, other_jobs = [login] * logins, [other] * others
+    # Interleave so ordinary requests arrive during the login burst
+    n = min(logins, others)
+    jobs = [j for pair in zip(login_jobs[:n], other_jobs[:n]) for j in pair] + login_jobs[n:] + other_jobs[n:]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=REQUEST_THREADS) as pool:
+        for job in jobs:
+            pool.submit(job)
+    wall = time.perf_counter() - start
+
+    print(f"\n📊 {mode}: {logins} logins + {others} other requests in {wall:.2f}s")
+    print(f"   login  p50={_pct(login_ms, .5):7.1f}ms  p95={_pct(login_ms, .95):7.1f}ms  ok={len(login_ms)}  429={rejected}")
+    print(f"   other  p50={_pct(other_ms, .5):7.1f}ms  p95={_pct(other_ms, .95):7.1f}ms  "
+          f"mean={statistics.mean(other_ms) * 1000 if other_ms else 0:.1f}ms")
+
+
+if __name__ == '__main__':
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    others = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+
+    stored_hash = bcrypt.hashpw(b'correct horse', bcrypt.gensalt(rounds=rounds))
+    print(f"🔐 bcrypt cost {rounds}, {REQUEST_THREADS} request threads")
+    run('inline', logins, others, rounds, stored_hash)
+    run('executor', logins, others, rounds, stored_hash)
@@ -0,0 +1,122 @@
+"""
+Benchmark: PII scrubbing throughput and output parity.
+
+First checks pii_stripper against pii_parity_corpus.json (expected outputs
+recorded from the previous six-pass implementation) and against that
+implementation, kept below as the reference, on random digit-heavy strings.
+Exits with status 1 on any mismatch. Then scrubs a batch of synthetic survey
+answers with the reference, with strip_pii per answer and with
+strip_pii_batch, and prints answers per second.
+
+Usage:
+    python benchmark_pii_stripper.py [answers] [pii_share] [fuzz_cases]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+
+from pii_stripper import strip_pii, strip_pii_batch
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pii_parity_corpus.json')
+
+
+# ─── Reference: the six-pass implementation the corpus was recorded from ───
+
+def _reference_hash(value):
+    return "[REDACTED_" + hashlib.sha256(value.encode()).hexdigest()[:8] + "]"
+
+
+def reference_strip_pii(text):
+    if not text or not isinstance(text, str):
+        return text or ""
+    text = re.sub(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', lambda m: _reference_hash(m.group()), text)
+    text = re.sub(r'(?:\+?91[\s\-]?)?[6-9]\d{4}[\s\-]?\d{5}', lambda m: _reference_hash(m.group()), text)
+    text = re.sub(
+        r'\+?\d{1,3}[\s\-]?\(?\d{2,4}\)?[\s\-]?\d{3,4}[\s\-]?\d{3,4}',
+        lambda m: _reference_hash(m.group()) if len(re.sub(r'[\s\-\(\)\+]', '', m.group())) >= 10 else m.group(),
+        text
+    )
+    text = re.sub(
+        r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b',
+        lambda m: _reference_hash(m.group()), text
+    )
+    text = re.sub(r'\b[2-9]\d{3}\s?\d{4}\s?\d{4}\b', lambda m: _reference_hash(m.group()), text)
+    text = re.sub(r'\b[A-Z]{5}\d{4}[A-Z]\b', lambda m: _reference_hash(m.group()), text)
+    return text
+
+
+# ─── Parity ───
+
+def check_parity(fuzz_cases):
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        corpus = json.load(f)
+    failures = [c for c in corpus if strip_pii(c['input']) != c['expected']]
+    if strip_pii_batch([c['input'] for c in corpus]) != [c['expected'] for c in corpus]:
+        failures.append({'input': '<strip_pii_batch over the corpus>'})
+
+    rnd = random.Random(0)
+    alphabets = ["0123456789 .-+()", "ABCDEZ0123456789 .@a_[]", "0123456789 -+().@abcXYZ_AB9\n"]
+    for i in range(fuzz_cases):
+        alphabet = alphabets[i % len(alphabets)]
+        text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 40)))
+        if strip_pii(text) != reference_strip_pii(text):
+            failures.append({'input': text})
+
+    print(f"🔍 Parity: {len(corpus)} corpus cases, {fuzz_cases} random cases, {len(failures)} mismatches")
+    for failure in failures[:10]:
+        print(f"   ❌ {failure['input']!r}")
+    return not failures
+
+
+# ─── Throughput ───
+
+CHOICE_ANSWERS = ["Yes", "No", "Maybe", "Very satisfied", "Somewhat dissatisfied", "Rated 9 out of 10"]
+WORDS = (
+    "the app checkout was slow confusing great support team quick replies prices went up this "
+    "year I use it 3-4 times a week delivery took 2 days order #1042 arrived late ₹1200 plan v2.1"
+).split()
+PII_ANSWERS = [
+    "Reach me at priya.k@gmail.com", "Call +91 98765 43210 after 6pm",
+    "My number is (415) 555-0132", "PAN ABCDE1234F attached", "Aadhaar 2345 6789 0123",
+]
+
+
+def make_answers(count, pii_share, rnd):
+    """A third single-choice answers, the rest free text; pii_share of them with PII."""
+    answers = []
+    for _ in range(count):
+        if rnd.random() < pii_share:
+            answers.append(rnd.choice(PII_ANSWERS))
+        elif rnd.random() < 0.33:
+            answers.append(rnd.choice(CHOICE_ANSWERS))
+        else:
+            answers.append(" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 20))))
+    return answers
+
+
+def timed(label, fn, answers):
+    start = time.perf_counter()
+    fn(answers)
+    elapsed = time.perf_counter() - start
+    print(f"   {label:<22} {elapsed * 1000:8.1f}ms  {len(answers) / elapsed:12,.0f} answers/s")
+    return elapsed
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    pii_share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    fuzz_cases = int(sys.argv[3]) if len(sys.argv) > 3 else 30000
+
+    if not check_parity(fuzz_cases):
+        sys.exit(1)
+
+    answers = make_answers(count, pii_share, random.Random(1))
+    print(f"\n📊 {count} answers, {pii_share:.0%} containing PII")
+    reference = timed("reference (6 passes)", lambda a: [reference_strip_pii(x) for x in a], answers)
+    single = timed("strip_pii", lambda a: [strip_pii(x) for x in a], answers)
+    batch = timed("strip_pii_batch", strip_pii_batch, answers)
+    print(f"   speedup: {reference / single:.1f}x per answer, {reference / batch:.1f}x batched")
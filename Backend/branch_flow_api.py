@@ -14,8 +14,9 @@ import hashlib
 import hmac
 import base64
 import os
-import requests as http_requests
 from mongodb_config import db
+from ai_gateway import complete
+from ai_response_cache import STRUCTURED_TTL_SECONDS
 
 branch_flow_bp = Blueprint('branch_flow_bp', __name__)
 
@@ -128,26 +129,16 @@ Examples:
 """
 
     try:
-        resp = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
+        content = complete(
+            extraction_prompt,
+            model="gpt-4o-mini",
+            temperature=0.1,
+            max_tokens=600,
             timeout=20,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": extraction_prompt}],
-                "temperature": 0.1,
-                "max_tokens": 600
-            }
-        )
-
-        if resp.status_code != 200:
-            print(f"⚠️ Branching extraction API error: {resp.status_code}")
-            return []
-
-        content = resp.json()["choices"][0]["message"]["content"].strip()
+            api_key=api_key,
+            tag="branch_flow.extract_rules",
+            cache_ttl=STRUCTURED_TTL_SECONDS,
+        ).strip()
         # Strip markdown if present
         if content.startswith("```"):
             content = content.split("```")[1]
@@ -340,46 +331,35 @@ Return a JSON array with show_if for EVERY question:
 RETURN ONLY VALID JSON ARRAY. No explanation. Every question must appear exactly once."""
 
     try:
-        resp = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
+        content = complete(
+            prompt,
+            model="gpt-4o-mini",
+            temperature=0.2,
+            max_tokens=2000,
             timeout=25,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.2,
-                "max_tokens": 2000
-            }
-        )
-
-        if resp.status_code == 200:
-            content = resp.json()["choices"][0]["message"]["content"].strip()
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-            content = content.strip()
+            api_key=api_key,
+            tag="branch_flow.suggest",
+        ).strip()
+        if content.startswith("```"):
+            content = content.split("```")[1]
+            if content.startswith("json"):
+                content = content[4:]
+        content = content.strip()
 
-            suggestions = json.loads(content)
-            suggestion_map = {s["id"]: s.get("show_if") for s in suggestions}
+        suggestions = json.loads(content)
+        suggestion_map = {s["id"]: s.get("show_if") for s in suggestions}
 
-            # Apply AI suggestions — preserve existing show_if if already set
-            enriched = []
-            for q in questions:
-                q_copy = dict(q)
-                q_id = q_copy.get("id", "")
-                if q_id in suggestion_map and not q_copy.get("show_if"):
-                    q_copy["show_if"] = suggestion_map[q_id]
-                enriched.append(q_copy)
-
-            print(f"✅ AI branch suggestions applied to {len(enriched)} questions")
-            return enriched
-        else:
-            print(f"⚠️ AI branch suggestion failed: {resp.status_code} {resp.text[:200]}")
-            return questions
+        # Apply AI suggestions — preserve existing show_if if already set
+        enriched = []
+        for q in questions:
+            q_copy = dict(q)
+            q_id = q_copy.get("id", "")
+            if q_id in suggestion_map and not q_copy.get("show_if"):
+                q_copy["show_if"] = suggestion_map[q_id]
+            enriched.append(q_copy)
+
+        print(f"✅ AI branch suggestions applied to {len(enriched)} questions")
+        return enriched
 
     except Exception as e:
         print(f"⚠️ AI branch suggestion error: {e}")
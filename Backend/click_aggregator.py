@@ -0,0 +1,328 @@
+"""
+Click Aggregator
+Write-behind buffers for hot click counters and click event streams.
+
+Counter updates for the same document are merged in memory ($inc summed,
+$max kept, $set last-wins, $push and $addToSet batched) and flushed as one unordered
+bulk_write every FLUSH_INTERVAL seconds, so a viral link or survey costs one
+write per flush instead of one per click. Detailed click events are appended
+to a buffered insert_many stream.
+
+Buffers live per process (the flusher thread starts lazily after gunicorn's
+fork). Pending writes are flushed at exit; a hard kill can lose at most one
+interval of clicks. Counter updates whose bulk_write fails are merged back
+into the pending set and retried on the next flush, up to
+CLICK_FLUSH_MAX_RETRIES times before they are dropped. Events whose insert
+fails are retried ahead of newer events the same way, with at most
+CLICK_MAX_PENDING_EVENTS held for retry.
+"""
+import os
+import time
+import atexit
+import threading
+from typing import Dict, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from mongodb_config import db
+
+FLUSH_INTERVAL = float(os.environ.get("CLICK_FLUSH_INTERVAL_SECONDS", "0.25"))
+# Flush early once this many documents / events are pending
+MAX_PENDING = int(os.environ.get("CLICK_FLUSH_MAX_PENDING", "2000"))
+EVENT_RETENTION_DAYS = int(os.environ.get("CLICK_EVENT_RETENTION_DAYS", "90"))
+# Flushes a failed counter update or event is retried on before it is dropped
+MAX_FLUSH_RETRIES = int(os.environ.get("CLICK_FLUSH_MAX_RETRIES", "3"))
+# Events held for retry beyond this are dropped, oldest first (CLICK_MAX_PENDING_EVENTS)
+MAX_PENDING_EVENTS = int(os.environ.get("CLICK_MAX_PENDING_EVENTS", str(MAX_PENDING * 10)))
+
+
+def _merge_set(pending: dict, field: str, value):
+    """Queue $set field=value without leaving conflicting parent/child paths."""
+    for queued in list(pending):
+        if queued.startswith(field + "."):
+            del pending[queued]
+        elif field.startswith(queued + ".") and isinstance(pending[queued], dict):
+            # e.g. "responses" then "responses.q3": write q3 into the queued dict
+            target = pending[queued] = _copy_dicts(pending[queued])
+            *path, leaf = field[len(queued) + 1:].split(".")
+            for key in path:
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                target = target[key]
+            target[leaf] = value
+            return
+    pending[field] = value
+
+
+def _copy_dicts(value):
+    return {k: _copy_dicts(v) for k, v in value.items()} if isinstance(value, dict) else value
+
+
+class WriteCoalescer:
+    """Merges per-document updates to one collection and flushes them in bulk."""
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        self._pending: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        self.flushed_ops = 0
+        self.merged_updates = 0
+        self.retried_ops = 0
+        self.dropped_ops = 0
+
+    def add(self, filter: dict, inc: dict = None, set: dict = None, max: dict = None,
+            push: dict = None, push_slice: int = None, add_to_set: dict = None,
+            upsert: bool = False):
+        """
+        Queue an update for the document matching `filter`.
+
+        Args:
+            inc: Fields to increment; summed across queued updates
+            set: Fields to set; the latest value wins (a later parent path
+                replaces queued child paths, a later child path is written
+                into a queued parent value)
+            max: Fields to raise to the largest value seen
+            push: {field: item} appended in order on flush
+            push_slice: Keep only the last N array items (negative $slice)
+            add_to_set: {field: item} added with $addToSet on flush
+        """
+        key = tuple(sorted(filter.items()))
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {
+                    "filter": dict(filter), "inc": {}, "set": {}, "max": {},
+                    "push": {}, "add_to_set": {}, "slice": push_slice, "upsert": upsert,
+                    "attempts": 0,
+                }
+            else:
+                self.merged_updates += 1
+            for field, delta in (inc or {}).items():
+                entry["inc"][field] = entry["inc"].get(field, 0) + delta
+            for field, value in (set or {}).items():
+                _merge_set(entry["set"], field, value)
+            for field, value in (max or {}).items():
+                current = entry["max"].get(field)
+                if current is None or value > current:
+                    entry["max"][field] = value
+            for field, item in (push or {}).items():
+                entry["push"].setdefault(field, []).append(item)
+            for field, item in (add_to_set or {}).items():
+                items = entry["add_to_set"].setdefault(field, [])
+                if item not in items:
+                    items.append(item)
+            entry["upsert"] = entry["upsert"] or upsert
+            size = len(self._pending)
+        _ensure_flusher()
+        if size >= MAX_PENDING:
+            self.flush()
+
+    def _take(self) -> List[dict]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+    def _requeue(self, entries: List[dict]):
+        """Merge entries whose write failed back under anything queued since."""
+        with self._lock:
+            for entry in entries:
+                entry["attempts"] += 1
+                if entry["attempts"] > MAX_FLUSH_RETRIES:
+                    self.dropped_ops += 1
+                    print(f"❌ [ClickAggregator] Dropping {self.collection} update for {entry['filter']} "
+                          f"after {MAX_FLUSH_RETRIES} retries")
+                    continue
+                self.retried_ops += 1
+                key = tuple(sorted(entry["filter"].items()))
+                newer = self._pending.get(key)
+                if newer is not None:
+                    # The failed entry is older: newer $set values win, pushes go after its own
+                    for field, delta in newer["inc"].items():
+                        entry["inc"][field] = entry["inc"].get(field, 0) + delta
+                    for field, value in newer["set"].items():
+                        _merge_set(entry["set"], field, value)
+                    for field, value in newer["max"].items():
+                        current = entry["max"].get(field)
+                        if current is None or value > current:
+                            entry["max"][field] = value
+                    for field, items in newer["push"].items():
+                        entry["push"].setdefault(field, []).extend(items)
+                    for field, items in newer["add_to_set"].items():
+                        queued = entry["add_to_set"].setdefault(field, [])
+                        queued.extend(item for item in items if item not in queued)
+                    entry["slice"] = newer["slice"] or entry["slice"]
+                    entry["upsert"] = entry["upsert"] or newer["upsert"]
+                self._pending[key] = entry
+
+    def flush(self) -> int:
+        entries = self._take()
+        if not entries:
+            return 0
+        ops = []
+        sent = []
+        for entry in entries:
+            update = {}
+            if entry["inc"]:
+                update["$inc"] = entry["inc"]
+            if entry["set"]:
+                update["$set"] = entry["set"]
+            if entry["max"]:
+                update["$max"] = entry["max"]
+            if entry["push"]:
+                update["$push"] = {
+                    field: ({"$each": items, "$slice": -entry["slice"]} if entry["slice"] else {"$each": items})
+                    for field, items in entry["push"].items()
+                }
+            if entry["add_to_set"]:
+                update["$addToSet"] = {field: {"$each": items} for field, items in entry["add_to_set"].items()}
+            if update:
+                ops.append(UpdateOne(entry["filter"], update, upsert=entry["upsert"]))
+                sent.append(entry)
+        if ops:
+            try:
+                db[self.collection].bulk_write(ops, ordered=False)
+                self.flushed_ops += len(ops)
+            except BulkWriteError as e:
+                # Unordered: everything but the reported ops was applied
+                failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                self.flushed_ops += len(ops) - len(failed)
+                print(f"❌ [ClickAggregator] {self.collection} flush: {len(failed)} of {len(ops)} updates failed, requeued")
+                self._requeue([sent[i] for i in sorted(failed)])
+            except Exception as e:
+                print(f"❌ [ClickAggregator] {self.collection} flush of {len(ops)} updates failed, requeued: {e}")
+                self._requeue(sent)
+        return len(ops)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+
+class EventBuffer:
+    """Append-only event stream written with buffered insert_many."""
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        self._events: List[dict] = []
+        self._lock = threading.Lock()
+        self.flushed_events = 0
+        # (event, failed flushes) waiting to be written ahead of new events
+        self._retry: List[tuple] = []
+        self.retried_events = 0
+        self.dropped_events = 0
+
+    def append(self, event: dict):
+        with self._lock:
+            self._events.append(event)
+            size = len(self._events)
+        _ensure_flusher()
+        if size >= MAX_PENDING:
+            self.flush()
+
+    def _requeue(self, failed: List[tuple]):
+        """Hold events whose insert failed for the next flush, ahead of newer ones."""
+        keep = []
+        dropped = 0
+        for event, attempts in failed:
+            if attempts > MAX_FLUSH_RETRIES:
+                dropped += 1
+            else:
+                keep.append((event, attempts))
+        with self._lock:
+            room = MAX_PENDING_EVENTS - len(self._retry)
+            if len(keep) > room:
+                dropped += len(keep) - max(room, 0)
+                keep = keep[len(keep) - max(room, 0):]
+            self._retry[:0] = keep
+            self.retried_events += len(keep)
+            self.dropped_events += dropped
+        if dropped:
+            print(f"❌ [ClickAggregator] Dropping {dropped} {self.collection} events after failed inserts")
+
+    def flush(self) -> int:
+        with self._lock:
+            batch = self._retry + [(event, 0) for event in self._events]
+            self._retry, self._events = [], []
+        if not batch:
+            return 0
+        events = [event for event, _ in batch]
+        try:
+            db[self.collection].insert_many(events, ordered=False)
+            self.flushed_events += len(events)
+        except BulkWriteError as e:
+            # Unordered: everything but the reported inserts was written. A
+            # duplicate key means an earlier attempt already wrote that event.
+            failed = {
+                error["index"] for error in e.details.get("writeErrors", [])
+                if error.get("code") != 11000
+            }
+            self.flushed_events += len(events) - len(failed)
+            if failed:
+                print(f"❌ [ClickAggregator] {self.collection} insert: {len(failed)} of {len(events)} events failed, requeued")
+                self._requeue([(batch[i][0], batch[i][1] + 1) for i in sorted(failed)])
+        except Exception as e:
+            print(f"❌ [ClickAggregator] {self.collection} insert of {len(events)} events failed, requeued: {e}")
+            self._requeue([(event, attempts + 1) for event, attempts in batch])
+        return len(events)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._events) + len(self._retry)
+
+
+# ─── Registry & flusher ──────────────────────────────────────────────────────
+
+_buffers: List = []
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+
+
+def register(buffer):
+    _buffers.append(buffer)
+    return buffer
+
+
+def flush_all() -> int:
+    return sum(buffer.flush() for buffer in _buffers)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush_all()
+        except Exception as e:
+            print(f"❌ [ClickAggregator] Flush loop error: {e}")
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        threading.Thread(target=_flush_loop, name="click-flusher", daemon=True).start()
+        _flusher_pid = os.getpid()
+
+
+atexit.register(flush_all)
+
+
+def aggregator_stats() -> dict:
+    return {
+        buffer.collection: {
+            "pending": buffer.pending(),
+            "flushed": getattr(buffer, "flushed_ops", getattr(buffer, "flushed_events", 0)),
+            **({"retried": buffer.retried_ops, "dropped": buffer.dropped_ops}
+               if isinstance(buffer, WriteCoalescer) else
+               {"retried": buffer.retried_events, "dropped": buffer.dropped_events}),
+        }
+        for buffer in _buffers
+    }
+
+
+# Shared buffers
+masked_link_counters = register(WriteCoalescer("masked_links"))
+masked_link_events = register(EventBuffer("masked_link_click_events"))
+survey_click_counters = register(WriteCoalescer("survey_clicks"))
+survey_click_events = register(EventBuffer("survey_click_events"))
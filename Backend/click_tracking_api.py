@@ -7,8 +7,12 @@ from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify
 from mongodb_config import db
 import uuid
+import threading
 import requests as http_requests
 from typing import Dict, Optional
+from utils.ttl_cache import TTLCache
+from utils.user_agent import classify
+from click_aggregator import survey_click_counters, survey_click_events
 
 
 def _geo_from_ip(ip: str) -> dict:
@@ -38,11 +42,54 @@ def _geo_from_ip(ip: str) -> dict:
 
 click_tracking_bp = Blueprint('click_tracking', __name__)
 
+# click_history keeps the most recent visits; every visit is also appended
+# to survey_click_events
+CLICK_HISTORY_LIMIT = 50
+
+_click_identities = TTLCache(maxsize=20000, ttl=120)
+# Entries are shared by every request thread; their click_count is bumped under this
+_click_count_lock = threading.Lock()
+_survey_titles = TTLCache(maxsize=1024, ttl=300)
+
 class ClickTracker:
     """Enhanced click tracking for comprehensive user interaction monitoring"""
     
     def __init__(self):
         self.db = db
+
+    # ── Identity map ─────────────────────────────────────────
+    # (survey_id, identifier) → {"_id", "click_count"} of the click record.
+    # The count is this process's running estimate; the stored value is
+    # kept by $inc in the coalesced flush.
+
+    @staticmethod
+    def _identity_keys(survey_id, click_id, user_id, ip_address):
+        return [
+            (survey_id, kind, value)
+            for kind, value in (("click_id", click_id), ("user_id", user_id), ("ip", ip_address))
+            if value
+        ]
+
+    def _known_click(self, survey_id, click_id, user_id, ip_address) -> Optional[Dict]:
+        for key in self._identity_keys(survey_id, click_id, user_id, ip_address):
+            known = _click_identities.get(key)
+            if known is not None:
+                return known
+        return None
+
+    def _remember_click(self, survey_id, click_id, user_id, ip_address, known: Dict):
+        for key in self._identity_keys(survey_id, click_id, user_id, ip_address):
+            _click_identities.set(key, known)
+
+    def _survey_title(self, survey_id: str) -> str:
+        title = _survey_titles.get(survey_id)
+        if title is None:
+            survey = self.db.surveys.find_one(
+                {"$or": [{"_id": survey_id}, {"id": survey_id}]}, {"title": 1}
+            )
+            title = survey.get('title', 'Unknown Survey') if survey else 'Unknown Survey'
+            _survey_titles.set(survey_id, title)
+        return title
     
     def track_survey_click(
         self, 
@@ -70,55 +117,59 @@ class ClickTracker:
             # Create unique identifier for this user/survey combination
             user_identifier = click_id or user_id or user_info.get('ip_address', 'unknown')
             
-            # Check if this user has clicked this survey before
-            existing_click = self.db.survey_clicks.find_one({
-                "survey_id": survey_id,
-                "$or": [
-                    {"click_id": click_id} if click_id else {"$expr": False},
-                    {"user_id": user_id} if user_id else {"$expr": False},
-                    {"ip_address": user_info.get('ip_address')} if user_info.get('ip_address') else {"$expr": False}
-                ]
-            })
-            
+            ip_address = user_info.get('ip_address')
             current_time = datetime.now(timezone.utc)
-            
-            if existing_click:
-                # Update existing click record
-                click_count = existing_click.get('click_count', 0) + 1
-                
-                update_data = {
-                    "$set": {
-                        "last_click_time": current_time,
-                        "click_count": click_count,
+            history_entry = {
+                "timestamp": current_time,
+                "ip_address": user_info.get('ip_address', ''),
+                "user_agent": user_info.get('user_agent', ''),
+                "referrer": user_info.get('referrer', ''),
+                "url_params": url_params or {}
+            }
+
+            # Repeat visitors are resolved from the identity map without a read
+            known = self._known_click(survey_id, click_id, user_id, ip_address)
+            if known is None:
+                existing_click = self.db.survey_clicks.find_one({
+                    "survey_id": survey_id,
+                    "$or": [
+                        {"click_id": click_id} if click_id else {"$expr": False},
+                        {"user_id": user_id} if user_id else {"$expr": False},
+                        {"ip_address": ip_address} if ip_address else {"$expr": False}
+                    ]
+                }, {"_id": 1, "click_count": 1})
+                if existing_click:
+                    known = {"_id": existing_click["_id"], "click_count": existing_click.get('click_count', 0)}
+
+            if known is not None:
+                # Update existing click record, coalesced with other clicks on it
+                with _click_count_lock:
+                    known["click_count"] += 1
+                    click_count = known["click_count"]
+                click_record_id = known["_id"]
+
+                survey_click_counters.add(
+                    {"_id": click_record_id},
+                    inc={"click_count": 1},
+                    max={"last_click_time": current_time},
+                    set={
                         "last_user_agent": user_info.get('user_agent', ''),
                         "last_referrer": user_info.get('referrer', ''),
                         "url_params": url_params or {}
                     },
-                    "$push": {
-                        "click_history": {
-                            "timestamp": current_time,
-                            "ip_address": user_info.get('ip_address', ''),
-                            "user_agent": user_info.get('user_agent', ''),
-                            "referrer": user_info.get('referrer', ''),
-                            "url_params": url_params or {}
-                        }
-                    }
-                }
-                
-                self.db.survey_clicks.update_one(
-                    {"_id": existing_click["_id"]},
-                    update_data
+                    push={"click_history": history_entry},
+                    push_slice=CLICK_HISTORY_LIMIT,
                 )
-                
-                click_record_id = existing_click["_id"]
                 is_new_user = False
-                
+
                 print(f"🔄 Updated existing click record: {click_record_id} (Click #{click_count})")
-                
+
             else:
                 # Create new click record
                 click_record_id = str(uuid.uuid4())
-                
+                click_count = 1
+                known = {"_id": click_record_id, "click_count": 1}
+
                 click_record = {
                     "_id": click_record_id,
                     "survey_id": survey_id,
@@ -142,34 +193,30 @@ class ClickTracker:
                         "device_type": self._detect_device_type(user_info.get('user_agent', '')),
                         "browser": self._detect_browser(user_info.get('user_agent', ''))
                     },
-                    "click_history": [{
-                        "timestamp": current_time,
-                        "ip_address": user_info.get('ip_address', ''),
-                        "user_agent": user_info.get('user_agent', ''),
-                        "referrer": user_info.get('referrer', ''),
-                        "url_params": url_params or {}
-                    }],
+                    "click_history": [history_entry],
                     "created_at": current_time,
                     "updated_at": current_time
                 }
-                
+
                 self.db.survey_clicks.insert_one(click_record)
                 is_new_user = True
-                
+
                 print(f"✅ New click record created: {click_record_id}")
-            
-            # Get survey info for response
-            survey = self.db.surveys.find_one({
-                "$or": [{"_id": survey_id}, {"id": survey_id}]
+
+            self._remember_click(survey_id, click_id, user_id, ip_address, known)
+            survey_click_events.append({
+                "survey_id": survey_id,
+                "click_record_id": click_record_id,
+                **history_entry
             })
-            
+
             return {
                 "success": True,
                 "click_record_id": click_record_id,
                 "survey_id": survey_id,
-                "survey_title": survey.get('title', 'Unknown Survey') if survey else 'Unknown Survey',
+                "survey_title": self._survey_title(survey_id),
                 "is_new_user": is_new_user,
-                "click_count": existing_click.get('click_count', 0) + 1 if existing_click else 1,
+                "click_count": click_count,
                 "user_identifier": user_identifier,
                 "username": self._extract_username(user_info, url_params),
                 "timestamp": current_time.isoformat()
@@ -314,27 +361,11 @@ class ClickTracker:
     
     def _detect_device_type(self, user_agent: str) -> str:
         """Detect device type from user agent"""
-        user_agent = user_agent.lower()
-        if 'mobile' in user_agent or 'android' in user_agent or 'iphone' in user_agent:
-            return 'mobile'
-        elif 'tablet' in user_agent or 'ipad' in user_agent:
-            return 'tablet'
-        else:
-            return 'desktop'
+        return classify(user_agent).device.value
     
     def _detect_browser(self, user_agent: str) -> str:
         """Detect browser from user agent"""
-        user_agent = user_agent.lower()
-        if 'chrome' in user_agent:
-            return 'chrome'
-        elif 'firefox' in user_agent:
-            return 'firefox'
-        elif 'safari' in user_agent:
-            return 'safari'
-        elif 'edge' in user_agent:
-            return 'edge'
-        else:
-            return 'unknown'
+        return classify(user_agent).browser.value
 
 # API Endpoints
 @click_tracking_bp.route('/api/track-click/<survey_id>', methods=['POST', 'GET'])
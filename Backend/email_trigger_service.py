@@ -10,7 +10,8 @@ from datetime import datetime, timezone
 from typing import Dict, List, Optional, Any
 from bson import ObjectId
 from mongodb_config import db
-import smtplib
+from smtp_delivery import get_pool, send_message
+from utils.ttl_cache import TTLCache
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import logging
@@ -19,6 +20,82 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Scheduled emails claimed per batch, and how long a claim holds before
+# another worker may take the email over
+SCHEDULED_EMAIL_BATCH = int(os.getenv('SCHEDULED_EMAIL_BATCH', '50'))
+SCHEDULED_EMAIL_LEASE_SECONDS = int(os.getenv('SCHEDULED_EMAIL_LEASE_SECONDS', '300'))
+SCHEDULED_EMAIL_MAX_ATTEMPTS = 3
+
+# Question text that marks where the respondent's email address is asked for
+EMAIL_QUESTION_KEYWORDS = ['email', 'e-mail', 'mail address', 'email address', 'mail id', 'mail id?', 'email id', 'email id?']
+
+# Compiled trigger indexes per survey. Trigger and template CRUD drops this
+# process's copy; other gunicorn workers see changes once the entry expires.
+TRIGGER_INDEX_TTL_SECONDS = int(os.getenv('TRIGGER_INDEX_TTL_SECONDS', '60'))
+_trigger_indexes = TTLCache(maxsize=2048, ttl=TRIGGER_INDEX_TTL_SECONDS)
+
+
+def _normalize_answer(value) -> str:
+    return str(value).lower()
+
+
+class TriggerIndex:
+    """
+    A survey's active triggers, ready for matching a submission:
+    question_id -> {normalized answer -> [(trigger, template), ...]}, plus
+    the ids of the survey's email questions in question order.
+    """
+
+    def __init__(self, triggers: List[Dict[str, Any]], templates: Dict[str, Dict[str, Any]],
+                 email_question_ids: List[str]):
+        self.size = len(triggers)
+        self.email_question_ids = email_question_ids
+        self.by_question: Dict[str, Dict[str, list]] = {}
+        for trigger in triggers:
+            by_answer = self.by_question.setdefault(trigger.get('question_id'), {})
+            by_answer.setdefault(_normalize_answer(trigger.get('answer_value')), []).append(
+                (trigger, templates.get(str(trigger.get('email_template_id'))))
+            )
+
+    def match(self, response_data: Dict[str, Any]) -> list:
+        """(trigger, template) pairs whose condition this submission meets"""
+        answers = {}
+        for answer_item in response_data.get('answers') or []:
+            answers.setdefault(answer_item.get('question_id'), answer_item.get('answer'))
+        
+        matched = []
+        for question_id, by_answer in self.by_question.items():
+            user_answer = answers.get(question_id)
+            # Also check in response_data directly (for backward compatibility)
+            if user_answer is None and question_id in response_data:
+                user_answer = response_data[question_id]
+            if user_answer:
+                matched.extend(by_answer.get(_normalize_answer(user_answer), ()))
+        return matched
+
+    def extract_email(self, responses: Dict[str, Any]) -> Optional[str]:
+        for question_id in self.email_question_ids:
+            answer_value = responses.get(question_id)
+            # Basic email validation
+            if answer_value and '@' in str(answer_value) and '.' in str(answer_value):
+                return str(answer_value)
+        return None
+
+
+def _email_question_ids(survey: Dict[str, Any]) -> List[str]:
+    return [
+        question.get('id') for question in survey.get('questions', [])
+        if any(keyword in question.get('question', '').lower() for keyword in EMAIL_QUESTION_KEYWORDS)
+    ]
+
+
+def invalidate_trigger_index(survey_id: str = None):
+    """Drop a survey's compiled triggers (or every survey's) in this process"""
+    if survey_id is None:
+        _trigger_indexes.clear()
+    else:
+        _trigger_indexes.pop(survey_id)
+
 class EmailTriggerService:
     """Service for managing email triggers and sending emails"""
     
@@ -127,6 +204,8 @@ class EmailTriggerService:
                 {"_id": ObjectId(template_id)},
                 {"$set": update_data}
             )
+            # Compiled indexes hold template copies, across any number of surveys
+            invalidate_trigger_index()
             
             return {"success": True, "message": "Template updated successfully"}
             
@@ -226,6 +305,7 @@ class EmailTriggerService:
             print(f"DEBUG: Creating trigger: {trigger}")
             result = self.db.email_triggers.insert_one(trigger)
             trigger["_id"] = str(result.inserted_id)
+            invalidate_trigger_index(actual_survey_id)
             
             return {
                 "success": True,
@@ -237,38 +317,24 @@ class EmailTriggerService:
             logger.error(f"Error creating email trigger: {e}")
             return {"error": f"Failed to create trigger: {str(e)}"}
     
+    def _find_survey(self, survey_id: str) -> Optional[Dict[str, Any]]:
+        survey = self.db.surveys.find_one({"id": survey_id})
+        if not survey and ObjectId.is_valid(survey_id):
+            survey = self.db.surveys.find_one({"_id": ObjectId(survey_id)})
+        return survey
+    
     def extract_email_from_survey_response(self, survey_id: str, responses: Dict[str, Any]) -> str:
         """Extract email from survey responses by looking for email-type questions"""
         try:
             # Get survey structure to find email questions
-            survey = self.db.surveys.find_one({"id": survey_id})
-            if not survey:
-                survey = self.db.surveys.find_one({"_id": ObjectId(survey_id)})
-            
+            survey = self._find_survey(survey_id)
             if not survey:
                 print(f"📧 Survey not found: {survey_id}")
                 return None
             
-            questions = survey.get('questions', [])
-            email_found = None
-            
-            # Look for questions that ask for email
-            for question in questions:
-                question_text = question.get('question', '').lower()
-                question_id = question.get('id')
-                
-                # Check if this question asks for email
-                if any(keyword in question_text for keyword in ['email', 'e-mail', 'mail address', 'email address', 'mail id', 'mail id?', 'email id', 'email id?']):
-                    # Get the answer for this question
-                    answer_value = responses.get(question_id)
-                    if answer_value:
-                        # Basic email validation
-                        if '@' in str(answer_value) and '.' in str(answer_value):
-                            email_found = str(answer_value)
-                            print(f"📧 Found email from question '{question_text}': {email_found}")
-                            break
-            
+            email_found = TriggerIndex([], {}, _email_question_ids(survey)).extract_email(responses)
             if email_found:
+                print(f"📧 Found email in survey responses: {email_found}")
                 return email_found
             else:
                 print(f"📧 No email found in survey responses")
@@ -314,88 +380,166 @@ class EmailTriggerService:
                 "error": str(e)
             }
     
-    def process_scheduled_emails(self) -> Dict[str, Any]:
-        """Process and send scheduled emails that are due"""
-        try:
-            from datetime import datetime, timezone
-            
-            # Find emails that are due to be sent
+    def _claim_due_emails(self, worker: str, limit: int) -> List[Dict[str, Any]]:
+        """Lease up to `limit` due scheduled emails to `worker`, oldest first"""
+        from datetime import timedelta
+        from pymongo import ReturnDocument
+
+        claimed = []
+        while len(claimed) < limit:
             now = datetime.now(timezone.utc)
-            due_emails = list(self.db.scheduled_emails.find({
-                "status": "scheduled",
-                "send_at": {"$lte": now}
-            }))
-            
-            results = {
-                "processed": 0,
-                "sent": 0,
-                "failed": 0,
-                "details": []
+            scheduled_email = self.db.scheduled_emails.find_one_and_update(
+                {
+                    "send_at": {"$lte": now},
+                    "$or": [
+                        {"status": "scheduled"},
+                        # Claimed by a worker that died before finishing
+                        {"status": "sending", "lease_expires_at": {"$lt": now}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "status": "sending",
+                        "lease_owner": worker,
+                        "lease_expires_at": now + timedelta(seconds=SCHEDULED_EMAIL_LEASE_SECONDS),
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("send_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if scheduled_email is None:
+                break
+            if scheduled_email["attempts"] > SCHEDULED_EMAIL_MAX_ATTEMPTS:
+                self._finish_scheduled_email(scheduled_email, worker, "failed", {
+                    "error": f"Abandoned after {SCHEDULED_EMAIL_MAX_ATTEMPTS} attempts"
+                })
+                continue
+            claimed.append(scheduled_email)
+        return claimed
+    
+    def _finish_scheduled_email(self, scheduled_email: Dict[str, Any], worker: str,
+                                status: str, fields: Dict[str, Any] = None) -> bool:
+        """Move a leased email out of "sending"; False if the lease was lost"""
+        result = self.db.scheduled_emails.update_one(
+            {"_id": scheduled_email["_id"], "status": "sending", "lease_owner": worker},
+            {
+                "$set": {**(fields or {}), "status": status},
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
             }
-            
-            for scheduled_email in due_emails:
+        )
+        return result.modified_count == 1
+    
+    def _release_scheduled_emails(self, scheduled_emails: List[Dict[str, Any]], worker: str):
+        """Hand unsent claimed emails back without counting the attempt"""
+        self.db.scheduled_emails.update_many(
+            {"_id": {"$in": [e["_id"] for e in scheduled_emails]}, "status": "sending", "lease_owner": worker},
+            {
+                "$set": {"status": "scheduled"},
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
+                "$inc": {"attempts": -1},
+            }
+        )
+    
+    def _prefetch_triggers(self, scheduled_emails: List[Dict[str, Any]]):
+        """Triggers and templates for a batch, keyed by str(_id), in one query each"""
+        def lookup_ids(values):
+            ids = set()
+            for value in values:
+                if not value:
+                    continue
+                ids.add(value)
+                if isinstance(value, str) and ObjectId.is_valid(value):
+                    ids.add(ObjectId(value))
+            return list(ids)
+        
+        triggers = {
+            str(t["_id"]): t for t in self.db.email_triggers.find(
+                {"_id": {"$in": lookup_ids(e.get("trigger_id") for e in scheduled_emails)}}
+            )
+        }
+        templates = {
+            str(t["_id"]): t for t in self.db.email_templates.find(
+                {"_id": {"$in": lookup_ids(t.get("email_template_id") for t in triggers.values())}}
+            )
+        }
+        return triggers, templates
+    
+    def process_scheduled_emails(self, worker: str = None, limit: int = None) -> Dict[str, Any]:
+        """
+        Send one batch of due scheduled emails.
+        
+        Emails are leased to `worker` before sending, so concurrent callers
+        (the HTTP endpoint, web workers, scheduled_email_worker.py) never
+        send the same one; only the lease holder can mark it sent or failed.
+        """
+        results = {
+            "processed": 0,
+            "sent": 0,
+            "failed": 0,
+            "details": []
+        }
+        try:
+            import time
+            from job_queue import worker_id
+            
+            worker = worker or worker_id()
+            # Stop sending well before the lease runs out and another worker may re-claim
+            send_until = time.monotonic() + SCHEDULED_EMAIL_LEASE_SECONDS / 2
+            due_emails = self._claim_due_emails(worker, limit or SCHEDULED_EMAIL_BATCH)
+            if not due_emails:
+                return results
+            
+            triggers, templates = self._prefetch_triggers(due_emails)
+            
+            for index, scheduled_email in enumerate(due_emails):
+                if time.monotonic() > send_until:
+                    self._release_scheduled_emails(due_emails[index:], worker)
+                    break
                 results["processed"] += 1
                 
-                try:
-                    # Get trigger details
-                    trigger = self.db.email_triggers.find_one({"_id": ObjectId(scheduled_email["trigger_id"])})
-                    if not trigger:
-                        continue
-                    
-                    # Get email template
-                    template = self.db.email_templates.find_one({"_id": ObjectId(trigger["email_template_id"])})
-                    if not template:
-                        continue
-                    
-                    # Send email
-                    email_result = self.send_email(
-                        to_email=scheduled_email["to_email"],
-                        subject=template.get("subject", "Survey Response"),
-                        body=template.get("body", "Thank you for your response"),
-                        is_html=True
-                    )
-                    
-                    if email_result:
-                        # Update status to sent
-                        self.db.scheduled_emails.update_one(
-                            {"_id": scheduled_email["_id"]},
-                            {"$set": {"status": "sent", "sent_at": now}}
-                        )
-                        results["sent"] += 1
-                        results["details"].append({
-                            "email_id": str(scheduled_email["_id"]),
-                            "to_email": scheduled_email["to_email"],
-                            "status": "sent"
-                        })
-                        print(f"📧 Scheduled email sent successfully to {scheduled_email['to_email']}")
-                    else:
-                        # Update status to failed
-                        self.db.scheduled_emails.update_one(
-                            {"_id": scheduled_email["_id"]},
-                            {"$set": {"status": "failed", "error": "SMTP send failed"}}
-                        )
-                        results["failed"] += 1
-                        results["details"].append({
-                            "email_id": str(scheduled_email["_id"]),
-                            "to_email": scheduled_email["to_email"],
-                            "status": "failed",
-                            "error": "SMTP send failed"
-                        })
-                        
-                except Exception as e:
-                    # Update status to failed
-                    self.db.scheduled_emails.update_one(
-                        {"_id": scheduled_email["_id"]},
-                        {"$set": {"status": "failed", "error": str(e)}}
+                error = None
+                trigger = triggers.get(str(scheduled_email.get("trigger_id")))
+                template = templates.get(str(trigger.get("email_template_id"))) if trigger else None
+                if not trigger:
+                    error = "Trigger not found"
+                elif not template:
+                    error = "Email template not found"
+                else:
+                    try:
+                        if not self.send_email(
+                            to_email=scheduled_email["to_email"],
+                            subject=template.get("subject", "Survey Response"),
+                            body=template.get("body", "Thank you for your response"),
+                            is_html=True
+                        ):
+                            error = "SMTP send failed"
+                    except Exception as e:
+                        error = str(e)
+                
+                if error is None:
+                    finished = self._finish_scheduled_email(
+                        scheduled_email, worker, "sent", {"sent_at": datetime.now(timezone.utc)}
                     )
+                    results["sent"] += 1
+                    results["details"].append({
+                        "email_id": str(scheduled_email["_id"]),
+                        "to_email": scheduled_email["to_email"],
+                        "status": "sent"
+                    })
+                    print(f"📧 Scheduled email sent successfully to {scheduled_email['to_email']}")
+                else:
+                    finished = self._finish_scheduled_email(scheduled_email, worker, "failed", {"error": error})
                     results["failed"] += 1
                     results["details"].append({
                         "email_id": str(scheduled_email["_id"]),
                         "to_email": scheduled_email["to_email"],
                         "status": "failed",
-                        "error": str(e)
+                        "error": error
                     })
-                    print(f"📧 Failed to send scheduled email: {e}")
+                    print(f"📧 Failed to send scheduled email: {error}")
+                if not finished:
+                    print(f"⚠️ Lost the lease on scheduled email {scheduled_email['_id']} before recording its status")
             
             print(f"📧 Processed {results['processed']} scheduled emails: {results['sent']} sent, {results['failed']} failed")
             
@@ -404,9 +548,7 @@ class EmailTriggerService:
         except Exception as e:
             print(f"📧 Error processing scheduled emails: {e}")
             return {
-                "processed": 0,
-                "sent": 0,
-                "failed": 0,
+                **results,
                 "error": str(e)
             }
     
@@ -425,138 +567,142 @@ class EmailTriggerService:
             
             # Get survey ID from trigger
             survey_id = trigger.get("survey_id")
-            
-            # Extract email from survey responses
-            # Convert response_data.answers to the format expected by extract_email_from_survey_response
-            responses_dict = {}
-            if 'answers' in response_data:
-                for answer_item in response_data['answers']:
-                    question_id = answer_item.get('question_id')
-                    answer_value = answer_item.get('answer')
-                    if question_id and answer_value:
-                        responses_dict[question_id] = answer_value
-            
-            user_email = self.extract_email_from_survey_response(survey_id, responses_dict)
-            
-            if not user_email:
-                return {
-                    "success": False, 
-                    "error": "No email found in survey responses",
-                    "reason": "No email question answered or email not provided"
-                }
+            survey = self._find_survey(survey_id)
+            if not survey:
+                print(f"📧 Survey not found: {survey_id}")
             
             # Get email template
             template = self.db.email_templates.find_one({"_id": ObjectId(trigger["email_template_id"])})
-            if not template:
-                return {"success": False, "error": "Email template not found"}
-            
-            # Get delay settings
-            delay_minutes = trigger.get("delay_minutes", 0)
-            
-            # Process template variables
-            processed_template = self.process_template_variables(template, response_data)
-            
-            if delay_minutes == 0:
-                # Send immediately
-                email_result = self.send_email(
-                    to_email=user_email,
-                    subject=processed_template.get("subject", "Survey Response"),
-                    body=processed_template.get("body", "Thank you for your response"),
-                    is_html=True
-                )
-                
-                if email_result:
-                    return {
-                        "success": True,
-                        "message": "Email sent successfully",
-                        "to_email": user_email,
-                        "delay_minutes": 0
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": "Failed to send email via SMTP"
-                    }
-            else:
-                # Schedule for later
-                schedule_result = self.schedule_email_trigger(
-                    trigger_id=trigger_id,
-                    delay_minutes=delay_minutes,
-                    to_email=user_email,
-                    response_data=response_data
-                )
-                
-                return schedule_result
+            
+            index = TriggerIndex([], {}, _email_question_ids(survey) if survey else [])
+            return self._send_for_trigger(trigger, template, index, response_data)
                 
         except Exception as e:
             print(f"📧 Error in send_triggered_email: {e}")
             return {"success": False, "error": str(e)}
     
+    def _send_for_trigger(self, trigger: Dict[str, Any], template: Optional[Dict[str, Any]],
+                          index: TriggerIndex, response_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Send (or schedule) a matched trigger's email; no reads beyond what's passed in"""
+        # Extract email from survey responses
+        responses_dict = {}
+        for answer_item in response_data.get('answers') or []:
+            question_id = answer_item.get('question_id')
+            answer_value = answer_item.get('answer')
+            if question_id and answer_value:
+                responses_dict[question_id] = answer_value
+        
+        user_email = index.extract_email(responses_dict)
+        
+        if not user_email:
+            return {
+                "success": False, 
+                "error": "No email found in survey responses",
+                "reason": "No email question answered or email not provided"
+            }
+        
+        if not template:
+            return {"success": False, "error": "Email template not found"}
+        
+        # Get delay settings
+        delay_minutes = trigger.get("delay_minutes", 0)
+        
+        # Process template variables
+        processed_template = self.process_template_variables(template, response_data)
+        
+        if delay_minutes == 0:
+            # Send immediately
+            email_result = self.send_email(
+                to_email=user_email,
+                subject=processed_template.get("subject", "Survey Response"),
+                body=processed_template.get("body", "Thank you for your response"),
+                is_html=True
+            )
+            
+            if email_result:
+                return {
+                    "success": True,
+                    "message": "Email sent successfully",
+                    "to_email": user_email,
+                    "delay_minutes": 0
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": "Failed to send email via SMTP"
+                }
+        else:
+            # Schedule for later
+            return self.schedule_email_trigger(
+                trigger_id=str(trigger["_id"]),
+                delay_minutes=delay_minutes,
+                to_email=user_email,
+                response_data=response_data
+            )
+    
+    def get_trigger_index(self, survey_id: str) -> TriggerIndex:
+        """The survey's compiled triggers, built on first use and cached"""
+        index = _trigger_indexes.get(survey_id)
+        if index is not None:
+            return index
+        
+        triggers = list(self.db.email_triggers.find({
+            "survey_id": survey_id,  # Use short ID directly
+            "is_active": True
+        }))
+        templates, email_question_ids = {}, []
+        if triggers:
+            template_ids = {t.get("email_template_id") for t in triggers}
+            templates = {
+                str(t["_id"]): t for t in self.db.email_templates.find({
+                    "_id": {"$in": [ObjectId(i) for i in template_ids if i and ObjectId.is_valid(str(i))]}
+                })
+            }
+            survey = self._find_survey(survey_id)
+            if survey:
+                email_question_ids = _email_question_ids(survey)
+            else:
+                print(f"📧 Survey not found: {survey_id}")
+        
+        index = TriggerIndex(triggers, templates, email_question_ids)
+        _trigger_indexes.set(survey_id, index)
+        return index
+    
     def process_survey_triggers(self, survey_id: str, response_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process all email triggers for a survey submission"""
         try:
             print(f"📧 Processing email triggers for survey: {survey_id}")
             
-            # Get all active triggers for this survey
-            triggers = list(self.db.email_triggers.find({
-                "survey_id": survey_id,  # Use short ID directly
-                "is_active": True
-            }))
+            # Active triggers for this survey, compiled and cached
+            index = self.get_trigger_index(survey_id)
             
-            print(f"📧 Found {len(triggers)} email triggers")
+            print(f"📧 Found {index.size} email triggers")
             
             emails_sent = []
             emails_failed = []
             
-            for trigger in triggers:
+            for trigger, template in index.match(response_data):
                 try:
-                    question_id = trigger.get('question_id')
-                    required_answer = trigger.get('answer_value')
-                    
-                    print(f"📧 Checking trigger - Question: {question_id}, Required: {required_answer}")
-                    
-                    # Check if the trigger condition is met
-                    user_answer = None
+                    print(f"📧 ✅ Trigger met! Question {trigger.get('question_id')} = {trigger.get('answer_value')}")
                     
-                    # Look for answer in response_data.answers
-                    if 'answers' in response_data:
-                        for answer_item in response_data['answers']:
-                            if answer_item.get('question_id') == question_id:
-                                user_answer = answer_item.get('answer')
-                                break
+                    # Send triggered email
+                    email_result = self._send_for_trigger(trigger, template, index, response_data)
                     
-                    # Also check in response_data directly (for backward compatibility)
-                    if user_answer is None and question_id in response_data:
-                        user_answer = response_data[question_id]
-                    
-                    print(f"📧 User answered: {user_answer}")
-                    
-                    if user_answer and str(user_answer).lower() == str(required_answer).lower():
-                        print(f"📧 ✅ Trigger met! Question {question_id} = {required_answer}")
-                        
-                        # Send triggered email
-                        email_result = self.send_triggered_email(
-                            str(trigger['_id']),
-                            response_data
-                        )
-                        
-                        if email_result.get('success'):
-                            emails_sent.append({
-                                'trigger_id': str(trigger['_id']),
-                                'recipient': email_result.get('to_email', 'unknown'),
-                                'subject': 'Email sent successfully',
-                                'delay_minutes': email_result.get('delay_minutes', 0)
-                            })
-                            print(f"📧 ✅ Email processed: {email_result}")
-                        else:
-                            emails_failed.append({
-                                'trigger_id': str(trigger['_id']),
-                                'reason': email_result.get('error', 'Unknown error'),
-                                'details': email_result
-                            })
-                            print(f"📧 ❌ Email failed: {email_result}")
+                    if email_result.get('success'):
+                        emails_sent.append({
+                            'trigger_id': str(trigger['_id']),
+                            'recipient': email_result.get('to_email', 'unknown'),
+                            'subject': 'Email sent successfully',
+                            'delay_minutes': email_result.get('delay_minutes', 0)
+                        })
+                        print(f"📧 ✅ Email processed: {email_result}")
                     else:
-                        print(f"📧 ❌ Trigger not met - Expected: {required_answer}, Got: {user_answer}")
+                        emails_failed.append({
+                            'trigger_id': str(trigger['_id']),
+                            'reason': email_result.get('error', 'Unknown error'),
+                            'details': email_result
+                        })
+                        print(f"📧 ❌ Email failed: {email_result}")
                         
                 except Exception as e:
                     print(f"📧 Error processing trigger {trigger.get('_id')}: {e}")
@@ -567,7 +713,7 @@ class EmailTriggerService:
             
             result = {
                 'success': True,
-                'triggers_found': len(triggers),
+                'triggers_found': index.size,
                 'emails_sent': emails_sent,
                 'emails_failed': emails_failed,
                 'total_processed': len(emails_sent) + len(emails_failed)
@@ -644,6 +790,7 @@ class EmailTriggerService:
                 {"_id": ObjectId(trigger_id)},
                 {"$set": update_data}
             )
+            invalidate_trigger_index(trigger.get("survey_id"))
             
             return {"success": True, "message": "Trigger updated successfully"}
             
@@ -667,6 +814,7 @@ class EmailTriggerService:
                 {"_id": ObjectId(trigger_id)},
                 {"$set": {"is_active": False, "updated_at": datetime.now(timezone.utc)}}
             )
+            invalidate_trigger_index(trigger.get("survey_id"))
             
             return {"success": True, "message": "Trigger deleted successfully"}
             
@@ -699,6 +847,9 @@ class EmailTriggerService:
             logger.error(f"Error substituting variables: {e}")
             return template  # Return original template if substitution fails
     
+    def _smtp_pool(self):
+        return get_pool(self.smtp_server, self.smtp_port, self.smtp_username, self.smtp_password)
+    
     def send_email(self, to_email: str, subject: str, body: str, is_html: bool = False) -> bool:
         """Send email using SMTP"""
         try:
@@ -723,16 +874,9 @@ class EmailTriggerService:
             else:
                 msg.attach(MIMEText(body, 'plain'))
             
-            # Connect to SMTP server and send
-            print(f"🔌 Connecting to SMTP server: {self.smtp_server}:{self.smtp_port}")
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            print(f"🔐 Logging in with username: {self.smtp_username}")
-            server.login(self.smtp_username, self.smtp_password)
-            
-            text = msg.as_string()
-            server.sendmail(self.from_email, to_email, text)
-            server.quit()
+            # Send on a pooled, already logged-in connection
+            if not send_message(self._smtp_pool(), self.from_email, to_email, msg):
+                return False
             
             print(f"✅ Email sent successfully to {to_email}")
             logger.info(f"Email sent successfully to {to_email}")
@@ -4,10 +4,12 @@ Shows comprehensive tracking including clicks, submissions, and failed attempts
 """
 
 from flask import Blueprint, request, jsonify, g
-from datetime import datetime, timezone
+from datetime import datetime
 from mongodb_config import db
 from auth_middleware import requireAuth
-from bson import ObjectId
+from bson import ObjectId, json_util
+import base64
+import heapq
 
 enhanced_response_logs_bp = Blueprint('enhanced_response_logs', __name__)
 
@@ -28,7 +30,12 @@ def convert_objectid_to_string(obj):
 @enhanced_response_logs_bp.route('/api/enhanced-response-logs/<survey_id>', methods=['GET'])
 @requireAuth
 def get_enhanced_response_logs(survey_id):
-    """Get comprehensive response logs including click tracking and failed submissions"""
+    """
+    Get comprehensive response logs including click tracking and failed submissions.
+
+    Pass ?limit=N to page through the logs; the response then carries a
+    next_cursor to send back as ?cursor=... for the following page.
+    """
     try:
         user = g.current_user
         user_id = str(user['_id'])
@@ -45,22 +52,28 @@ def get_enhanced_response_logs(survey_id):
         if survey.get('ownerUserId') != user_id and user.get('role') != 'admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get submitted responses with enhanced data
-        submitted_responses = get_submitted_responses(str(survey['_id']))
-        
-        # Get click records (including those without submissions)
-        click_records = get_click_records(str(survey['_id']))
+        canonical_id = str(survey['_id'])
+        limit = request.args.get('limit', type=int)
         
-        # Merge and organize the data
-        comprehensive_logs = merge_response_and_click_data(submitted_responses, click_records)
+        if limit:
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
+            try:
+                cursor = _decode_cursor(request.args.get('cursor'))
+            except Exception:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            comprehensive_logs, next_cursor = get_joined_logs_page(canonical_id, limit, cursor)
+        else:
+            comprehensive_logs = list(iter_joined_logs(canonical_id))
+            next_cursor = None
         
-        # Calculate comprehensive statistics
-        stats = calculate_comprehensive_stats(comprehensive_logs, click_records)
+        # Calculate comprehensive statistics server-side
+        stats = calculate_comprehensive_stats(canonical_id)
         
         return jsonify({
             'success': True,
             'logs': comprehensive_logs,
             'summary': stats,
+            'next_cursor': next_cursor,
             'survey_id': survey_id,
             'survey_title': survey.get('title', 'Unknown Survey')
         })
@@ -69,242 +82,363 @@ def get_enhanced_response_logs(survey_id):
         print(f"Error fetching enhanced response logs: {e}")
         return jsonify({'error': f'Failed to fetch enhanced response logs: {str(e)}'}), 500
 
-def get_submitted_responses(survey_id):
-    """Get all submitted responses with session data"""
+# ─── Response ⋈ click join ────────────────────────────────────────────────────
+#
+# Each response is joined to exactly one click record, in order of confidence:
+#   1. click_tracking.click_record_id stored by EnhancedSurveyHandler (by _id)
+#   2. the response's click_id
+#   3. the most recent click from the same IP made before the submission
+# Lookups 2 and 3 use the survey_clicks (click_id | ip_address, survey_id,
+# first_click_time) indexes declared in index_registry.
+# Responses and click-only records are read in keyset-paginated batches and
+# merged by timestamp, so no survey-wide lookup table is held in memory.
+
+BATCH_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+# Sentinel join key that can never equal a stored click_id / ip_address
+_NO_JOIN = "\u0000no-join"
+
+_CLICK_FIELDS = {
+    "_id": 1,
+    "click_id": 1,
+    "username": 1,
+    "first_click_time": 1,
+    "last_click_time": 1,
+    "click_count": 1,
+    "device_info": 1,
+}
+
+
+def _keyset_match(field, after):
+    """Match documents strictly after (ts, _id) in (field desc, _id desc) order."""
+    if not after:
+        return {}
+    ts, last_id = after
+    return {"$or": [
+        {field: {"$lt": ts}},
+        {field: ts, "_id": {"$lt": last_id}},
+    ]}
+
+
+def _fetch_response_batch(survey_id, after, batch_size):
+    """One page of submitted responses joined with their session and click record."""
     pipeline = [
-        # Match responses for this survey
-        {
-            "$match": {
-                "survey_id": survey_id
-            }
-        },
+        {"$match": {"survey_id": survey_id, **_keyset_match("submitted_at", after)}},
+        {"$sort": {"submitted_at": -1, "_id": -1}},
+        {"$limit": batch_size},
         # Lookup session data
-        {
-            "$lookup": {
-                "from": "survey_sessions",
-                "localField": "session_id",
-                "foreignField": "_id",
-                "as": "session_data"
-            }
-        },
+        {"$lookup": {
+            "from": "survey_sessions",
+            "localField": "session_id",
+            "foreignField": "_id",
+            "as": "session_data"
+        }},
+        # 1. Pre-linked click record
+        {"$lookup": {
+            "from": "survey_clicks",
+            "localField": "click_tracking.click_record_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": _CLICK_FIELDS}],
+            "as": "linked_click"
+        }},
+        {"$addFields": {
+            "_click_join_id": {"$cond": [
+                {"$or": [
+                    {"$gt": [{"$size": "$linked_click"}, 0]},
+                    {"$in": [{"$ifNull": ["$user_info.click_id", ""]}, ["", "unknown"]]}
+                ]},
+                _NO_JOIN,
+                "$user_info.click_id"
+            ]}
+        }},
+        # 2. Click id
+        {"$lookup": {
+            "from": "survey_clicks",
+            "localField": "_click_join_id",
+            "foreignField": "click_id",
+            "pipeline": [
+                {"$match": {"survey_id": survey_id}},
+                {"$sort": {"first_click_time": -1}},
+                {"$limit": 1},
+                {"$project": _CLICK_FIELDS}
+            ],
+            "as": "click_by_id"
+        }},
+        {"$addFields": {
+            "_click_join_ip": {"$cond": [
+                {"$or": [
+                    {"$gt": [{"$size": "$linked_click"}, 0]},
+                    {"$gt": [{"$size": "$click_by_id"}, 0]},
+                    {"$in": [{"$ifNull": ["$user_info.ip_address", ""]}, ["", "unknown"]]}
+                ]},
+                _NO_JOIN,
+                "$user_info.ip_address"
+            ]}
+        }},
+        # 3. Latest click from the same IP before the submission
+        {"$lookup": {
+            "from": "survey_clicks",
+            "localField": "_click_join_ip",
+            "foreignField": "ip_address",
+            "let": {"submitted_at": "$submitted_at"},
+            "pipeline": [
+                {"$match": {
+                    "survey_id": survey_id,
+                    "$expr": {"$lte": ["$first_click_time", "$$submitted_at"]}
+                }},
+                {"$sort": {"first_click_time": -1}},
+                {"$limit": 1},
+                {"$project": _CLICK_FIELDS}
+            ],
+            "as": "click_by_ip"
+        }},
         # Add computed fields
-        {
-            "$addFields": {
-                "session_info": {"$arrayElemAt": ["$session_data", 0]},
-                "duration_seconds": {
-                    "$cond": {
-                        "if": {"$and": [
-                            {"$ne": [{"$arrayElemAt": ["$session_data.timestamps.survey_started", 0]}, None]},
-                            {"$ne": [{"$arrayElemAt": ["$session_data.timestamps.survey_completed", 0]}, None]}
-                        ]},
-                        "then": {
-                            "$divide": [
-                                {"$subtract": [
-                                    {"$arrayElemAt": ["$session_data.timestamps.survey_completed", 0]},
-                                    {"$arrayElemAt": ["$session_data.timestamps.survey_started", 0]}
-                                ]},
-                                1000
-                            ]
-                        },
-                        "else": 0
-                    }
+        {"$addFields": {
+            "session_info": {"$arrayElemAt": ["$session_data", 0]},
+            "click_data": {"$arrayElemAt": [
+                {"$concatArrays": ["$linked_click", "$click_by_id", "$click_by_ip"]}, 0
+            ]},
+            "click_match": {"$switch": {
+                "branches": [
+                    {"case": {"$gt": [{"$size": "$linked_click"}, 0]}, "then": "click_record_id"},
+                    {"case": {"$gt": [{"$size": "$click_by_id"}, 0]}, "then": "click_id"},
+                    {"case": {"$gt": [{"$size": "$click_by_ip"}, 0]}, "then": "ip_address"},
+                ],
+                "default": None
+            }},
+            "duration_seconds": {
+                "$cond": {
+                    "if": {"$and": [
+                        {"$ne": [{"$arrayElemAt": ["$session_data.timestamps.survey_started", 0]}, None]},
+                        {"$ne": [{"$arrayElemAt": ["$session_data.timestamps.survey_completed", 0]}, None]}
+                    ]},
+                    "then": {
+                        "$divide": [
+                            {"$subtract": [
+                                {"$arrayElemAt": ["$session_data.timestamps.survey_completed", 0]},
+                                {"$arrayElemAt": ["$session_data.timestamps.survey_started", 0]}
+                            ]},
+                            1000
+                        ]
+                    },
+                    "else": 0
                 }
             }
-        },
+        }},
         # Project final fields
-        {
-            "$project": {
-                "_id": 1,
-                "survey_id": 1,
-                "session_id": 1,
-                "username": {"$ifNull": ["$user_info.username", ""]},
-                "email": {"$ifNull": ["$user_info.email", ""]},
-                "ip_address": {"$ifNull": ["$user_info.ip_address", ""]},
-                "click_id": {"$ifNull": ["$user_info.click_id", ""]},
-                "submitted_at": 1,
-                "status": 1,
-                "duration_seconds": 1,
-                "evaluation_result": 1,
-                "responses_count": {"$size": {"$objectToArray": {"$ifNull": ["$responses", {}]}}},
-                "user_agent": {"$ifNull": ["$user_info.user_agent", ""]},
-                "postback_status": {"$ifNull": ["$postback_status", "none"]},
-                "click_tracking": 1  # Include click tracking data if available
-            }
-        },
-        # Sort by most recent first
-        {
-            "$sort": {"submitted_at": -1}
-        }
+        {"$project": {
+            "_id": 1,
+            "survey_id": 1,
+            "session_id": 1,
+            "username": {"$ifNull": ["$user_info.username", ""]},
+            "email": {"$ifNull": ["$user_info.email", ""]},
+            "ip_address": {"$ifNull": ["$user_info.ip_address", ""]},
+            "click_id": {"$ifNull": ["$user_info.click_id", ""]},
+            "submitted_at": 1,
+            "status": 1,
+            "duration_seconds": 1,
+            "evaluation_result": 1,
+            "responses_count": {"$size": {"$objectToArray": {"$ifNull": ["$responses", {}]}}},
+            "user_agent": {"$ifNull": ["$user_info.user_agent", ""]},
+            "postback_status": {"$ifNull": ["$postback_status", "none"]},
+            "click_data": 1,
+            "click_match": 1
+        }}
     ]
-    
     return list(db.responses.aggregate(pipeline))
 
-def get_click_records(survey_id):
-    """Get all click records for this survey"""
-    click_records = list(db.survey_clicks.find(
-        {"survey_id": survey_id},
-        {
-            "_id": 1,
-            "survey_id": 1,
-            "click_id": 1,
-            "user_id": 1,
-            "aff_sub": 1,
-            "username": 1,
-            "first_click_time": 1,
-            "last_click_time": 1,
-            "click_count": 1,
-            "ip_address": 1,
-            "user_agent": 1,
-            "submission_status": 1,
-            "submission_count": 1,
-            "last_submission_time": 1,
-            "evaluation_results": 1,
-            "device_info": 1,
-            "click_history": 1
-        }
-    ).sort("first_click_time", -1))
-    
-    # Convert ObjectIds to strings
-    for record in click_records:
-        convert_objectid_to_string(record)
-    
-    return click_records
 
-def merge_response_and_click_data(responses, click_records):
-    """Merge response data with click tracking data"""
-    comprehensive_logs = []
-    
-    # Create a lookup for click records by identifiers
-    click_lookup = {}
-    for click_record in click_records:
-        # Index by multiple identifiers
-        identifiers = [
-            click_record.get('click_id', ''),
-            click_record.get('user_id', ''),
-            click_record.get('ip_address', '')
-        ]
-        for identifier in identifiers:
-            if identifier and identifier != 'unknown':
-                click_lookup[identifier] = click_record
-    
-    # Process submitted responses first
-    processed_click_ids = set()
-    
-    for response in responses:
-        convert_objectid_to_string(response)
-        
-        # Try to find matching click record
-        click_data = None
-        identifiers = [
-            response.get('click_id', ''),
-            response.get('ip_address', '')
-        ]
-        
-        for identifier in identifiers:
-            if identifier and identifier in click_lookup:
-                click_data = click_lookup[identifier]
-                processed_click_ids.add(click_data['_id'])
-                break
-        
-        # Format duration
-        if response.get('duration_seconds', 0) > 0:
-            duration = response['duration_seconds']
-            if duration < 60:
-                response['duration_formatted'] = f"{duration:.1f}s"
-            elif duration < 3600:
-                response['duration_formatted'] = f"{duration/60:.1f}m"
-            else:
-                response['duration_formatted'] = f"{duration/3600:.1f}h"
-        else:
-            response['duration_formatted'] = "N/A"
-        
-        # Add click tracking information
-        if click_data:
-            response['click_tracking'] = {
-                'click_count': click_data.get('click_count', 1),
-                'first_click_time': click_data.get('first_click_time'),
-                'last_click_time': click_data.get('last_click_time'),
-                'total_clicks': click_data.get('click_count', 1),
-                'device_type': click_data.get('device_info', {}).get('device_type', 'unknown'),
-                'browser': click_data.get('device_info', {}).get('browser', 'unknown')
-            }
-            response['enhanced_username'] = click_data.get('username', response.get('username', ''))
-        else:
-            response['click_tracking'] = {
-                'click_count': 1,
-                'first_click_time': response.get('submitted_at'),
-                'last_click_time': response.get('submitted_at'),
-                'total_clicks': 1,
-                'device_type': 'unknown',
-                'browser': 'unknown'
-            }
-            response['enhanced_username'] = response.get('username', '')
-        
-        response['record_type'] = 'submitted'
-        comprehensive_logs.append(response)
-    
-    # Add click records without submissions (failed attempts)
-    for click_record in click_records:
-        if click_record['_id'] not in processed_click_ids:
-            # This is a click without submission
-            failed_record = {
-                '_id': f"click_{click_record['_id']}",
-                'survey_id': click_record['survey_id'],
-                'session_id': None,
-                'username': click_record.get('username', ''),
-                'enhanced_username': click_record.get('username', ''),
-                'email': '',
-                'ip_address': click_record.get('ip_address', ''),
-                'click_id': click_record.get('click_id', ''),
-                'submitted_at': None,
-                'status': 'clicked_not_submitted',
-                'duration_seconds': 0,
-                'duration_formatted': 'N/A',
-                'timestamp': click_record.get('last_click_time', click_record.get('first_click_time')),
-                'evaluation_result': {'status': 'not_submitted', 'score': 0},
-                'responses_count': 0,
-                'user_agent': click_record.get('user_agent', ''),
-                'postback_status': 'none',
-                'click_tracking': {
-                    'click_count': click_record.get('click_count', 1),
-                    'first_click_time': click_record.get('first_click_time'),
-                    'last_click_time': click_record.get('last_click_time'),
-                    'total_clicks': click_record.get('click_count', 1),
-                    'device_type': click_record.get('device_info', {}).get('device_type', 'unknown'),
-                    'browser': click_record.get('device_info', {}).get('browser', 'unknown')
-                },
-                'record_type': 'clicked_only'
-            }
-            comprehensive_logs.append(failed_record)
+def _fetch_click_only_batch(survey_id, after, batch_size):
+    """One page of click records that never led to a submission."""
+    query = {
+        "survey_id": survey_id,
+        "submission_status": {"$ne": "submitted"},
+        **_keyset_match("last_click_time", after)
+    }
+    projection = {**_CLICK_FIELDS, "survey_id": 1, "ip_address": 1, "user_agent": 1}
+    return list(
+        db.survey_clicks.find(query, projection)
+        .sort([("last_click_time", -1), ("_id", -1)])
+        .limit(batch_size)
+    )
+
+
+def _format_duration(seconds):
+    if seconds and seconds > 0:
+        if seconds < 60:
+            return f"{seconds:.1f}s"
+        if seconds < 3600:
+            return f"{seconds/60:.1f}m"
+        return f"{seconds/3600:.1f}h"
+    return "N/A"
+
+
+def _format_submitted(response):
+    """Shape a joined response document into a 'submitted' log row."""
+    click_data = response.pop('click_data', None)
+    response['duration_formatted'] = _format_duration(response.get('duration_seconds', 0))
     
-    # Sort by timestamp (most recent first)
-    comprehensive_logs.sort(key=lambda x: x.get('timestamp') or x.get('submitted_at') or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
+    # Add click tracking information
+    if click_data:
+        response['click_tracking'] = {
+            'click_count': click_data.get('click_count', 1),
+            'first_click_time': click_data.get('first_click_time'),
+            'last_click_time': click_data.get('last_click_time'),
+            'total_clicks': click_data.get('click_count', 1),
+            'device_type': click_data.get('device_info', {}).get('device_type', 'unknown'),
+            'browser': click_data.get('device_info', {}).get('browser', 'unknown'),
+            'click_record_id': str(click_data.get('_id', ''))
+        }
+        response['enhanced_username'] = click_data.get('username', response.get('username', ''))
+    else:
+        response['click_tracking'] = {
+            'click_count': 1,
+            'first_click_time': response.get('submitted_at'),
+            'last_click_time': response.get('submitted_at'),
+            'total_clicks': 1,
+            'device_type': 'unknown',
+            'browser': 'unknown'
+        }
+        response['enhanced_username'] = response.get('username', '')
     
-    return comprehensive_logs
+    response['record_type'] = 'submitted'
+    return convert_objectid_to_string(response)
+
+
+def _format_click_only(click_record):
+    """Shape a click record without a submission into a 'clicked_only' log row."""
+    return convert_objectid_to_string({
+        '_id': f"click_{click_record['_id']}",
+        'survey_id': click_record['survey_id'],
+        'session_id': None,
+        'username': click_record.get('username', ''),
+        'enhanced_username': click_record.get('username', ''),
+        'email': '',
+        'ip_address': click_record.get('ip_address', ''),
+        'click_id': click_record.get('click_id', ''),
+        'submitted_at': None,
+        'status': 'clicked_not_submitted',
+        'duration_seconds': 0,
+        'duration_formatted': 'N/A',
+        'timestamp': click_record.get('last_click_time', click_record.get('first_click_time')),
+        'evaluation_result': {'status': 'not_submitted', 'score': 0},
+        'responses_count': 0,
+        'user_agent': click_record.get('user_agent', ''),
+        'postback_status': 'none',
+        'click_tracking': {
+            'click_count': click_record.get('click_count', 1),
+            'first_click_time': click_record.get('first_click_time'),
+            'last_click_time': click_record.get('last_click_time'),
+            'total_clicks': click_record.get('click_count', 1),
+            'device_type': click_record.get('device_info', {}).get('device_type', 'unknown'),
+            'browser': click_record.get('device_info', {}).get('browser', 'unknown')
+        },
+        'record_type': 'clicked_only'
+    })
 
-def calculate_comprehensive_stats(logs, click_records):
-    """Calculate comprehensive statistics"""
-    total_clicks = len(click_records)
-    total_unique_clicks = sum(record.get('click_count', 1) for record in click_records)
+
+def _stream(fetch_batch, ts_field, source, survey_id, after, batch_size):
+    """Yield (sort_key, source, raw_key, doc) from a keyset-paginated source, newest first."""
+    while True:
+        batch = fetch_batch(survey_id, after, batch_size)
+        for doc in batch:
+            key = (doc.get(ts_field), doc['_id'])
+            sort_ts = key[0] if isinstance(key[0], datetime) else datetime.min
+            yield (sort_ts, source, key, doc)
+        if len(batch) < batch_size:
+            return
+        after = (batch[-1].get(ts_field), batch[-1]['_id'])
+
+
+def _merged_stream(survey_id, cursor=None, batch_size=BATCH_SIZE):
+    cursor = cursor or {}
+    responses = _stream(_fetch_response_batch, "submitted_at", "r", survey_id, cursor.get("r"), batch_size)
+    clicks = _stream(_fetch_click_only_batch, "last_click_time", "c", survey_id, cursor.get("c"), batch_size)
+    return heapq.merge(responses, clicks, key=lambda item: item[0], reverse=True)
+
+
+def _format_row(source, doc):
+    return _format_submitted(doc) if source == "r" else _format_click_only(doc)
+
+
+def iter_joined_logs(survey_id, batch_size=BATCH_SIZE):
+    """Yield every log row for a survey, most recent first, in bounded-memory batches."""
+    for _, source, _, doc in _merged_stream(survey_id, batch_size=batch_size):
+        yield _format_row(source, doc)
+
+
+def get_joined_logs_page(survey_id, limit, cursor=None):
+    """Return (rows, next_cursor) for one page of the merged, time-ordered log."""
+    cursor = dict(cursor or {})
+    rows = []
+    for _, source, key, doc in _merged_stream(survey_id, cursor, batch_size=min(limit + 1, BATCH_SIZE)):
+        if len(rows) == limit:
+            return rows, _encode_cursor(cursor)
+        rows.append(_format_row(source, doc))
+        cursor[source] = key
+    return rows, None
+
+
+def _encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json_util.dumps(cursor).encode()).decode()
+
+
+def _decode_cursor(token):
+    if not token:
+        return None
+    cursor = json_util.loads(base64.urlsafe_b64decode(token.encode()).decode())
+    return {k: tuple(v) for k, v in cursor.items() if k in ("r", "c") and v}
+
+
+def calculate_comprehensive_stats(survey_id):
+    """Calculate comprehensive statistics with server-side aggregation"""
+    click_res = list(db.survey_clicks.aggregate([
+        {"$match": {"survey_id": survey_id}},
+        {"$group": {
+            "_id": None,
+            "records": {"$sum": 1},
+            "clicks": {"$sum": {"$ifNull": ["$click_count", 1]}},
+            "not_submitted": {"$sum": {"$cond": [{"$ne": ["$submission_status", "submitted"]}, 1, 0]}}
+        }}
+    ]))
+    clicks = click_res[0] if click_res else {"records": 0, "clicks": 0, "not_submitted": 0}
     
-    submitted_logs = [log for log in logs if log.get('record_type') == 'submitted']
-    clicked_only_logs = [log for log in logs if log.get('record_type') == 'clicked_only']
+    total_submissions = db.responses.count_documents({"survey_id": survey_id})
     
-    total_submissions = len(submitted_logs)
-    total_click_only = len(clicked_only_logs)
+    # Average duration across submitted responses with a completed session
+    duration_res = list(db.responses.aggregate([
+        {"$match": {"survey_id": survey_id, "session_id": {"$exists": True}}},
+        {"$lookup": {
+            "from": "survey_sessions",
+            "localField": "session_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"timestamps.survey_started": 1, "timestamps.survey_completed": 1}}],
+            "as": "session"
+        }},
+        {"$unwind": "$session"},
+        {"$match": {
+            "session.timestamps.survey_started": {"$ne": None},
+            "session.timestamps.survey_completed": {"$ne": None}
+        }},
+        {"$project": {"duration": {"$divide": [
+            {"$subtract": ["$session.timestamps.survey_completed", "$session.timestamps.survey_started"]}, 1000
+        ]}}},
+        {"$match": {"duration": {"$gt": 0}}},
+        {"$group": {"_id": None, "avg": {"$avg": "$duration"}}}
+    ]))
+    avg_duration = duration_res[0]["avg"] if duration_res else 0
     
-    # Calculate durations for submitted responses
-    valid_durations = [log.get('duration_seconds', 0) for log in submitted_logs if log.get('duration_seconds', 0) > 0]
-    avg_duration = sum(valid_durations) / len(valid_durations) if valid_durations else 0
+    total_clicks = clicks["records"]
     
     # Calculate conversion rate
     conversion_rate = (total_submissions / total_clicks * 100) if total_clicks > 0 else 0
     
     return {
         'total_clicks': total_clicks,
-        'total_unique_clicks': total_unique_clicks,
+        'total_unique_clicks': clicks["clicks"],
         'total_submissions': total_submissions,
-        'clicked_not_submitted': total_click_only,
+        'clicked_not_submitted': clicks["not_submitted"],
         'conversion_rate': round(conversion_rate, 2),
         'average_duration': avg_duration,
         'average_duration_formatted': f"{avg_duration/60:.1f}m" if avg_duration > 0 else "N/A",
@@ -332,9 +466,7 @@ def export_enhanced_response_logs(survey_id):
             return jsonify({'error': 'Access denied'}), 403
         
         # Get comprehensive logs
-        submitted_responses = get_submitted_responses(str(survey['_id']))
-        click_records = get_click_records(str(survey['_id']))
-        comprehensive_logs = merge_response_and_click_data(submitted_responses, click_records)
+        comprehensive_logs = iter_joined_logs(str(survey['_id']))
         
         # CSV headers
         csv_headers = [
@@ -417,30 +549,35 @@ def get_click_analytics_detailed(survey_id):
         if survey.get('ownerUserId') != user_id and user.get('role') != 'admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get click records
-        click_records = get_click_records(str(survey['_id']))
+        # Aggregate click records server-side
+        facets = list(db.survey_clicks.aggregate([
+            {"$match": {"survey_id": str(survey['_id'])}},
+            {"$facet": {
+                "totals": [{"$group": {
+                    "_id": None,
+                    "users": {"$sum": 1},
+                    "clicks": {"$sum": {"$ifNull": ["$click_count", 1]}},
+                    "submitted": {"$sum": {"$cond": [{"$eq": ["$submission_status", "submitted"]}, 1, 0]}},
+                    "clicked_only": {"$sum": {"$cond": [{"$eq": ["$submission_status", "not_submitted"]}, 1, 0]}}
+                }}],
+                "devices": [{"$group": {"_id": {"$ifNull": ["$device_info.device_type", "unknown"]}, "count": {"$sum": 1}}}],
+                "browsers": [{"$group": {"_id": {"$ifNull": ["$device_info.browser", "unknown"]}, "count": {"$sum": 1}}}]
+            }}
+        ]))[0]
+        totals = facets["totals"][0] if facets["totals"] else {"users": 0, "clicks": 0, "submitted": 0, "clicked_only": 0}
         
         # Calculate analytics
         analytics = {
-            'total_unique_users': len(click_records),
-            'total_clicks': sum(record.get('click_count', 1) for record in click_records),
-            'users_who_submitted': len([r for r in click_records if r.get('submission_status') == 'submitted']),
-            'users_who_clicked_only': len([r for r in click_records if r.get('submission_status') == 'not_submitted']),
-            'average_clicks_per_user': sum(record.get('click_count', 1) for record in click_records) / len(click_records) if click_records else 0,
-            'device_breakdown': {},
-            'browser_breakdown': {},
+            'total_unique_users': totals['users'],
+            'total_clicks': totals['clicks'],
+            'users_who_submitted': totals['submitted'],
+            'users_who_clicked_only': totals['clicked_only'],
+            'average_clicks_per_user': totals['clicks'] / totals['users'] if totals['users'] else 0,
+            'device_breakdown': {row['_id']: row['count'] for row in facets['devices']},
+            'browser_breakdown': {row['_id']: row['count'] for row in facets['browsers']},
             'hourly_click_distribution': {}
         }
         
-        # Device and browser breakdown
-        for record in click_records:
-            device_info = record.get('device_info', {})
-            device_type = device_info.get('device_type', 'unknown')
-            browser = device_info.get('browser', 'unknown')
-            
-            analytics['device_breakdown'][device_type] = analytics['device_breakdown'].get(device_type, 0) + 1
-            analytics['browser_breakdown'][browser] = analytics['browser_breakdown'].get(browser, 0) + 1
-        
         # Calculate conversion rate
         analytics['conversion_rate'] = (analytics['users_who_submitted'] / analytics['total_unique_users'] * 100) if analytics['total_unique_users'] > 0 else 0
         
@@ -10,16 +10,24 @@ from datetime import datetime, timezone
 from bson import ObjectId
 from mongodb_config import db
 from auth_middleware import requireAuth
+from ai_gateway import chat_completion, complete, AIGatewayError, BACKGROUND
+from ai_response_cache import STRUCTURED_TTL_SECONDS
+from job_queue import JobQueue, JobWatcher, LeaseLost, FINISHED_STATUSES
+from utils.sse import CLOSE, drain, format_event, sse_response
+from utils.mongo_keys import encode_key
 from funnel_scoring_engine import (
     process_screening_survey_submission,
     process_job_survey_submission,
     build_job_queue,
-    accumulate_scores
+    accumulate_scores,
+    get_funnel_stats,
+    build_screening_dropoff
 )
 import os
 import json
 import uuid
-import requests as http_requests
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 funnel_bp = Blueprint("funnel_bp", __name__)
 
@@ -224,26 +232,24 @@ Example 3 — Short vague prompt:
 NOW ANALYZE THE USER'S PROMPT ABOVE AND RETURN THE PLAN."""
 
     try:
-        resp = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            timeout=30,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "gpt-4o",
-                "messages": [
+        try:
+            content = chat_completion(
+                [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": analysis_prompt}
                 ],
-                "temperature": 0.2,
-                "max_tokens": 4000,
-                "response_format": {"type": "json_object"}
-            }
-        )
-
-        if resp.status_code != 200:
-            return jsonify({"error": f"AI error: {resp.status_code}"}), 502
+                model="gpt-4o",
+                temperature=0.2,
+                max_tokens=4000,
+                response_format={"type": "json_object"},
+                timeout=30,
+                api_key=api_key,
+                tag="funnel.analyze",
+                cache_ttl=STRUCTURED_TTL_SECONDS,
+            )
+        except AIGatewayError as e:
+            return jsonify({"error": f"AI error: {e.status_code or e}"}), 502
 
-        content = resp.json()["choices"][0]["message"]["content"]
         result = json.loads(content)
         return jsonify(result), 200
 
@@ -262,7 +268,7 @@ NOW ANALYZE THE USER'S PROMPT ABOVE AND RETURN THE PLAN."""
 @requireAuth
 def generate_funnel():
     """
-    Kicks off funnel generation in a background thread.
+    Queues funnel generation for the funnel worker (funnel_worker.py).
     Returns immediately with a job_id.
     Frontend polls /api/funnels/generate-status/<job_id> for progress.
     This bypasses Render's 60-second proxy timeout.
@@ -280,63 +286,157 @@ def generate_funnel():
     current_user = g.current_user
     owner_user_id = str(current_user.get("_id", ""))
 
-    api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("AI_API_KEY", "")
-    if not api_key:
+    if not _funnel_api_key():
         return jsonify({"error": "AI service not configured"}), 503
 
     job_id = f"fgen_{uuid.uuid4().hex[:12]}"
 
-    # Save initial job status to DB
-    db.funnel_generation_jobs.insert_one({
-        "job_id": job_id,
-        "status": "running",
-        "progress": 0,
-        "current_step": "Starting generation...",
-        "generated_surveys": [],
-        "funnel_id": None,
-        "errors": [],
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-
-    # Run generation in background thread so we return immediately
-    import threading
-    thread = threading.Thread(
-        target=_run_funnel_generation_bg,
-        args=(job_id, funnel_plan, original_prompt, owner_user_id, api_key),
-        daemon=True
+    # The worker reads the API key from its own environment; it is not stored
+    funnel_jobs.enqueue(
+        job_id,
+        FUNNEL_GENERATION_JOB,
+        {
+            "funnel_plan": funnel_plan,
+            "original_prompt": original_prompt,
+            "owner_user_id": owner_user_id,
+            # Fixed up front so a resumed job keeps adding to the same funnel
+            "funnel_id": f"fnl_{uuid.uuid4().hex[:10]}",
+        },
+        progress=0,
+        current_step="Waiting for a generation worker...",
+        generated_surveys=[],
+        funnel_id=None,
+        errors=[],
+        created_at=datetime.now(timezone.utc).isoformat()
     )
-    thread.start()
 
-    return jsonify({"job_id": job_id, "status": "running"}), 202
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
 
 
-def _run_funnel_generation_bg(job_id, funnel_plan, original_prompt, owner_user_id, api_key):
-    """Runs the actual funnel generation in a background thread. Updates DB with progress."""
+# Funnel generation runs as a durable job in funnel_generation_jobs
+FUNNEL_GENERATION_JOB = "funnel_generation"
+funnel_jobs = JobQueue("funnel_generation_jobs")
+funnel_job_watcher = JobWatcher(funnel_jobs, close=CLOSE)
 
-    def update_job(status=None, progress=None, step=None, surveys=None, funnel_id=None, errors=None):
-        patch = {}
-        if status: patch["status"] = status
-        if progress is not None: patch["progress"] = progress
-        if step: patch["current_step"] = step
-        if surveys is not None: patch["generated_surveys"] = surveys
-        if funnel_id: patch["funnel_id"] = funnel_id
-        if errors is not None: patch["errors"] = errors
-        if patch:
-            db.funnel_generation_jobs.update_one({"job_id": job_id}, {"$set": patch})
+# A progress stream ends after this long; the client reconnects or polls
+FUNNEL_PROGRESS_STREAM_SECONDS = 15 * 60
 
-    try:
-        funnel_id = f"fnl_{uuid.uuid4().hex[:10]}"
-        generated_surveys = []
-        errors = []
-        questions_asked_so_far: list = []
+# Surveys generated at once by one funnel generation job
+FUNNEL_GENERATION_WORKERS = int(os.environ.get("FUNNEL_GENERATION_WORKERS", "4"))
+
+
+def _funnel_api_key():
+    return os.environ.get("OPENAI_API_KEY") or os.environ.get("AI_API_KEY", "")
 
-        total_surveys = len(funnel_plan.get("screening_surveys", [])) + len(funnel_plan.get("job_profiles", []))
-        done = 0
 
-        # ── Screening surveys ──
-        screening_survey_ids = []
-        for s_meta in funnel_plan.get("screening_surveys", []):
-            update_job(step=f"Generating: {s_meta['name']}...", progress=int(done / max(total_surveys, 1) * 80))
+def _run_task_graph(tasks, max_workers):
+    """
+    Run {name: (dependencies, fn)} on a bounded thread pool, starting each task
+    as soon as all of its dependencies have finished (whether or not they
+    succeeded — task functions record their own errors).
+    """
+    pending = dict(tasks)
+    finished = set()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="funnel-gen") as pool:
+        running = {}
+        while pending or running:
+            for name, (deps, fn) in list(pending.items()):
+                if all(d in finished for d in deps):
+                    running[pool.submit(fn)] = name
+                    del pending[name]
+            if not running:
+                raise RuntimeError(f"Unsatisfiable task dependencies: {sorted(pending)}")
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                finished.add(running.pop(future))
+                future.result()
+
+
+def run_funnel_generation_job(job, ctx):
+    """
+    Job handler for FUNNEL_GENERATION_JOB. Reports progress through ctx and
+    checkpoints every finished survey (checkpoints.screening.<index>,
+    checkpoints.jobs.<job id>, checkpoints.scoring), so a job resumed after a
+    worker crash only generates what is still missing. Job ids come from the
+    AI plan, so they go through encode_key before becoming part of a path.
+    """
+    payload = job["payload"]
+    funnel_plan = payload["funnel_plan"]
+    original_prompt = payload.get("original_prompt", "")
+    owner_user_id = payload.get("owner_user_id", "")
+    funnel_id = payload["funnel_id"]
+
+    api_key = _funnel_api_key()
+    if not api_key:
+        raise RuntimeError("AI service not configured")
+
+    done_screening = ctx.checkpoints.get("screening", {})
+    done_jobs = ctx.checkpoints.get("jobs", {})
+    done_scoring = ctx.checkpoints.get("scoring", False)
+    if done_screening or done_jobs or done_scoring:
+        print(f"🔁 [BG Funnel] Resuming {job['job_id']} (attempt {job['attempts']})")
+
+    generated_surveys = []
+    errors = []
+    questions_asked_so_far: list = []
+    screening_plan = funnel_plan.get("screening_surveys", [])
+    job_plan = funnel_plan.get("job_profiles", [])
+
+    # Task graph — each screening layer dedupes against the layers before
+    # it, so layers form a chain; job surveys and the scoring matrix only
+    # need the finished screening surveys and run side by side.
+    tasks = {}
+    screening_results = {}
+    job_surveys_config = {}
+    progress_lock = threading.Lock()
+    running = {}
+    # Surveys plus the scoring matrix; saving the funnel is the last 10%
+    total_units = len(screening_plan) + len(job_plan) + 1
+    done = 0
+
+    # Pick up what earlier attempts finished
+    for s_meta in screening_plan:
+        saved = done_screening.get(str(s_meta["index"]))
+        if saved:
+            screening_results[s_meta["index"]] = saved["result"]
+            generated_surveys.append(saved["survey"])
+            questions_asked_so_far.extend(saved["topics"])
+            done += 1
+    for job_meta in job_plan:
+        saved = done_jobs.get(encode_key(job_meta["id"]))
+        if saved:
+            job_surveys_config[job_meta["id"]] = saved["config"]
+            generated_surveys.append(saved["survey"])
+            done += 1
+    if done_scoring:
+        done += 1
+
+    ctx.update(funnel_id=funnel_id, generated_surveys=list(generated_surveys),
+               progress=int(done / total_units * 90))
+
+    def report(started=None, finished=None, survey=None, error=None):
+        nonlocal done
+        with progress_lock:
+            if started:
+                running[started[0]] = started[1]
+            if finished:
+                running.pop(finished, None)
+                done += 1
+            if survey:
+                generated_surveys.append(survey)
+            if error:
+                errors.append(error)
+            fields = {"progress": int(done / total_units * 90)}
+            if running:
+                fields["current_step"] = f"Generating: {', '.join(running.values())}..."
+            if survey:
+                fields["generated_surveys"] = list(generated_surveys)
+            ctx.update(**fields)
+
+    def screening_task(s_meta):
+        def run():
+            key = f"screening:{s_meta['index']}"
+            report(started=(key, s_meta["name"]))
             try:
                 survey_doc = _generate_single_survey(
                     api_key=api_key,
@@ -349,27 +449,31 @@ def _run_funnel_generation_bg(job_id, funnel_plan, original_prompt, owner_user_i
                     funnel_id=funnel_id,
                     layer_index=s_meta["index"],
                     original_prompt=original_prompt,
-                    questions_asked_so_far=questions_asked_so_far
+                    questions_asked_so_far=list(questions_asked_so_far)
                 )
-                for q in survey_doc.get("questions", []):
-                    if isinstance(q, dict):  # guard: skip any non-dict items saved by AI
-                        questions_asked_so_far.append({"topic": q.get("question", "")[:80], "survey": s_meta["name"]})
-                screening_survey_ids.append({"survey_id": survey_doc["id"], "name": s_meta["name"], "index": s_meta["index"], "purpose": s_meta["purpose"]})
-                generated_surveys.append({"type": "screening", "index": s_meta["index"], "survey_id": survey_doc["id"], "name": s_meta["name"], "question_count": len(survey_doc.get("questions", []))})
-                done += 1
-                update_job(surveys=list(generated_surveys), progress=int(done / max(total_surveys, 1) * 80))
+                topics = [
+                    {"topic": q.get("question", "")[:80], "survey": s_meta["name"]}
+                    for q in survey_doc.get("questions", [])
+                    if isinstance(q, dict)  # guard: skip any non-dict items saved by AI
+                ]
+                questions_asked_so_far.extend(topics)
+                result = {"survey_id": survey_doc["id"], "name": s_meta["name"], "index": s_meta["index"], "purpose": s_meta["purpose"]}
+                survey = {"type": "screening", "index": s_meta["index"], "survey_id": survey_doc["id"], "name": s_meta["name"], "question_count": len(survey_doc.get("questions", []))}
+                screening_results[s_meta["index"]] = result
+                ctx.checkpoint(f"screening.{s_meta['index']}", {"result": result, "survey": survey, "topics": topics})
+                report(finished=key, survey=survey)
                 print(f"✅ [BG Funnel] Screening survey: {s_meta['name']}")
+            except LeaseLost:
+                raise
             except Exception as e:
-                errors.append(f"Screening survey '{s_meta['name']}': {e}")
+                report(finished=key, error=f"Screening survey '{s_meta['name']}': {e}")
                 print(f"❌ [BG Funnel] Screening failed {s_meta['name']}: {e}")
-                done += 1
+        return run
 
-        # ── Job surveys ──
-        screening_questions_asked = list(questions_asked_so_far)
-        job_surveys_config = {}
-        for job_meta in funnel_plan.get("job_profiles", []):
+    def job_task(job_meta):
+        def run():
             job_id_key = job_meta["id"]
-            update_job(step=f"Generating: {job_meta['display_name']}...", progress=int(done / max(total_surveys, 1) * 80))
+            report(started=(f"job:{job_id_key}", job_meta["display_name"]))
             try:
                 survey_doc = _generate_single_survey(
                     api_key=api_key,
@@ -384,9 +488,9 @@ def _run_funnel_generation_bg(job_id, funnel_plan, original_prompt, owner_user_i
                     original_prompt=original_prompt,
                     job_id=job_id_key,
                     qualification_flag=job_meta.get("qualification_flag"),
-                    questions_asked_so_far=screening_questions_asked
+                    questions_asked_so_far=list(questions_asked_so_far)
                 )
-                job_surveys_config[job_id_key] = {
+                config = {
                     "survey_id": survey_doc["id"],
                     "display_name": job_meta["display_name"],
                     "redirect_url": "",
@@ -401,65 +505,89 @@ def _run_funnel_generation_bg(job_id, funnel_plan, original_prompt, owner_user_i
                         "show_next_job_name": True
                     }
                 }
-                generated_surveys.append({"type": "job", "job_id": job_id_key, "survey_id": survey_doc["id"], "name": job_meta["display_name"], "question_count": len(survey_doc.get("questions", []))})
-                done += 1
-                update_job(surveys=list(generated_surveys), progress=int(done / max(total_surveys, 1) * 80))
+                survey = {"type": "job", "job_id": job_id_key, "survey_id": survey_doc["id"], "name": job_meta["display_name"], "question_count": len(survey_doc.get("questions", []))}
+                job_surveys_config[job_id_key] = config
+                ctx.checkpoint(f"jobs.{encode_key(job_id_key)}", {"config": config, "survey": survey})
+                report(finished=f"job:{job_id_key}", survey=survey)
                 print(f"✅ [BG Funnel] Job survey: {job_meta['display_name']}")
+            except LeaseLost:
+                raise
             except Exception as e:
-                errors.append(f"Job survey '{job_id_key}': {e}")
+                report(finished=f"job:{job_id_key}", error=f"Job survey '{job_id_key}': {e}")
                 print(f"❌ [BG Funnel] Job failed {job_id_key}: {e}")
-                done += 1
+        return run
 
-        # ── Scoring matrix ──
-        update_job(step="Building AI scoring matrix...", progress=85)
+    def scoring_task():
+        report(started=("scoring", "AI scoring matrix"))
         try:
+            screening_survey_ids = [screening_results[s["index"]] for s in screening_plan if s["index"] in screening_results]
             scoring_matrix = _generate_scoring_matrix(api_key=api_key, funnel_plan=funnel_plan, screening_survey_ids=screening_survey_ids, original_prompt=original_prompt)
             _apply_scoring_to_surveys(scoring_matrix, screening_survey_ids)
+            ctx.checkpoint("scoring", True)
+            report(finished="scoring")
             print(f"✅ [BG Funnel] Scoring matrix applied")
+        except LeaseLost:
+            raise
         except Exception as e:
-            errors.append(f"Scoring matrix: {e}")
+            report(finished="scoring", error=f"Scoring matrix: {e}")
             print(f"⚠️ [BG Funnel] Scoring matrix error: {e}")
 
-        # ── Save funnel config ──
-        job_priority_order = [j["id"] for j in funnel_plan.get("job_profiles", [])]
-        funnel_doc = {
-            "funnel_id": funnel_id,
-            "name": funnel_plan.get("funnel_name", "Untitled Funnel"),
-            "goal": funnel_plan.get("goal", ""),
-            "funnel_type": funnel_plan.get("funnel_type", "general"),
-            "original_prompt": original_prompt,
-            "funnel_plan": funnel_plan,
-            "owner_user_id": owner_user_id,
-            "screening_surveys": screening_survey_ids,
-            "job_surveys": job_surveys_config,
-            "job_priority_order": job_priority_order,
-            "fallback_url": "",
-            "min_score_threshold": 0,
-            "status": "active",
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-            "generated_surveys": generated_surveys,
-            "generation_errors": errors
-        }
-        db.funnels.insert_one(funnel_doc)
-        print(f"✅ [BG Funnel] Saved funnel: {funnel_id}")
-
-        update_job(
-            status="done",
-            progress=100,
-            step="Done!",
-            surveys=generated_surveys,
-            funnel_id=funnel_id,
-            errors=errors
-        )
-
-    except Exception as e:
-        import traceback
-        print(f"❌ [BG Funnel] Fatal error: {traceback.format_exc()}")
-        db.funnel_generation_jobs.update_one(
-            {"job_id": job_id},
-            {"$set": {"status": "error", "error": str(e), "progress": 0}}
-        )
+    # Checkpointed steps stay in the graph as no-ops so dependencies still line up
+    def skip():
+        pass
+
+    previous = []
+    for s_meta in screening_plan:
+        name = f"screening:{s_meta['index']}"
+        tasks[name] = (previous, skip if s_meta["index"] in screening_results else screening_task(s_meta))
+        previous = [name]
+    screening_done = previous
+    # Scoring is the longest call, so it is queued ahead of the job surveys
+    tasks["scoring"] = (screening_done, skip if done_scoring else scoring_task)
+    for job_meta in job_plan:
+        tasks[f"job:{job_meta['id']}"] = (screening_done, skip if job_meta["id"] in job_surveys_config else job_task(job_meta))
+
+    _run_task_graph(tasks, max_workers=FUNNEL_GENERATION_WORKERS)
+
+    # Parallel tasks finish in any order; store everything in plan order
+    screening_survey_ids = [screening_results[s["index"]] for s in screening_plan if s["index"] in screening_results]
+    plan_order = {("screening", s["index"]): i for i, s in enumerate(screening_plan)}
+    plan_order.update({("job", j["id"]): len(screening_plan) + i for i, j in enumerate(job_plan)})
+    generated_surveys.sort(key=lambda s: plan_order.get((s["type"], s.get("index", s.get("job_id"))), 0))
+    job_surveys_config = {j["id"]: job_surveys_config[j["id"]] for j in job_plan if j["id"] in job_surveys_config}
+
+    # ── Save funnel config ──
+    job_priority_order = [j["id"] for j in funnel_plan.get("job_profiles", [])]
+    funnel_doc = {
+        "funnel_id": funnel_id,
+        "name": funnel_plan.get("funnel_name", "Untitled Funnel"),
+        "goal": funnel_plan.get("goal", ""),
+        "funnel_type": funnel_plan.get("funnel_type", "general"),
+        "original_prompt": original_prompt,
+        "funnel_plan": funnel_plan,
+        "owner_user_id": owner_user_id,
+        "screening_surveys": screening_survey_ids,
+        "job_surveys": job_surveys_config,
+        "job_priority_order": job_priority_order,
+        "fallback_url": "",
+        "min_score_threshold": 0,
+        "status": "active",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "generated_surveys": generated_surveys,
+        "generation_errors": errors
+    }
+    # Upsert: a crash between saving the funnel and finishing the job must not save it twice
+    db.funnels.replace_one({"funnel_id": funnel_id}, funnel_doc, upsert=True)
+    print(f"✅ [BG Funnel] Saved funnel: {funnel_id}")
+
+    return {
+        "progress": 100,
+        "current_step": "Done!",
+        "generated_surveys": generated_surveys,
+        "funnel_id": funnel_id,
+        "errors": errors
+    }
 
 
 # ═══════════════════════════════════════════════════════
@@ -473,20 +601,47 @@ def get_generation_status(job_id):
     """Poll this endpoint every 3 seconds to get generation progress."""
     if request.method == "OPTIONS":
         return "", 200
-    job = db.funnel_generation_jobs.find_one({"job_id": job_id})
+    job = funnel_jobs.status(job_id)
     if not job:
         return jsonify({"error": "Job not found"}), 404
-    job.pop("_id", None)
     return jsonify(job), 200
 
 
+@funnel_bp.route("/api/funnels/generate-status/<job_id>/stream", methods=["GET", "OPTIONS"])
+@cross_origin(supports_credentials=True, origins=ALLOWED_ORIGINS)
+@requireAuth
+def stream_generation_status(job_id):
+    """
+    Server-sent events version of generate-status: a `progress` event with the
+    same JSON whenever the job changes, ending after done/error.
+    """
+    if request.method == "OPTIONS":
+        return "", 200
+    # Subscribe first so no change between the read and the subscription is lost
+    updates = funnel_job_watcher.subscribe(job_id)
+    job = funnel_jobs.status(job_id)
+    if not job:
+        funnel_job_watcher.unsubscribe(job_id, updates)
+        return jsonify({"error": "Job not found"}), 404
+
+    def events():
+        try:
+            yield format_event("progress", job)
+            if job.get("status") not in FINISHED_STATUSES:
+                yield from drain(updates, max_seconds=FUNNEL_PROGRESS_STREAM_SECONDS)
+        finally:
+            funnel_job_watcher.unsubscribe(job_id, updates)
+
+    return sse_response(events())
+
+
 def _generate_single_survey(
     api_key, survey_name, survey_purpose, key_topics, survey_type,
     funnel_plan, owner_user_id, funnel_id, layer_index, original_prompt,
     job_id=None, qualification_flag=None, questions_asked_so_far=None
 ):
     """Generate one survey (screening or job) and save to DB. Returns the saved doc."""
-    from utils.short_id import generate_short_id
+    from id_allocator import id_allocator
 
     job_profiles_summary = ""
     if survey_type == "screening":
@@ -634,23 +789,20 @@ STRICT RULES:
 - If user wrote "Select all that apply" → use type "multi_select" with allowMultiple: true
 - If user wrote "Select up to N" → use type "multi_select" with allowMultiple: true"""
 
-    resp = http_requests.post(
-        "https://api.openai.com/v1/chat/completions",
+    content = complete(
+        prompt,
+        model="gpt-4o",
+        temperature=0.2,
+        max_tokens=4000,
+        response_format={"type": "json_object"},
         timeout=40,
-        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-        json={
-            "model": "gpt-4o",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.2,
-            "max_tokens": 4000,
-            "response_format": {"type": "json_object"}
-        }
+        priority=BACKGROUND,
+        api_key=api_key,
+        user_id=owner_user_id,
+        tag="funnel.generate_survey",
     )
 
-    if resp.status_code != 200:
-        raise Exception(f"AI API error {resp.status_code}: {resp.text[:200]}")
-
-    survey_data = json.loads(resp.json()["choices"][0]["message"]["content"])
+    survey_data = json.loads(content)
     raw_questions = survey_data.get("questions", [])
     # Guard: AI sometimes returns a list with strings or nested dicts — keep only dicts
     questions = [q for q in raw_questions if isinstance(q, dict)]
@@ -711,13 +863,11 @@ STRICT RULES:
         if q.get("type") == "multi_select":
             q["allowMultiple"] = True
 
-    short_id = generate_short_id(5)
     survey_id = f"fnl_{funnel_id}_{job_id or f'screening_{layer_index}'}_{uuid.uuid4().hex[:6]}"
 
     survey_doc = {
         "_id": survey_id,
         "id": survey_id,
-        "short_id": short_id,
         "title": survey_data.get("title", survey_name),
         "questions": questions,
         "template_type": "basic",
@@ -732,7 +882,8 @@ STRICT RULES:
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
 
-    db.surveys.insert_one(survey_doc)
+    # short_id is allocated on insert; the unique index catches legacy clashes
+    id_allocator.insert_with_id("survey", "surveys", survey_doc, "short_id")
     return survey_doc
 
 
@@ -805,21 +956,20 @@ Return ONLY valid JSON in this exact structure:
 
     def _call_scoring_api(prompt_text):
         """Call the scoring API with a higher token budget and a JSON-parse fallback."""
-        r = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            timeout=60,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "gpt-4o",
-                "messages": [{"role": "user", "content": prompt_text}],
-                "temperature": 0.1,
-                "max_tokens": 8000,  # raised from 4000 — large funnels need room
-                "response_format": {"type": "json_object"}
-            }
-        )
-        if r.status_code != 200:
-            raise Exception(f"Scoring matrix API error {r.status_code}: {r.text[:200]}")
-        raw = r.json()["choices"][0]["message"]["content"]
+        try:
+            raw = complete(
+                prompt_text,
+                model="gpt-4o",
+                temperature=0.1,
+                max_tokens=8000,  # raised from 4000 — large funnels need room
+                response_format={"type": "json_object"},
+                timeout=60,
+                priority=BACKGROUND,
+                api_key=api_key,
+                tag="funnel.scoring_matrix",
+            )
+        except AIGatewayError as e:
+            raise Exception(f"Scoring matrix {e}")
         try:
             return json.loads(raw).get("scoring_matrix", [])
         except json.JSONDecodeError:
@@ -1013,8 +1163,9 @@ def delete_funnel(funnel_id):
         result = db.surveys.delete_many({"id": {"$in": survey_ids_to_delete}})
         deleted_surveys = result.deleted_count
 
-    # Delete funnel sessions
+    # Delete funnel sessions and their counters
     db.funnel_sessions.delete_many({"funnel_id": funnel_id})
+    db.funnel_stats.delete_one({"funnel_id": funnel_id})
 
     # Delete the funnel
     db.funnels.delete_one({"funnel_id": funnel_id})
@@ -1149,31 +1300,41 @@ def update_option_score(funnel_id):
 @cross_origin(supports_credentials=True, origins=ALLOWED_ORIGINS)
 @requireAuth
 def get_funnel_analytics(funnel_id):
-    """Basic funnel analytics — completion rates, job match distribution."""
+    """
+    Funnel analytics — completion rates, screening drop-off, job match distribution.
+    Served from the funnel_stats counters; ?recompute=1 rebuilds them by aggregation.
+    """
     if request.method == "OPTIONS":
         return "", 200
 
-    sessions = list(db.funnel_sessions.find({"funnel_id": funnel_id}))
+    recompute = request.args.get("recompute", "").lower() in ("1", "true")
+    stats = get_funnel_stats(funnel_id, recompute=recompute)
 
-    total = len(sessions)
-    completed = sum(1 for s in sessions if s.get("status") == "completed")
-    terminated = sum(1 for s in sessions if s.get("status") == "terminated")
-    no_match = sum(1 for s in sessions if s.get("status") == "no_match")
+    funnel = db.funnels.find_one({"funnel_id": funnel_id}, {"screening_surveys": 1})
+    layer_count = len(funnel.get("screening_surveys", [])) if funnel else 0
 
-    job_matches: dict = {}
-    for s in sessions:
-        matched = s.get("matched_job")
-        if matched:
-            job_matches[matched] = job_matches.get(matched, 0) + 1
+    status_counts = stats.get("status_counts", {})
+    total = stats.get("total_sessions", 0)
+    completed = status_counts.get("completed", 0)
+    job_matches = stats.get("job_matches", {})
+    matched_total = sum(job_matches.values())
 
     return jsonify({
         "funnel_id": funnel_id,
         "total_sessions": total,
         "completed": completed,
-        "terminated": terminated,
-        "no_match": no_match,
+        "terminated": status_counts.get("terminated", 0),
+        "no_match": status_counts.get("no_match", 0),
+        "in_progress": status_counts.get("screening", 0) + status_counts.get("job_phase", 0),
         "completion_rate": round(completed / total * 100, 1) if total else 0,
-        "job_match_distribution": job_matches
+        "status_counts": status_counts,
+        "screening_dropoff": build_screening_dropoff(stats, layer_count),
+        "job_match_distribution": job_matches,
+        "job_match_percentages": {
+            job: round(count / matched_total * 100, 1) for job, count in job_matches.items()
+        } if matched_total else {},
+        "job_attempts": stats.get("job_attempts", {}),
+        "stats_updated_at": stats.get("updated_at")
     }), 200
 
 
@@ -1599,23 +1760,21 @@ Return ONLY valid JSON:
 Use "_{job_id}" as the key for each score."""
 
     try:
-        resp = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            timeout=30,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.1,
-                "max_tokens": 2000,
-                "response_format": {"type": "json_object"}
-            }
-        )
-
-        if resp.status_code != 200:
-            return jsonify({"error": f"AI error: {resp.status_code}"}), 502
+        try:
+            content = complete(
+                prompt,
+                model="gpt-4o-mini",
+                temperature=0.1,
+                max_tokens=2000,
+                response_format={"type": "json_object"},
+                timeout=30,
+                api_key=api_key,
+                tag="funnel.job_signals",
+            )
+        except AIGatewayError as e:
+            return jsonify({"error": f"AI error: {e.status_code or e}"}), 502
 
-        result = json.loads(resp.json()["choices"][0]["message"]["content"])
+        result = json.loads(content)
         signals = result.get("signals", [])
 
         # Apply to questions
@@ -1685,25 +1844,23 @@ Prompt:
 Return ONLY JSON: {{"is_funnel": true/false, "confidence": 0-100, "reason": "one sentence why"}}"""
 
     try:
-        resp = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
+        content = complete(
+            detection_prompt,
+            model="gpt-4o-mini",
+            temperature=0.0,
+            max_tokens=80,
+            response_format={"type": "json_object"},
             timeout=8,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": detection_prompt}],
-                "temperature": 0.0,
-                "max_tokens": 80,
-                "response_format": {"type": "json_object"}
-            }
+            api_key=api_key,
+            tag="funnel.detect",
+            cache_ttl=STRUCTURED_TTL_SECONDS,
         )
-        if resp.status_code == 200:
-            result = json.loads(resp.json()["choices"][0]["message"]["content"])
-            return jsonify({
-                "is_funnel": bool(result.get("is_funnel", False)),
-                "confidence": int(result.get("confidence", 0)),
-                "reason": result.get("reason", "")
-            }), 200
+        result = json.loads(content)
+        return jsonify({
+            "is_funnel": bool(result.get("is_funnel", False)),
+            "confidence": int(result.get("confidence", 0)),
+            "reason": result.get("reason", "")
+        }), 200
     except Exception as e:
         print(f"⚠️ detect_funnel_prompt error: {e}")
 
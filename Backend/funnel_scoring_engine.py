@@ -4,13 +4,18 @@ Handles per-answer scoring, screening checks, job queue building,
 cascade logic, and AI-based job survey evaluation.
 """
 
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from typing import Dict, List, Optional
+from pymongo import ReturnDocument
 from mongodb_config import db
+from ai_gateway import complete
+from utils.mongo_keys import encode_key, decode_keys
 import os
 import json
-import requests as http_requests
+import time
 import uuid
+import threading
 
 
 # ─────────────────────────────────────────────
@@ -255,35 +260,302 @@ Return ONLY valid JSON, no markdown:
 {{"verdict": "pass", "reason": "Candidate has 10+ years with strong MIS and stakeholder management experience", "confidence": 85}}"""
 
     try:
-        resp = http_requests.post(
-            "https://api.openai.com/v1/chat/completions",
+        content = complete(
+            prompt,
+            model="gpt-4o-mini",
+            temperature=0.1,
+            max_tokens=200,
             timeout=20,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.1,
-                "max_tokens": 200
-            }
-        )
-        if resp.status_code == 200:
-            content = resp.json()["choices"][0]["message"]["content"].strip()
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-            result = json.loads(content.strip())
-            return {
-                "verdict": result.get("verdict", "fail"),
-                "reason": result.get("reason", ""),
-                "confidence": result.get("confidence", 70)
-            }
+            api_key=api_key,
+            tag="funnel.evaluate_job",
+        ).strip()
+        if content.startswith("```"):
+            content = content.split("```")[1]
+            if content.startswith("json"):
+                content = content[4:]
+        result = json.loads(content.strip())
+        return {
+            "verdict": result.get("verdict", "fail"),
+            "reason": result.get("reason", ""),
+            "confidence": result.get("confidence", 70)
+        }
     except Exception as e:
         print(f"⚠️ AI job evaluation error: {e}")
 
     return {"verdict": "fail", "reason": "Evaluation error — defaulting to fail", "confidence": 0}
 
 
+# ─────────────────────────────────────────────
+#  FUNNEL STATS COUNTERS
+# ─────────────────────────────────────────────
+# funnel_stats holds one document per funnel with counters that are bumped
+# on every session state transition, so analytics never scan funnel_sessions:
+#   total_sessions, status_counts.<status>, layers.<i>.passed|terminated,
+#   job_matches.<job_id>, job_attempts.<job_id>.pass|fail
+# Job ids come from the AI plan, so they are stored through encode_key and
+# decoded again by get_funnel_stats.
+#
+# A session write and its counter bump are two operations, so session writes
+# run inside _counted_writes: it pushes a lease onto write_leases before the
+# first session write, and the bumps collected meanwhile are applied in one
+# $inc that also pulls the lease and increments `version`.
+# recompute_funnel_stats only stores while no unexpired lease is held and the
+# version is the one it read, so a session is never both aggregated and bumped.
+
+# Attempts at storing recomputed stats before giving up on concurrent bumps
+RECOMPUTE_ATTEMPTS = 5
+# How long a submission may hold off recomputes; covers a process that died mid-write
+WRITE_LEASE_SECONDS = 30
+
+# Counter deltas of the _counted_writes block running on this thread
+_open_writes = threading.local()
+
+
+def _apply_funnel_counters(funnel_id: str, inc: Dict[str, int], lease_id: Optional[str] = None):
+    """Atomically apply $inc deltas to a funnel's counters document, releasing a write lease."""
+    if not funnel_id or not (inc or lease_id):
+        return
+    update = {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+    if inc:
+        update["$inc"] = {**inc, "version": 1}
+    if lease_id:
+        update["$pull"] = {"write_leases": {"id": lease_id}}
+    try:
+        db.funnel_stats.update_one({"funnel_id": funnel_id}, update, upsert=True)
+    except Exception as e:
+        # Counters are rebuilt by recompute_funnel_stats, never block the submission
+        print(f"⚠️ [Funnel] Stats counter update failed for {funnel_id}: {e}")
+
+
+@contextmanager
+def _counted_writes(funnel_id: str):
+    """Hold a funnel_stats write lease around session writes; bumps inside are applied on exit."""
+    if getattr(_open_writes, "funnel_id", None) == funnel_id:
+        yield
+        return
+    lease_id = uuid.uuid4().hex
+    try:
+        db.funnel_stats.update_one(
+            {"funnel_id": funnel_id},
+            {"$push": {"write_leases": {"id": lease_id, "until": time.time() + WRITE_LEASE_SECONDS}}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"⚠️ [Funnel] Stats write lease failed for {funnel_id}: {e}")
+        lease_id = None
+    _open_writes.funnel_id, _open_writes.inc = funnel_id, {}
+    try:
+        yield
+    finally:
+        inc = _open_writes.inc
+        _open_writes.funnel_id, _open_writes.inc = None, None
+        _apply_funnel_counters(funnel_id, inc, lease_id)
+
+
+def _bump_funnel_counters(funnel_id: str, inc: Dict[str, int]):
+    """Apply $inc deltas now, or on exit of the _counted_writes block for this funnel."""
+    if getattr(_open_writes, "funnel_id", None) == funnel_id:
+        for field, delta in inc.items():
+            _open_writes.inc[field] = _open_writes.inc.get(field, 0) + delta
+        return
+    _apply_funnel_counters(funnel_id, inc)
+
+
+def _record_funnel_transition(funnel_id: str, prev_status: Optional[str], new_status: str,
+                              extra_inc: Optional[Dict[str, int]] = None):
+    """Apply the counter deltas for one session moving prev_status → new_status."""
+    inc = dict(extra_inc or {})
+    if prev_status is None:
+        inc["total_sessions"] = 1
+    if prev_status != new_status:
+        if prev_status:
+            inc[f"status_counts.{prev_status}"] = -1
+        inc[f"status_counts.{new_status}"] = 1
+    _bump_funnel_counters(funnel_id, inc)
+
+
+def _transition_session(funnel_id: str, funnel_session_id: str, update: dict,
+                        new_status: str, upsert: bool = False,
+                        extra_inc: Optional[Dict[str, int]] = None) -> Optional[dict]:
+    """
+    Update a funnel session and bump funnel counters from the exact previous state.
+    Returns the session as it was before the update (None if it was just created).
+    """
+    with _counted_writes(funnel_id):
+        before = db.funnel_sessions.find_one_and_update(
+            {"funnel_session_id": funnel_session_id},
+            update,
+            projection={"status": 1},
+            upsert=upsert,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None and not upsert:
+            return None
+        prev_status = before.get("status") if before else None
+        _record_funnel_transition(funnel_id, prev_status, new_status, extra_inc)
+    return before
+
+
+def recompute_funnel_stats(funnel_id: str) -> dict:
+    """
+    Rebuild a funnel's counters from funnel_sessions with one aggregation.
+    Used when the counters document is missing or an admin asks for a refresh.
+
+    The stored document is only replaced if its version is still the one read
+    before aggregating; a bump in between means aggregating again. If bumps
+    keep winning, the stats are returned without being stored.
+    """
+    for attempt in range(RECOMPUTE_ATTEMPTS):
+        now = time.time()
+        fence = db.funnel_stats.find_one({"funnel_id": funnel_id}, {"version": 1, "write_leases": 1})
+        if fence is None:
+            stats = _aggregate_funnel_stats(funnel_id)
+            # $setOnInsert: if a write created the document meanwhile, aggregate again
+            result = db.funnel_stats.update_one(
+                {"funnel_id": funnel_id}, {"$setOnInsert": {**stats, "version": 0}}, upsert=True
+            )
+            if result.upserted_id is not None:
+                return stats
+        elif not any(lease.get("until", 0) > now for lease in fence.get("write_leases") or []):
+            stats = _aggregate_funnel_stats(funnel_id)
+            version = fence.get("version")
+            # The replacement drops write_leases, which only holds expired leases here
+            result = db.funnel_stats.replace_one(
+                {
+                    "funnel_id": funnel_id,
+                    "version": version,
+                    "write_leases": {"$not": {"$elemMatch": {"until": {"$gt": now}}}},
+                },
+                {**stats, "version": version or 0}
+            )
+            if result.matched_count:
+                return stats
+        time.sleep(0.05 * (attempt + 1))
+
+    stats = _aggregate_funnel_stats(funnel_id)
+    print(f"⚠️ [Funnel] Stats recompute for {funnel_id} kept racing counter updates; not stored")
+    return stats
+
+
+def _aggregate_funnel_stats(funnel_id: str) -> dict:
+    pipeline = [
+        {"$match": {"funnel_id": funnel_id}},
+        {"$facet": {
+            "status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "matches": [
+                {"$match": {"matched_job": {"$nin": [None, ""]}}},
+                {"$group": {"_id": "$matched_job", "count": {"$sum": 1}}}
+            ],
+            "layers_passed": [
+                {"$unwind": "$layers_completed"},
+                {"$group": {"_id": "$layers_completed.layer", "count": {"$sum": 1}}}
+            ],
+            "layers_terminated": [
+                {"$match": {"status": "terminated"}},
+                {"$group": {
+                    # Older sessions lack terminated_layer; layers pass in order,
+                    # so the number completed is the layer they stopped at
+                    "_id": {"$ifNull": ["$terminated_layer", {"$size": {"$ifNull": ["$layers_completed", []]}}]},
+                    "count": {"$sum": 1}
+                }}
+            ],
+            "attempts": [
+                {"$unwind": "$job_attempts"},
+                {"$group": {
+                    "_id": {"job": "$job_attempts.job_id", "verdict": "$job_attempts.ai_verdict"},
+                    "count": {"$sum": 1}
+                }}
+            ],
+        }}
+    ]
+    facets = next(db.funnel_sessions.aggregate(pipeline), {})
+
+    status_counts = {}
+    total = 0
+    for row in facets.get("status", []):
+        total += row["count"]
+        if row["_id"]:
+            status_counts[row["_id"]] = row["count"]
+
+    layers: Dict[str, dict] = {}
+    for row in facets.get("layers_passed", []):
+        if row["_id"] is not None:
+            layers.setdefault(str(row["_id"]), {"passed": 0, "terminated": 0})["passed"] = row["count"]
+    for row in facets.get("layers_terminated", []):
+        layers.setdefault(str(row["_id"]), {"passed": 0, "terminated": 0})["terminated"] = row["count"]
+
+    job_attempts: Dict[str, dict] = {}
+    for row in facets.get("attempts", []):
+        job = row["_id"].get("job")
+        verdict = "pass" if row["_id"].get("verdict") == "pass" else "fail"
+        if job:
+            job_attempts.setdefault(encode_key(job), {"pass": 0, "fail": 0})[verdict] += row["count"]
+
+    stats = {
+        "funnel_id": funnel_id,
+        "total_sessions": total,
+        "status_counts": status_counts,
+        "layers": layers,
+        "job_matches": {encode_key(row["_id"]): row["count"] for row in facets.get("matches", [])},
+        "job_attempts": job_attempts,
+        "recomputed_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    return stats
+
+
+def get_funnel_stats(funnel_id: str, recompute: bool = False) -> dict:
+    """Return a funnel's counters, rebuilding them by aggregation if absent."""
+    stats = None if recompute else db.funnel_stats.find_one({"funnel_id": funnel_id}, {"_id": 0})
+    if not stats or "recomputed_at" not in stats:
+        stats = recompute_funnel_stats(funnel_id)
+    return {
+        **stats,
+        "job_matches": decode_keys(stats.get("job_matches")),
+        "job_attempts": decode_keys(stats.get("job_attempts")),
+    }
+
+
+def get_funnel_session_totals(funnel_ids: List[str]) -> Dict[str, int]:
+    """Session totals for many funnels in one query, falling back to aggregation for gaps."""
+    totals = {
+        doc["funnel_id"]: doc.get("total_sessions", 0)
+        for doc in db.funnel_stats.find(
+            {"funnel_id": {"$in": funnel_ids}, "recomputed_at": {"$exists": True}},
+            {"funnel_id": 1, "total_sessions": 1}
+        )
+    }
+    missing = [fid for fid in funnel_ids if fid not in totals]
+    if missing:
+        for row in db.funnel_sessions.aggregate([
+            {"$match": {"funnel_id": {"$in": missing}}},
+            {"$group": {"_id": "$funnel_id", "count": {"$sum": 1}}}
+        ]):
+            totals[row["_id"]] = row["count"]
+    return totals
+
+
+def build_screening_dropoff(stats: dict, layer_count: int) -> List[dict]:
+    """Step-by-step screening funnel: how many entered, passed and dropped at each layer."""
+    layers = stats.get("layers", {})
+    entered = stats.get("total_sessions", 0)
+    steps = []
+    for i in range(max(layer_count, len(layers))):
+        layer = layers.get(str(i), {})
+        passed = layer.get("passed", 0)
+        terminated = layer.get("terminated", 0)
+        steps.append({
+            "layer": i,
+            "entered": entered,
+            "passed": passed,
+            "terminated": terminated,
+            "abandoned": max(entered - passed - terminated, 0),
+            "pass_rate": round(passed / entered * 100, 1) if entered else 0,
+        })
+        entered = passed
+    return steps
+
+
 # ─────────────────────────────────────────────
 #  FULL SCREENING SURVEY SUBMISSION PROCESSOR
 # ─────────────────────────────────────────────
@@ -316,14 +588,18 @@ def process_screening_survey_submission(
     screen_result = run_screening_check(questions, answers)
     if not screen_result["passed"]:
         # Save terminate status
-        db.funnel_sessions.update_one(
-            {"funnel_session_id": funnel_session_id},
+        _transition_session(
+            funnel_id, funnel_session_id,
             {"$set": {
                 "status": "terminated",
+                "funnel_id": funnel_id,
+                "terminated_layer": layer_index,
                 "terminate_reason": screen_result["reason"],
                 "terminated_at": datetime.now(timezone.utc).isoformat()
             }},
-            upsert=True
+            new_status="terminated",
+            upsert=True,
+            extra_inc={f"layers.{layer_index}.terminated": 1}
         )
         fallback_url = funnel.get("fallback_url", "")
         return {
@@ -336,89 +612,95 @@ def process_screening_survey_submission(
     new_scores = calculate_scores_from_answers(questions, answers)
     print(f"📊 [Funnel] Layer {layer_index} scores: {new_scores}")
 
-    # Step 3: Accumulate
-    cumulative = accumulate_scores(funnel_session_id, new_scores)
-
-    # Step 4: Record this layer
-    layer_record = {
-        "layer": layer_index,
-        "phase": "screening",
-        "survey_id": survey_id,
-        "answers": answers,
-        "scores_added": new_scores,
-        "screening_passed": True,
-        "completed_at": datetime.now(timezone.utc).isoformat()
-    }
-    db.funnel_sessions.update_one(
-        {"funnel_session_id": funnel_session_id},
-        {
-            "$push": {"layers_completed": layer_record},
-            "$set": {
-                "current_layer": layer_index + 1,
-                "status": "screening",
-                "user_info": user_info,
-                "funnel_id": funnel_id,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-        },
-        upsert=True
-    )
+    # Session writes and their counter bumps are fenced against recompute_funnel_stats
+    with _counted_writes(funnel_id):
+        # Step 3: Accumulate
+        cumulative = accumulate_scores(funnel_session_id, new_scores)
+
+        # Step 4: Record this layer
+        layer_record = {
+            "layer": layer_index,
+            "phase": "screening",
+            "survey_id": survey_id,
+            "answers": answers,
+            "scores_added": new_scores,
+            "screening_passed": True,
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        }
+        _transition_session(
+            funnel_id, funnel_session_id,
+            {
+                "$push": {"layers_completed": layer_record},
+                "$set": {
+                    "current_layer": layer_index + 1,
+                    "status": "screening",
+                    "user_info": user_info,
+                    "funnel_id": funnel_id,
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }
+            },
+            new_status="screening",
+            upsert=True,
+            extra_inc={f"layers.{layer_index}.passed": 1}
+        )
 
-    # Step 5: Check if more screening surveys
-    screening_surveys = funnel.get("screening_surveys", [])
-    next_layer = layer_index + 1
+        # Step 5: Check if more screening surveys
+        screening_surveys = funnel.get("screening_surveys", [])
+        next_layer = layer_index + 1
 
-    if next_layer < len(screening_surveys):
-        next_survey_id = screening_surveys[next_layer]["survey_id"]
-        return {
-            "action": "next_screening",
-            "next_survey_id": next_survey_id,
-            "next_layer": next_layer,
-            "funnel_session_id": funnel_session_id,
-            "cumulative_scores": cumulative
-        }
+        if next_layer < len(screening_surveys):
+            next_survey_id = screening_surveys[next_layer]["survey_id"]
+            return {
+                "action": "next_screening",
+                "next_survey_id": next_survey_id,
+                "next_layer": next_layer,
+                "funnel_session_id": funnel_session_id,
+                "cumulative_scores": cumulative
+            }
 
-    # All screening done — build job queue
-    job_queue = build_job_queue(cumulative, funnel)
-    print(f"🎯 [Funnel] Job queue built: {job_queue}")
+        # All screening done — build job queue
+        job_queue = build_job_queue(cumulative, funnel)
+        print(f"🎯 [Funnel] Job queue built: {job_queue}")
+
+        if not job_queue:
+            fallback_url = funnel.get("fallback_url", "")
+            _transition_session(
+                funnel_id, funnel_session_id,
+                {"$set": {"status": "no_match", "job_queue": [], "queue_position": 0}},
+                new_status="no_match"
+            )
+            return {
+                "action": "no_match",
+                "redirect_url": _ensure_https(fallback_url),
+                "cumulative_scores": cumulative
+            }
 
-    if not job_queue:
-        fallback_url = funnel.get("fallback_url", "")
-        db.funnel_sessions.update_one(
-            {"funnel_session_id": funnel_session_id},
-            {"$set": {"status": "no_match", "job_queue": [], "queue_position": 0}}
+        # Save queue to session
+        _transition_session(
+            funnel_id, funnel_session_id,
+            {"$set": {
+                "job_queue": job_queue,
+                "queue_position": 0,
+                "status": "job_phase",
+                "phase": "job_surveys",
+                "cumulative_scores": cumulative
+            }},
+            new_status="job_phase"
         )
-        return {
-            "action": "no_match",
-            "redirect_url": _ensure_https(fallback_url),
-            "cumulative_scores": cumulative
-        }
 
-    # Save queue to session
-    db.funnel_sessions.update_one(
-        {"funnel_session_id": funnel_session_id},
-        {"$set": {
+        first_job = job_queue[0]
+        job_config = funnel.get("job_surveys", {}).get(first_job, {})
+        first_job_survey_id = job_config.get("survey_id", "")
+
+        return {
+            "action": "go_to_job",
+            "job_id": first_job,
+            "job_survey_id": first_job_survey_id,
             "job_queue": job_queue,
             "queue_position": 0,
-            "status": "job_phase",
-            "phase": "job_surveys",
+            "funnel_session_id": funnel_session_id,
             "cumulative_scores": cumulative
-        }}
-    )
-
-    first_job = job_queue[0]
-    job_config = funnel.get("job_surveys", {}).get(first_job, {})
-    first_job_survey_id = job_config.get("survey_id", "")
-
-    return {
-        "action": "go_to_job",
-        "job_id": first_job,
-        "job_survey_id": first_job_survey_id,
-        "job_queue": job_queue,
-        "queue_position": 0,
-        "funnel_session_id": funnel_session_id,
-        "cumulative_scores": cumulative
-    }
+        }
 
 
 # ─────────────────────────────────────────────
@@ -463,139 +745,145 @@ def process_job_survey_submission(
     eval_result = ai_evaluate_job_survey(job_id, job_criteria, answers, funnel_context, job_questions)
     print(f"🤖 [Funnel] AI eval for {job_id}: {eval_result['verdict']} ({eval_result['confidence']}%)")
 
-    # Record this job attempt
-    job_record = {
-        "job_id": job_id,
-        "survey_id": job_survey_id,
-        "answers": answers,
-        "ai_verdict": eval_result["verdict"],
-        "ai_reason": eval_result["reason"],
-        "ai_confidence": eval_result["confidence"],
-        "completed_at": datetime.now(timezone.utc).isoformat()
-    }
-    db.funnel_sessions.update_one(
-        {"funnel_session_id": funnel_session_id},
-        {"$push": {"job_attempts": job_record}}
-    )
-
-    if eval_result["verdict"] == "pass":
-        confidence = eval_result["confidence"]  # 0-100
-
-        # ── Threshold-based redirect selection ──────────────────────────────
-        # Admin can configure multiple redirect URLs with score thresholds.
-        # redirect_rules: [{"operator": ">=", "threshold": 80, "url": "...", "label": "Strong match"},
-        #                   {"operator": ">=", "threshold": 60, "url": "...", "label": "Good match"},
-        #                   {"operator": "<",  "threshold": 60, "url": "...", "label": "Weak match"}]
-        # Rules are evaluated in order — first match wins.
-        redirect_rules = job_config.get("redirect_rules", [])
-        redirect_url = job_config.get("redirect_url", "")  # fallback single URL
-
-        # ── Ensure URL has a scheme ─────────────────────────────────────────
-        redirect_url = _ensure_https(redirect_url)
-        redirect_bucket_label = "default"
-        redirect_reason = f"AI confidence: {confidence}%"
-
-        if redirect_rules:
-            for rule in redirect_rules:
-                operator = rule.get("operator", ">=")
-                threshold = float(rule.get("threshold", 0))
-                rule_url = rule.get("url", "")
-                rule_label = rule.get("label", f"{operator}{threshold}%")
-
-                match = False
-                if operator == ">=":
-                    match = confidence >= threshold
-                elif operator == ">":
-                    match = confidence > threshold
-                elif operator == "<=":
-                    match = confidence <= threshold
-                elif operator == "<":
-                    match = confidence < threshold
-                elif operator == "==":
-                    match = confidence == threshold
-
-                if match and rule_url:
-                    redirect_url = _ensure_https(rule_url)
-                    redirect_bucket_label = rule_label
-                    redirect_reason = f"Score {confidence}% matched rule: {operator}{threshold}% → {rule_label}"
-                    break
-
-        print(f"🎯 [Funnel] Redirect bucket: {redirect_bucket_label} ({redirect_reason})")
-
+    # Session writes and their counter bumps are fenced against recompute_funnel_stats
+    with _counted_writes(funnel_id):
+        # Record this job attempt
+        job_record = {
+            "job_id": job_id,
+            "survey_id": job_survey_id,
+            "answers": answers,
+            "ai_verdict": eval_result["verdict"],
+            "ai_reason": eval_result["reason"],
+            "ai_confidence": eval_result["confidence"],
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        }
         db.funnel_sessions.update_one(
             {"funnel_session_id": funnel_session_id},
-            {"$set": {
-                "status": "completed",
-                "matched_job": job_id,
-                "final_redirect_url": redirect_url,
+            {"$push": {"job_attempts": job_record}}
+        )
+
+        if eval_result["verdict"] == "pass":
+            confidence = eval_result["confidence"]  # 0-100
+
+            # ── Threshold-based redirect selection ──────────────────────────────
+            # Admin can configure multiple redirect URLs with score thresholds.
+            # redirect_rules: [{"operator": ">=", "threshold": 80, "url": "...", "label": "Strong match"},
+            #                   {"operator": ">=", "threshold": 60, "url": "...", "label": "Good match"},
+            #                   {"operator": "<",  "threshold": 60, "url": "...", "label": "Weak match"}]
+            # Rules are evaluated in order — first match wins.
+            redirect_rules = job_config.get("redirect_rules", [])
+            redirect_url = job_config.get("redirect_url", "")  # fallback single URL
+
+            # ── Ensure URL has a scheme ─────────────────────────────────────────
+            redirect_url = _ensure_https(redirect_url)
+            redirect_bucket_label = "default"
+            redirect_reason = f"AI confidence: {confidence}%"
+
+            if redirect_rules:
+                for rule in redirect_rules:
+                    operator = rule.get("operator", ">=")
+                    threshold = float(rule.get("threshold", 0))
+                    rule_url = rule.get("url", "")
+                    rule_label = rule.get("label", f"{operator}{threshold}%")
+
+                    match = False
+                    if operator == ">=":
+                        match = confidence >= threshold
+                    elif operator == ">":
+                        match = confidence > threshold
+                    elif operator == "<=":
+                        match = confidence <= threshold
+                    elif operator == "<":
+                        match = confidence < threshold
+                    elif operator == "==":
+                        match = confidence == threshold
+
+                    if match and rule_url:
+                        redirect_url = _ensure_https(rule_url)
+                        redirect_bucket_label = rule_label
+                        redirect_reason = f"Score {confidence}% matched rule: {operator}{threshold}% → {rule_label}"
+                        break
+
+            print(f"🎯 [Funnel] Redirect bucket: {redirect_bucket_label} ({redirect_reason})")
+
+            _transition_session(
+                funnel_id, funnel_session_id,
+                {"$set": {
+                    "status": "completed",
+                    "matched_job": job_id,
+                    "final_redirect_url": redirect_url,
+                    "redirect_bucket": redirect_bucket_label,
+                    "redirect_reason": redirect_reason,
+                    "ai_confidence": confidence,
+                    "completed_at": datetime.now(timezone.utc).isoformat()
+                }},
+                new_status="completed",
+                extra_inc={f"job_matches.{encode_key(job_id)}": 1, f"job_attempts.{encode_key(job_id)}.pass": 1}
+            )
+            return {
+                "action": "pass",
+                "job_id": job_id,
+                "redirect_url": redirect_url,
                 "redirect_bucket": redirect_bucket_label,
                 "redirect_reason": redirect_reason,
                 "ai_confidence": confidence,
-                "completed_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-        return {
-            "action": "pass",
-            "job_id": job_id,
-            "redirect_url": redirect_url,
-            "redirect_bucket": redirect_bucket_label,
-            "redirect_reason": redirect_reason,
-            "ai_confidence": confidence,
-            "ai_reason": eval_result["reason"]
-        }
-
-    # FAIL — move to next job in queue
-    queue = session.get("job_queue", [])
-    current_pos = session.get("queue_position", 0)
-    failed_jobs = session.get("failed_jobs", [])
-    failed_jobs.append(job_id)
-    next_pos = current_pos + 1
+                "ai_reason": eval_result["reason"]
+            }
 
-    db.funnel_sessions.update_one(
-        {"funnel_session_id": funnel_session_id},
-        {"$set": {
-            "queue_position": next_pos,
-            "failed_jobs": failed_jobs
-        }}
-    )
+        # FAIL — move to next job in queue
+        queue = session.get("job_queue", [])
+        current_pos = session.get("queue_position", 0)
+        failed_jobs = session.get("failed_jobs", [])
+        failed_jobs.append(job_id)
+        next_pos = current_pos + 1
 
-    if next_pos >= len(queue):
-        # All jobs exhausted
-        fallback_url = funnel.get("fallback_url", "")
         db.funnel_sessions.update_one(
             {"funnel_session_id": funnel_session_id},
-            {"$set": {"status": "no_match", "completed_at": datetime.now(timezone.utc).isoformat()}}
+            {"$set": {
+                "queue_position": next_pos,
+                "failed_jobs": failed_jobs
+            }}
         )
-        return {
-            "action": "all_failed",
-            "redirect_url": _ensure_https(fallback_url),
-            "failed_jobs": failed_jobs,
-            "ai_reason": eval_result["reason"]
-        }
+        _bump_funnel_counters(funnel_id, {f"job_attempts.{encode_key(job_id)}.fail": 1})
+
+        if next_pos >= len(queue):
+            # All jobs exhausted
+            fallback_url = funnel.get("fallback_url", "")
+            _transition_session(
+                funnel_id, funnel_session_id,
+                {"$set": {"status": "no_match", "completed_at": datetime.now(timezone.utc).isoformat()}},
+                new_status="no_match"
+            )
+            return {
+                "action": "all_failed",
+                "redirect_url": _ensure_https(fallback_url),
+                "failed_jobs": failed_jobs,
+                "ai_reason": eval_result["reason"]
+            }
 
-    # There is a next job
-    next_job_id = queue[next_pos]
-    next_job_config = funnel.get("job_surveys", {}).get(next_job_id, {})
-    next_job_survey_id = next_job_config.get("survey_id", "")
+        # There is a next job
+        next_job_id = queue[next_pos]
+        next_job_config = funnel.get("job_surveys", {}).get(next_job_id, {})
+        next_job_survey_id = next_job_config.get("survey_id", "")
 
-    # Get transition page config for the FAILED job
-    transition = job_config.get("transition_page", {})
-    transition_enabled = transition.get("enabled", True)
+        # Get transition page config for the FAILED job
+        transition = job_config.get("transition_page", {})
+        transition_enabled = transition.get("enabled", True)
 
-    return {
-        "action": "next_job",
-        "failed_job_id": job_id,
-        "next_job_id": next_job_id,
-        "next_job_survey_id": next_job_survey_id,
-        "queue_position": next_pos,
-        "ai_reason": eval_result["reason"],
-        "transition_page": {
-            "enabled": transition_enabled,
-            "heading": transition.get("heading", "We found another opportunity for you!"),
-            "message": transition.get("message", "You didn't qualify for this role, but we have another great opportunity that matches your profile."),
-            "cta_text": transition.get("cta_text", "See Next Opportunity →"),
-            "auto_redirect_seconds": transition.get("auto_redirect_seconds", 5),
-            "show_next_job_name": transition.get("show_next_job_name", True),
-            "next_job_display_name": next_job_config.get("display_name", next_job_id)
+        return {
+            "action": "next_job",
+            "failed_job_id": job_id,
+            "next_job_id": next_job_id,
+            "next_job_survey_id": next_job_survey_id,
+            "queue_position": next_pos,
+            "ai_reason": eval_result["reason"],
+            "transition_page": {
+                "enabled": transition_enabled,
+                "heading": transition.get("heading", "We found another opportunity for you!"),
+                "message": transition.get("message", "You didn't qualify for this role, but we have another great opportunity that matches your profile."),
+                "cta_text": transition.get("cta_text", "See Next Opportunity →"),
+                "auto_redirect_seconds": transition.get("auto_redirect_seconds", 5),
+                "show_next_job_name": transition.get("show_next_job_name", True),
+                "next_job_display_name": next_job_config.get("display_name", next_job_id)
+            }
         }
-    }
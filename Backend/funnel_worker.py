@@ -0,0 +1,42 @@
+"""
+Funnel Worker
+Runs queued funnel generation jobs outside the web process.
+
+    python funnel_worker.py
+
+The web app only enqueues into funnel_generation_jobs; this process claims
+jobs, generates the surveys and writes progress back for
+/api/funnels/generate-status/<job_id>. Run as many as you like — each job is
+leased to one worker, and a job whose worker dies is picked up again from its
+last checkpoint once the lease runs out. Needs the same environment as the
+web service (MONGO_URI, OPENAI_API_KEY, AI_GATEWAY_*, SMTP_*).
+
+Also sends due scheduled emails on a background thread (see
+scheduled_email_worker.py).
+"""
+import signal
+import threading
+from job_queue import run_worker
+from funnel_api import funnel_jobs, FUNNEL_GENERATION_JOB, run_funnel_generation_job
+from scheduled_email_worker import start_scheduler_thread
+from index_registry import warn_missing_indexes
+
+
+def main():
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        # Claim nothing new; a job cut off mid-run resumes on another worker
+        print(f"🛑 [FunnelWorker] Signal {signum}, stopping after the current job")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    warn_missing_indexes([funnel_jobs.collection, "funnels", "funnel_stats", "scheduled_emails"])
+    start_scheduler_thread(stop)
+    run_worker(funnel_jobs, {FUNNEL_GENERATION_JOB: run_funnel_generation_job}, stop=stop)
+
+
+if __name__ == "__main__":
+    main()
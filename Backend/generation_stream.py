@@ -0,0 +1,184 @@
+"""
+Generation Stream
+Streaming mode for survey generation (POST /generate with
+Accept: text/event-stream or ?stream=1).
+
+The normal /generate handler runs unchanged on a worker thread; the request
+thread relays what it reports as server-sent events:
+
+    attempt    {"attempt": n}            a (re)try started — drop earlier partial questions
+    delta      {"text": "..."}           model output as it arrives
+    question   {"index": i, "question"}  a question the model has finished writing
+    done       {"status", "body"}        the same JSON /generate returns
+    error      {"status", "body"}        the same error JSON /generate returns
+
+Streamed questions are previews: the final list in `done` is deduplicated,
+trimmed and renumbered like a normal response.
+"""
+import re
+import json
+import queue
+import threading
+from typing import Callable, Optional
+from flask import current_app, copy_current_request_context
+from utils.sse import CLOSE, drain, sse_response
+
+_local = threading.local()
+
+# "3. How satisfied ..." — the start of a question in the numbered text format
+_QUESTION_START = re.compile(r"^\d+\.")
+
+
+def current() -> Optional["GenerationStream"]:
+    """The stream the running handler reports to, or None outside streaming mode."""
+    return getattr(_local, "stream", None)
+
+
+class QuestionScanner:
+    """
+    Picks finished questions out of partial model output.
+
+    JSON replies (a question array, or an object with a "questions" array)
+    yield each question object once its closing brace arrives. Numbered text
+    replies yield a question's text block once the next question begins.
+    """
+
+    def __init__(self, json_mode: bool):
+        self.json_mode = json_mode
+        self.buffer = ""
+        self.pos = 0
+        # JSON state
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.start = None
+        # Text state
+        self.block_start = None
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        return self._scan_json() if self.json_mode else self._scan_text()
+
+    def finish(self) -> list:
+        """Whatever complete item is left once the reply has ended."""
+        if self.json_mode or self.block_start is None:
+            return []
+        block = self.buffer[self.block_start:].strip()
+        self.block_start = None
+        return [block] if block else []
+
+    def _scan_json(self) -> list:
+        found = []
+        buf = self.buffer
+        for i in range(self.pos, len(buf)):
+            ch = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "[{":
+                # An object directly inside the top-level array, or inside the
+                # array that is a value of the top-level object
+                if ch == "{" and self.stack in (["["], ["{", "["]):
+                    self.start = i
+                self.stack.append(ch)
+            elif ch in "]}" and self.stack:
+                self.stack.pop()
+                if ch == "}" and self.start is not None and self.stack in (["["], ["{", "["]):
+                    try:
+                        item = json.loads(buf[self.start:i + 1])
+                        if isinstance(item, dict):
+                            found.append(item)
+                    except ValueError:
+                        pass
+                    self.start = None
+        self.pos = len(buf)
+        return found
+
+    def _scan_text(self) -> list:
+        found = []
+        # Only look at complete lines
+        end = self.buffer.rfind("\n") + 1
+        while self.pos < end:
+            line_end = self.buffer.index("\n", self.pos) + 1
+            line = self.buffer[self.pos:line_end].strip()
+            if _QUESTION_START.match(line):
+                if self.block_start is not None:
+                    block = self.buffer[self.block_start:self.pos].strip()
+                    if block:
+                        found.append(block)
+                self.block_start = self.pos
+            self.pos = line_end
+        return found
+
+
+class GenerationStream:
+    def __init__(self):
+        self.events = queue.Queue()
+        self.scanner = None
+        self.parse = None
+        self.count = 0
+
+    def emit(self, event: str, data):
+        self.events.put((event, data))
+
+    def begin_attempt(self, attempt: int, json_mode: bool, parse: Callable[[object, int], Optional[dict]]):
+        """
+        Start relaying a model call. `parse(item, index)` turns a raw scanned
+        item (dict or text block) into a question dict, or None to skip it.
+        """
+        self.scanner = QuestionScanner(json_mode)
+        self.parse = parse
+        self.count = 0
+        self.emit("attempt", {"attempt": attempt})
+
+    def delta(self, text: str):
+        """on_delta callback for ai_gateway.chat_completion."""
+        self.emit("delta", {"text": text})
+        if self.scanner:
+            self._questions(self.scanner.feed(text))
+
+    def end_attempt(self):
+        if self.scanner:
+            self._questions(self.scanner.finish())
+            self.scanner = None
+
+    def _questions(self, items: list):
+        for item in items:
+            try:
+                question = self.parse(item, self.count)
+            except Exception as e:
+                print(f"⚠️ [GenerationStream] Could not parse streamed question: {e}")
+                continue
+            if question:
+                self.emit("question", {"index": self.count, "question": question})
+                self.count += 1
+
+
+def stream_view(view, *args, **kwargs):
+    """Run `view` on a thread in streaming mode and return its SSE response."""
+    stream = GenerationStream()
+
+    @copy_current_request_context
+    def run():
+        _local.stream = stream
+        try:
+            resp = current_app.make_response(view(*args, **kwargs))
+            stream.emit(
+                "done" if resp.status_code < 400 else "error",
+                {"status": resp.status_code, "body": resp.get_json(silent=True)},
+            )
+        except Exception as e:
+            print(f"❌ [GenerationStream] Handler failed: {e}")
+            stream.emit("error", {"status": 500, "body": {"error": str(e)}})
+        finally:
+            _local.stream = None
+            stream.events.put(CLOSE)
+
+    threading.Thread(target=run, daemon=True, name="generate-stream").start()
+    return sse_response(drain(stream.events))
@@ -0,0 +1,151 @@
+"""
+Short-ID Allocator
+Collision-free public IDs (survey short IDs, masked links, referral codes,
+simpleUserId) without a read-before-write.
+
+Each namespace owns a counter document in `id_counters`. A process reserves a
+block of BLOCK_SIZE sequence numbers with one find_one_and_update and hands
+them out locally. Every sequence number n is mapped through a bijection of the
+namespace's ID space,
+
+    n → (n * multiplier + offset) mod space
+
+and then written in the namespace alphabet at a fixed width, so consecutive
+allocations do not look consecutive and two sequence numbers can never give
+the same ID. (This only spreads IDs out; it is not a secret.)
+
+IDs created before the allocator were random, so the rare clash with a legacy
+ID is caught by the unique index on the ID field: `insert_with_id` moves on to
+the next ID when that index rejects the insert.
+"""
+import os
+import math
+import string
+import threading
+from typing import Callable, Dict, Iterable, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from mongodb_config import db
+
+BLOCK_SIZE = int(os.environ.get("ID_ALLOCATOR_BLOCK_SIZE", "50"))
+
+# Give up on insert_with_id after this many legacy clashes in a row
+MAX_CLASHES = 8
+
+
+class Namespace:
+    def __init__(self, name: str, alphabet: str, length: int, start: int = 0,
+                 space: Optional[int] = None, numeric: bool = False):
+        """
+        Args:
+            alphabet: Symbols used for the encoding, in digit order
+            length: Fixed width of every ID
+            start: Added to the encoded value (numeric namespaces only)
+            space: Number of IDs, when smaller than len(alphabet) ** length
+            numeric: Return an int instead of a string
+        """
+        self.name = name
+        self.alphabet = alphabet
+        self.base = len(alphabet)
+        self.length = length
+        self.space = space or self.base ** length
+        self.start = start
+        self.numeric = numeric
+        self.multiplier = self._coprime(int(self.space * 0.6180339887))
+        self.offset = int(self.space * 0.4142135623)
+
+    def _coprime(self, candidate: int) -> int:
+        while math.gcd(candidate, self.space) != 1:
+            candidate += 1
+        return candidate
+
+    def encode(self, seq: int):
+        if seq >= self.space:
+            raise RuntimeError(f"ID namespace '{self.name}' is exhausted ({self.space} IDs)")
+        value = (seq * self.multiplier + self.offset) % self.space
+        if self.numeric:
+            return self.start + value
+        digits = []
+        for _ in range(self.length):
+            value, digit = divmod(value, self.base)
+            digits.append(self.alphabet[digit])
+        return "".join(reversed(digits))
+
+
+NAMESPACES: Dict[str, Namespace] = {
+    # /s/<short_id> survey links — validated by utils.short_id.is_valid_short_id
+    "survey": Namespace("survey", string.digits + string.ascii_uppercase, 5),
+    # /l/<short_id> masked links
+    "masked_link": Namespace("masked_link", string.digits + string.ascii_letters, 6),
+    # Promoter ref codes — no 0/O 1/I/L
+    "ref_code": Namespace("ref_code", "ABCDEFGHJKMNPQRSTUVWXYZ23456789", 7),
+    # Six-digit simpleUserId, 100000-999999
+    "user": Namespace("user", string.digits, 6, start=100000, space=900000, numeric=True),
+}
+
+
+class IdAllocator:
+    def __init__(self, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+        self._blocks: Dict[str, list] = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _reserve(self, name: str) -> list:
+        counter = db.id_counters.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"next": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        end = counter["next"]
+        return [end - self.block_size, end]
+
+    def next_seq(self, name: str) -> int:
+        with self._lock:
+            # Blocks reserved before gunicorn's fork must not be shared by the workers
+            if self._pid != os.getpid():
+                self._blocks = {}
+                self._pid = os.getpid()
+            block = self._blocks.get(name)
+            if block is None or block[0] >= block[1]:
+                block = self._blocks[name] = self._reserve(name)
+            seq = block[0]
+            block[0] += 1
+            return seq
+
+    def allocate(self, name: str):
+        """Next ID in a namespace (str, or int for numeric namespaces)."""
+        return NAMESPACES[name].encode(self.next_seq(name))
+
+    def insert_with_id(self, name: str, collection: str, doc: dict, field: str,
+                       mirror: Iterable[str] = (), derive: Optional[Callable[[dict, object], None]] = None):
+        """
+        Allocate an ID into doc[field] (and each `mirror` field) and insert doc,
+        taking the next ID if the unique index on `field` reports a clash with a
+        legacy ID. `derive(doc, id)` fills in any other fields built from the ID
+        (links, say) before each attempt. Returns the ID used.
+        """
+        mirror = tuple(mirror)
+        for _ in range(MAX_CLASHES):
+            value = self.allocate(name)
+            doc[field] = value
+            for other in mirror:
+                doc[other] = value
+            if derive:
+                derive(doc, value)
+            try:
+                db[collection].insert_one(doc)
+                return value
+            except DuplicateKeyError as e:
+                if field not in ((e.details or {}).get("keyPattern") or {}):
+                    raise
+                print(f"⚠️ [IdAllocator] {name} ID {value} already taken, allocating another")
+        raise RuntimeError(f"Could not allocate a unique {name} ID")
+
+
+id_allocator = IdAllocator()
+
+
+def allocate_id(name: str):
+    return id_allocator.allocate(name)
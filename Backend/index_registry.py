@@ -0,0 +1,345 @@
+"""
+Index Registry
+Every MongoDB index the app relies on, declared in one place.
+
+    python index_registry.py ensure     create whatever is missing
+    python index_registry.py check      list missing or conflicting indexes (exit 1 if any)
+    python index_registry.py explain    explain() the hot queries below (exit 1 on a COLLSCAN)
+
+`ensure` runs once per deploy, as the release step (Procfile `release:`,
+render.yaml `preDeployCommand`): one listIndexes per collection, and
+create_index only for indexes that are not there yet. Building an index on a
+large collection is slow and locks it for writes on older servers, so the web
+app and workers never create indexes; they call warn_missing_indexes() at
+startup, which only lists them and logs what is missing. An existing index on
+the same keys with different options (unique, TTL, partial filter) is
+reported, never dropped or rebuilt — fix those by hand.
+
+New indexes go in INDEXES; a query that must never scan a whole collection
+goes in HOT_QUERIES so `explain` catches a missing or unused index.
+"""
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from mongodb_config import db
+from ai_summary_cache import CACHE_RETENTION_SECONDS as AI_SUMMARY_RETENTION_SECONDS
+from click_aggregator import EVENT_RETENTION_DAYS
+
+# Options that make two indexes on the same keys different indexes
+_COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: Tuple[Tuple[str, int], ...]
+    options: dict
+
+    def describe(self) -> str:
+        keys = ", ".join(f"{field}: {direction}" for field, direction in self.keys)
+        options = "".join(f" {name}={value}" for name, value in self.options.items())
+        return f"{self.collection} {{{keys}}}{options}"
+
+
+def index(collection: str, keys, **options) -> IndexSpec:
+    """keys: a field name (ascending) or a list of (field, direction) pairs."""
+    if isinstance(keys, str):
+        keys = [(keys, 1)]
+    return IndexSpec(collection, tuple(keys), options)
+
+
+def _job_queue(collection: str) -> List[IndexSpec]:
+    # See job_queue.JobQueue.claim
+    return [
+        index(collection, "job_id", unique=True),
+        index(collection, [("kind", 1), ("status", 1), ("queued_at", 1)]),
+        index(collection, [("status", 1), ("lease_expires_at", 1)]),
+    ]
+
+
+_TRACKING_TTL_SECONDS = 15 * 24 * 3600
+_TRACKING_COLLECTIONS = (
+    "login_events", "page_visits", "pricing_clicks", "user_sessions",
+    "user_geolocations", "button_clicks", "premium_feature_attempts",
+)
+_CLICK_EVENT_TTL_SECONDS = EVENT_RETENTION_DAYS * 24 * 3600
+
+
+INDEXES: List[IndexSpec] = [
+    # ─── Surveys & responses ───
+    index("surveys", "id"),
+    index("surveys", "short_id", unique=True, partialFilterExpression={"short_id": {"$type": "string"}}),
+    index("responses", [("survey_id", 1), ("submitted_at", -1)]),
+    index("responses", [("survey_id", 1), ("evaluation_result.status", 1)]),
+    index("responses", "device_fingerprint", sparse=True),
+    index("responses", "session_id"),
+    index("survey_configurations", "survey_id"),
+    index("survey_configurations", [("pass_fail_enabled", 1), ("pepperads_redirect_enabled", 1)]),
+    index("pass_fail_criteria", "is_active"),
+    index("pass_fail_criteria", "name"),
+    index("system_config", "config_key"),
+    index("redirect_rules_config", "survey_id"),
+
+    # ─── Sessions & clicks ───
+    index("survey_sessions", "survey_id"),
+    index("survey_sessions", "user_info.click_id"),
+    index("survey_sessions", "step_tracking.timestamp"),
+    index("survey_sessions", "evaluation_result.status"),
+    index("survey_clicks", [("survey_id", 1), ("first_click_time", -1)]),
+    # Response ⋈ click join in enhanced_response_logs_api
+    index("survey_clicks", [("click_id", 1), ("survey_id", 1), ("first_click_time", -1)]),
+    index("survey_clicks", [("ip_address", 1), ("survey_id", 1), ("first_click_time", -1)]),
+    index("survey_click_events", [("survey_id", 1), ("timestamp", -1)]),
+    index("survey_click_events", "timestamp", expireAfterSeconds=_CLICK_EVENT_TTL_SECONDS),
+    index("masked_links", "short_id", unique=True),
+    index("masked_link_click_events", [("short_id", 1), ("timestamp", -1)]),
+    index("masked_link_click_events", "timestamp", expireAfterSeconds=_CLICK_EVENT_TTL_SECONDS),
+    index("users", "simpleUserId", unique=True, partialFilterExpression={"simpleUserId": {"$type": "number"}}),
+
+    # ─── Funnels ───
+    index("funnels", "funnel_id"),
+    index("funnel_sessions", "funnel_id"),
+    index("funnel_sessions", "funnel_session_id"),
+    index("funnel_stats", "funnel_id"),
+    *_job_queue("funnel_generation_jobs"),
+
+    # ─── Email ───
+    index("email_triggers", [("survey_id", 1), ("is_active", 1)]),
+    index("scheduled_emails", [("status", 1), ("send_at", 1)]),
+    index("scheduled_emails", [("status", 1), ("lease_expires_at", 1)]),
+    index("invite_batches", "batch_id", unique=True),
+
+    # ─── Referrals & sharing ───
+    index("promoters", "ref_code", unique=True),
+    index("promoters", "user_id", unique=True),
+    index("referral_attributions", "visitor_id", unique=True),
+    index("referral_attributions", [("ref_code", 1), ("first_seen", -1)]),
+    index("referral_attributions", "user_id"),
+    index("referral_events", [("ref_code", 1), ("status", 1)]),
+    index("referral_events", [("status", 1), ("eligible_at", 1)],
+          partialFilterExpression={"status": "pending"}),
+    # Idempotency: one credit per subscription per billing month
+    index("referral_events", [("subscription_id", 1), ("billing_period", 1)], unique=True,
+          partialFilterExpression={"type": {"$in": ["subscription_monthly", "subscription_annual"]},
+                                   "subscription_id": {"$exists": True},
+                                   "billing_period": {"$exists": True}}),
+    # One signup credit per user ever
+    index("referral_events", "user_id", unique=True, partialFilterExpression={"type": "signup"}),
+    index("referral_events", [("ref_code", 1), ("ledger_bucket", 1)]),
+    index("referral_events", "payout_id", sparse=True),
+    index("referral_payouts", "ref_code"),
+    index("survey_share_clicks", [("survey_id", 1), ("sharer_ref_code", 1)]),
+    index("survey_share_clicks", [("visitor_id", 1), ("survey_id", 1), ("day_key", 1)]),
+    index("survey_share_completions", [("survey_id", 1), ("sharer_ref_code", 1)]),
+    index("survey_share_completions", "status"),
+    index("survey_share_completions", "completed_at"),
+
+    # ─── User tracking (15-day TTL) ───
+    *[
+        spec
+        for name in _TRACKING_COLLECTIONS
+        for spec in (
+            index(name, "created_at", expireAfterSeconds=_TRACKING_TTL_SECONDS),
+            index(name, "user_id"),
+            index(name, "user_email"),
+        )
+    ],
+    index("page_visits", "page"),
+    index("button_clicks", "button_id"),
+    index("pricing_clicks", "source"),
+    index("user_sessions", "session_id"),
+    index("user_geolocations", [("latitude", 1), ("longitude", 1)]),
+
+    # ─── AI caches ───
+    index("ai_summary_cache", [("survey_id", 1), ("question_key", 1), ("created_at", -1)]),
+    index("ai_summary_cache", "created_at", expireAfterSeconds=AI_SUMMARY_RETENTION_SECONDS),
+    index("ai_response_cache", "expires_at", expireAfterSeconds=0),
+]
+
+
+class HotQuery(NamedTuple):
+    label: str
+    collection: str
+    filter: dict
+    sort: Optional[List[Tuple[str, int]]] = None
+
+
+_PROBE = "__index_probe__"
+
+# Predicates on request paths; values are placeholders, only the plan matters
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("survey by short id", "surveys", {"id": _PROBE}),
+    HotQuery("survey responses, newest first", "responses", {"survey_id": _PROBE}, [("submitted_at", -1)]),
+    HotQuery("previous submission (resubmit control)", "responses",
+             {"survey_id": _PROBE, "$or": [{"device_fingerprint": _PROBE}, {"user_info.email": _PROBE}]},
+             [("submitted_at", -1)]),
+    HotQuery("survey clicks", "survey_clicks", {"survey_id": _PROBE}, [("first_click_time", -1)]),
+    HotQuery("response click by click id", "survey_clicks",
+             {"click_id": _PROBE, "survey_id": _PROBE}, [("first_click_time", -1)]),
+    HotQuery("response click by ip", "survey_clicks",
+             {"ip_address": _PROBE, "survey_id": _PROBE,
+              "first_click_time": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}},
+             [("first_click_time", -1)]),
+    HotQuery("masked link redirect", "masked_links", {"short_id": _PROBE}),
+    HotQuery("funnel sessions", "funnel_sessions", {"funnel_id": _PROBE}),
+    HotQuery("funnel session by id", "funnel_sessions", {"funnel_session_id": _PROBE}),
+    HotQuery("active email triggers", "email_triggers", {"survey_id": _PROBE, "is_active": True}),
+    HotQuery("redirect rules", "redirect_rules_config", {"survey_id": _PROBE}),
+    HotQuery("survey sessions", "survey_sessions", {"survey_id": _PROBE}),
+    HotQuery("due scheduled emails", "scheduled_emails",
+             {"status": "scheduled", "send_at": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}},
+             [("send_at", 1)]),
+]
+
+
+# ─── Ensure / check ───
+
+def _normalize_key(key) -> Tuple[Tuple[str, object], ...]:
+    # listIndexes may return 1.0 / -1.0
+    return tuple(
+        (field, int(direction) if isinstance(direction, (int, float)) else direction)
+        for field, direction in key.items()
+    )
+
+
+def _options_of(info: dict) -> dict:
+    return {name: info[name] for name in _COMPARED_OPTIONS if name in info and info[name] is not False}
+
+
+def _compare(spec: IndexSpec, existing: Dict[tuple, dict]) -> str:
+    """'ok', 'missing' or 'conflict' (same keys, different options)."""
+    info = existing.get(spec.keys)
+    if info is None:
+        return "missing"
+    wanted = {name: value for name, value in spec.options.items() if value is not False}
+    have = _options_of(info)
+    # Mongo stores TTLs as numbers of either type
+    if "expireAfterSeconds" in have:
+        have["expireAfterSeconds"] = int(have["expireAfterSeconds"])
+    return "ok" if have == wanted else "conflict"
+
+
+def _existing_indexes(collection: str) -> Dict[tuple, dict]:
+    return {_normalize_key(info["key"]): info for info in db[collection].list_indexes()}
+
+
+def _by_collection(collections: Iterable[str] = None) -> Dict[str, List[IndexSpec]]:
+    wanted = set(collections) if collections else None
+    grouped: Dict[str, List[IndexSpec]] = {}
+    for spec in INDEXES:
+        if wanted is None or spec.collection in wanted:
+            grouped.setdefault(spec.collection, []).append(spec)
+    return grouped
+
+
+def check_indexes(collections: Iterable[str] = None) -> Dict[str, List[IndexSpec]]:
+    """Registered indexes grouped by state: {"missing": [...], "conflict": [...]}."""
+    problems = {"missing": [], "conflict": []}
+    for collection, specs in _by_collection(collections).items():
+        existing = _existing_indexes(collection)
+        for spec in specs:
+            state = _compare(spec, existing)
+            if state != "ok":
+                problems[state].append(spec)
+    return problems
+
+
+def warn_missing_indexes(collections: Iterable[str] = None) -> Dict[str, List[IndexSpec]]:
+    """Startup check: log missing or conflicting indexes without creating any. Never raises."""
+    try:
+        problems = check_indexes(collections)
+    except Exception as e:
+        print(f"⚠️ [Indexes] Could not check indexes: {e}")
+        return {"missing": [], "conflict": []}
+    for state, specs in problems.items():
+        for spec in specs:
+            print(f"⚠️ [Indexes] {state}: {spec.describe()}")
+    if problems["missing"]:
+        print(f"⚠️ [Indexes] {len(problems['missing'])} missing; run `python index_registry.py ensure`")
+    return problems
+
+
+def ensure_indexes(collections: Iterable[str] = None) -> dict:
+    """Create missing registered indexes; report conflicting ones. Never raises."""
+    created, conflicts, failed = 0, 0, 0
+    for collection, specs in _by_collection(collections).items():
+        try:
+            existing = _existing_indexes(collection)
+        except Exception as e:
+            print(f"⚠️ [Indexes] Could not list {collection} indexes: {e}")
+            failed += len(specs)
+            continue
+        for spec in specs:
+            state = _compare(spec, existing)
+            if state == "conflict":
+                conflicts += 1
+                print(f"⚠️ [Indexes] {spec.describe()} exists with different options; left as is")
+            elif state == "missing":
+                try:
+                    db[collection].create_index(list(spec.keys), **spec.options)
+                    created += 1
+                    print(f"🔧 [Indexes] Created {spec.describe()}")
+                except Exception as e:
+                    failed += 1
+                    print(f"⚠️ [Indexes] {spec.describe()}: {e}")
+    print(f"✅ [Indexes] {len(INDEXES)} registered: {created} created, {conflicts} conflicting, {failed} failed")
+    return {"registered": len(INDEXES), "created": created, "conflicts": conflicts, "failed": failed}
+
+
+# ─── Query plans ───
+
+def _stages(plan) -> Iterable[str]:
+    """Every stage name in an explain plan tree (classic and SBE layouts)."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def explain_hot_queries() -> List[dict]:
+    """Winning-plan stages of every hot query; `collscan` marks a full scan."""
+    results = []
+    for query in HOT_QUERIES:
+        cursor = db[query.collection].find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        planner = cursor.explain().get("queryPlanner", {})
+        stages = list(_stages(planner.get("winningPlan", {})))
+        results.append({
+            "label": query.label,
+            "collection": query.collection,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return results
+
+
+def main(argv: List[str]) -> int:
+    command = argv[1] if len(argv) > 1 else "ensure"
+    if command == "ensure":
+        result = ensure_indexes()
+        return 1 if result["failed"] else 0
+    if command == "check":
+        problems = check_indexes()
+        for state, specs in problems.items():
+            for spec in specs:
+                print(f"❌ {state}: {spec.describe()}")
+        print(f"{'❌' if any(problems.values()) else '✅'} {len(INDEXES)} registered indexes checked")
+        return 1 if any(problems.values()) else 0
+    if command == "explain":
+        results = explain_hot_queries()
+        for result in results:
+            mark = "❌" if result["collscan"] else "✅"
+            print(f"{mark} {result['label']:<42} {result['collection']:<24} {' > '.join(result['stages'])}")
+        scans = sum(result["collscan"] for result in results)
+        print(f"{'❌' if scans else '✅'} {len(results)} hot queries, {scans} collection scan(s)")
+        return 1 if scans else 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
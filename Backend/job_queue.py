@@ -0,0 +1,281 @@
+"""
+Job Queue
+Durable Mongo-backed background jobs with lease/heartbeat claiming.
+
+A job is a document in its own status collection (so existing status
+endpoints keep reading the same document). Workers claim the oldest queued
+job — or a running job whose lease has expired because its worker died — with
+one find_one_and_update, and extend the lease from a heartbeat thread while
+the handler runs. Every write a handler makes goes through the JobContext and
+is conditional on still holding the lease, so a worker that lost its job
+cannot overwrite the new owner's progress.
+
+Handlers record step results with ctx.checkpoint(); when a job is picked up
+again after a crash they find them in job["checkpoints"] and skip that work.
+
+JobWatcher pushes status changes to SSE subscribers in the web process: one
+batched query per interval covers every job anyone is watching, instead of one
+poll per client.
+
+Config (env):
+    JOB_LEASE_SECONDS      lease length; heartbeats renew it every third (default 60)
+    JOB_MAX_ATTEMPTS       claims before a job is failed for good (default 3)
+    JOB_POLL_SECONDS       idle wait between claim attempts (default 2)
+    JOB_WATCH_SECONDS      JobWatcher refresh interval (default 1)
+"""
+import os
+import time
+import uuid
+import socket
+import threading
+from queue import Queue
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional
+from pymongo import ReturnDocument
+from mongodb_config import db
+
+LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "2"))
+WATCH_SECONDS = float(os.environ.get("JOB_WATCH_SECONDS", "1"))
+
+# Queue bookkeeping that status endpoints should not return
+INTERNAL_FIELDS = ("_id", "kind", "payload", "checkpoints", "lease_owner", "lease_expires_at", "queued_at")
+FINISHED_STATUSES = ("done", "error")
+
+
+class LeaseLost(Exception):
+    """Another worker now owns the job; stop working on it."""
+
+
+class JobQueue:
+    def __init__(self, collection: str, lease_seconds: int = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @property
+    def _coll(self):
+        return db[self.collection]
+
+    def enqueue(self, job_id: str, kind: str, payload: dict, **fields) -> str:
+        """Queue a job; `fields` are extra status fields shown to pollers."""
+        now = datetime.utcnow()
+        self._coll.insert_one({
+            "job_id": job_id,
+            "kind": kind,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "checkpoints": {},
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "queued_at": now,
+            **fields,
+        })
+        return job_id
+
+    def claim(self, worker_id: str, kinds: Iterable[str]) -> Optional[dict]:
+        """Take the next runnable job of one of `kinds`, or None."""
+        while True:
+            now = datetime.utcnow()
+            job = self._coll.find_one_and_update(
+                {
+                    "kind": {"$in": list(kinds)},
+                    "$or": [
+                        {"status": "queued"},
+                        {"status": "running", "lease_expires_at": {"$lt": now}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "status": "running",
+                        "lease_owner": worker_id,
+                        "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("queued_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if job is None:
+                return None
+            if job["attempts"] <= self.max_attempts:
+                return job
+            # Crashed its worker too many times — give up instead of looping
+            self._coll.update_one(
+                {"_id": job["_id"], "lease_owner": worker_id},
+                {"$set": {
+                    "status": "error",
+                    "error": f"Job abandoned after {self.max_attempts} attempts",
+                    "lease_owner": None,
+                }}
+            )
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """The job as status endpoints show it (without queue bookkeeping)."""
+        return self._coll.find_one({"job_id": job_id}, {f: 0 for f in INTERNAL_FIELDS})
+
+    def _guarded(self, job: dict, update: dict) -> bool:
+        result = self._coll.update_one({"_id": job["_id"], "lease_owner": job["lease_owner"]}, update)
+        return result.matched_count == 1
+
+    def heartbeat(self, job: dict) -> bool:
+        return self._guarded(job, {"$set": {
+            "lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+        }})
+
+    def finish(self, job: dict, status: str, fields: dict = None) -> bool:
+        return self._guarded(job, {"$set": {
+            **(fields or {}),
+            "status": status,
+            "lease_owner": None,
+            "lease_expires_at": None,
+        }})
+
+
+class JobContext:
+    """What a handler uses to report progress and checkpoints under its lease."""
+
+    def __init__(self, queue: JobQueue, job: dict):
+        self.queue = queue
+        self.job = job
+        # As claimed — what earlier attempts of this job already finished
+        self.checkpoints = job.get("checkpoints") or {}
+        self.lost = threading.Event()
+
+    def _write(self, update: dict):
+        if self.lost.is_set() or not self.queue._guarded(self.job, update):
+            self.lost.set()
+            raise LeaseLost(self.job["job_id"])
+
+    def update(self, **fields):
+        """Set status fields (progress, current_step, ...)."""
+        if fields:
+            self._write({"$set": fields})
+
+    def checkpoint(self, name: str, value):
+        """Persist a finished step's result under checkpoints.<name> (dotted paths allowed)."""
+        self._write({"$set": {f"checkpoints.{name}": value}})
+
+
+def _heartbeat_loop(queue: JobQueue, ctx: JobContext, stop: threading.Event):
+    interval = max(queue.lease_seconds / 3, 1)
+    while not stop.wait(interval):
+        try:
+            if not queue.heartbeat(ctx.job):
+                print(f"⚠️ [JobWorker] Lost lease on {ctx.job['job_id']}")
+                ctx.lost.set()
+                return
+        except Exception as e:
+            print(f"⚠️ [JobWorker] Heartbeat failed for {ctx.job['job_id']}: {e}")
+
+
+def run_job(queue: JobQueue, job: dict, handler: Callable[[dict, JobContext], Optional[dict]]):
+    """Run one claimed job to completion, keeping its lease alive meanwhile."""
+    ctx = JobContext(queue, job)
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat_loop, args=(queue, ctx, stop), daemon=True)
+    beat.start()
+    try:
+        result = handler(job, ctx)
+        queue.finish(job, "done", result)
+        print(f"✅ [JobWorker] {job['kind']} {job['job_id']} done")
+    except LeaseLost:
+        print(f"⚠️ [JobWorker] {job['job_id']} was taken over by another worker")
+    except Exception as e:
+        import traceback
+        print(f"❌ [JobWorker] {job['kind']} {job['job_id']} failed: {traceback.format_exc()}")
+        queue.finish(job, "error", {"error": str(e), "progress": 0})
+    finally:
+        stop.set()
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def run_worker(queue: JobQueue, handlers: Dict[str, Callable], poll_seconds: float = POLL_SECONDS,
+               stop: threading.Event = None):
+    """Claim and run jobs of the handled kinds until `stop` is set."""
+    me = worker_id()
+    stop = stop or threading.Event()
+    print(f"👷 [JobWorker] {me} polling {queue.collection} for {', '.join(handlers)}")
+    while not stop.is_set():
+        try:
+            job = queue.claim(me, handlers.keys())
+        except Exception as e:
+            print(f"❌ [JobWorker] Claim failed: {e}")
+            job = None
+        if job is None:
+            stop.wait(poll_seconds)
+            continue
+        run_job(queue, job, handlers[job["kind"]])
+
+
+class JobWatcher:
+    """
+    Delivers job status changes to subscribers (one Queue each). A single
+    thread per process re-reads every watched job in one query each interval
+    and hands out documents that changed; after a finished status it sends
+    the subscriber's queue `close` and drops it.
+    """
+
+    def __init__(self, queue: JobQueue, close, interval: float = WATCH_SECONDS):
+        """`close` is the end-of-stream marker put on a queue after a finished status."""
+        self.queue = queue
+        self.close = close
+        self.interval = interval
+        self._subscribers: Dict[str, list] = {}
+        self._last: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def subscribe(self, job_id: str) -> Queue:
+        updates = Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(updates)
+            # One thread per process; --preload forks after import
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop, daemon=True, name="job-watcher").start()
+        return updates
+
+    def unsubscribe(self, job_id: str, updates: Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id, [])
+            if updates in subscribers:
+                subscribers.remove(updates)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+                self._last.pop(job_id, None)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                job_ids = list(self._subscribers)
+            if not job_ids:
+                continue
+            try:
+                docs = list(self.queue._coll.find(
+                    {"job_id": {"$in": job_ids}}, {f: 0 for f in INTERNAL_FIELDS}
+                ))
+            except Exception as e:
+                print(f"⚠️ [JobWatcher] Refresh failed: {e}")
+                continue
+            with self._lock:
+                for doc in docs:
+                    job_id = doc["job_id"]
+                    if doc == self._last.get(job_id):
+                        continue
+                    self._last[job_id] = doc
+                    finished = doc.get("status") in FINISHED_STATUSES
+                    for updates in self._subscribers.get(job_id, []):
+                        updates.put(("progress", doc))
+                        if finished:
+                            updates.put(self.close)
+                    if finished:
+                        self._subscribers.pop(job_id, None)
+                        self._last.pop(job_id, None)
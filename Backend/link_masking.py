@@ -6,9 +6,10 @@ Provides URL shortening and masking capabilities with analytics tracking
 from datetime import datetime, timezone
 from flask import request, jsonify, redirect
 from mongodb_config import db
+from click_aggregator import masked_link_counters, masked_link_events
+from id_allocator import id_allocator, allocate_id
+from utils.user_agent import classify, Browser
 import uuid
-import string
-import random
 from urllib.parse import urlparse
 
 class LinkMaskingHandler:
@@ -19,15 +20,9 @@ class LinkMaskingHandler:
         # Use localhost for testing, change back to production when ready
         self.base_url = "http://127.0.0.1:5000"  # Testing URL
     
-    def generate_short_id(self, length=6):
-        """Generate a unique short ID for the link"""
-        characters = string.ascii_letters + string.digits
-        while True:
-            short_id = ''.join(random.choices(characters, k=length))
-            # Check if ID already exists
-            existing = self.db.masked_links.find_one({"short_id": short_id})
-            if not existing:
-                return short_id
+    def generate_short_id(self):
+        """Allocate a unique short ID for the link"""
+        return allocate_id("masked_link")
     
     def create_masked_link(self, original_url, custom_alias=None, user_id=None):
         """Create a new masked link"""
@@ -57,7 +52,8 @@ class LinkMaskingHandler:
                     return {"error": "Custom alias already exists"}
                 short_id = custom_alias.lower()
             else:
-                short_id = self.generate_short_id()
+                # Allocated on insert
+                short_id = None
             
             # Create link document
             link_data = {
@@ -79,7 +75,10 @@ class LinkMaskingHandler:
             }
             
             # Insert into database
-            result = self.db.masked_links.insert_one(link_data)
+            if short_id:
+                self.db.masked_links.insert_one(link_data)
+            else:
+                short_id = id_allocator.insert_with_id("masked_link", "masked_links", link_data, "short_id")
             
             # Return success response
             masked_url = f"{self.base_url}/l/{short_id}"
@@ -88,7 +87,7 @@ class LinkMaskingHandler:
                 "short_id": short_id,
                 "masked_url": masked_url,
                 "original_url": original_url,
-                "link_id": str(result.inserted_id)
+                "link_id": str(link_data["_id"])
             }
             
         except Exception as e:
@@ -107,12 +106,10 @@ class LinkMaskingHandler:
                 self._track_click(link, request_obj)
             else:
                 # Just update click count without detailed analytics
-                self.db.masked_links.update_one(
+                masked_link_counters.add(
                     {"short_id": short_id},
-                    {
-                        "$inc": {"clicks": 1},
-                        "$set": {"last_clicked": datetime.now(timezone.utc)}
-                    }
+                    inc={"clicks": 1},
+                    max={"last_clicked": datetime.now(timezone.utc)},
                 )
             
             return link["original_url"]
@@ -153,40 +150,31 @@ class LinkMaskingHandler:
             if link.get("clicks", 0) == 0:
                 inc_fields["unique_clicks"] = 1
 
-            self.db.masked_links.update_one(
-                {"short_id": short_id},
-                {
-                    "$inc": inc_fields,
-                    "$set": {"last_clicked": datetime.now(timezone.utc)},
-                }
+            now = datetime.now(timezone.utc)
+            # Coalesced with other clicks on this link and flushed in bulk
+            masked_link_counters.add(
+                {"short_id": short_id}, inc=inc_fields, max={"last_clicked": now}
             )
+            masked_link_events.append({
+                "short_id": short_id,
+                "timestamp": now,
+                "referrer": referrer,
+                "country": country,
+                "device": device,
+                "browser": browser,
+            })
 
         except Exception as e:
             print(f"Error tracking click: {e}")
     
     def _parse_device(self, user_agent):
         """Parse device type from user agent"""
-        user_agent = user_agent.lower()
-        if 'mobile' in user_agent or 'android' in user_agent or 'iphone' in user_agent:
-            return 'mobile'
-        elif 'tablet' in user_agent or 'ipad' in user_agent:
-            return 'tablet'
-        else:
-            return 'desktop'
+        return classify(user_agent).device.value
     
     def _parse_browser(self, user_agent):
         """Parse browser from user agent"""
-        user_agent = user_agent.lower()
-        if 'chrome' in user_agent:
-            return 'chrome'
-        elif 'firefox' in user_agent:
-            return 'firefox'
-        elif 'safari' in user_agent:
-            return 'safari'
-        elif 'edge' in user_agent:
-            return 'edge'
-        else:
-            return 'other'
+        browser = classify(user_agent).browser
+        return 'other' if browser is Browser.UNKNOWN else browser.value
     
     def _get_country_from_ip(self, ip_address):
         """Get country from IP (simplified - in production use GeoIP database)"""
@@ -249,13 +237,29 @@ class LinkMaskingHandler:
                 return {"error": "Link not found or access denied"}
             
             # Allowed updates
-            allowed_updates = ["is_active", "original_url"]
+            allowed_updates = ["is_active", "original_url", "proxy_limits", "cache_ttl_seconds"]
             update_data = {}
             
             for key, value in updates.items():
                 if key in allowed_updates:
                     update_data[key] = value
             
+            # Per-link proxy overrides: max_bytes, connect_timeout, read_timeout, max_seconds
+            if "proxy_limits" in update_data:
+                from link_proxy import DEFAULT_LIMITS
+                limits = update_data["proxy_limits"]
+                if not isinstance(limits, dict) or any(
+                    k not in DEFAULT_LIMITS or not isinstance(v, (int, float)) or v <= 0
+                    for k, v in limits.items()
+                ):
+                    return {"error": f"proxy_limits may only set positive {', '.join(DEFAULT_LIMITS)}"}
+            
+            # Proxy cache lifetime override in seconds; 0 disables caching, null follows upstream
+            if "cache_ttl_seconds" in update_data:
+                ttl = update_data["cache_ttl_seconds"]
+                if ttl is not None and (not isinstance(ttl, int) or isinstance(ttl, bool) or ttl < 0):
+                    return {"error": "cache_ttl_seconds must be a non-negative integer or null"}
+            
             if not update_data:
                 return {"error": "No valid updates provided"}
             
@@ -0,0 +1,251 @@
+"""
+Masked Link Proxy
+Streams a masked link's destination through our domain.
+
+All upstream fetches share one pooled requests.Session so keep-alive
+connections are reused across clicks. Non-HTML responses are passed through
+chunk by chunk; HTML is streamed too, with a <base> tag injected right after
+<head> while the first chunks go by, so time to first byte no longer waits
+for the whole page.
+
+Complete HTML pages are also written to link_proxy_cache and served from
+there (with conditional revalidation) on later clicks.
+
+Limits (env defaults, overridable per link via masked_links.proxy_limits):
+    LINK_PROXY_MAX_BYTES          stop streaming after this many bytes (10 MB)
+    LINK_PROXY_CONNECT_TIMEOUT    seconds to connect upstream (5)
+    LINK_PROXY_READ_TIMEOUT       seconds between upstream reads (15)
+    LINK_PROXY_MAX_SECONDS        total seconds a response may stream (60)
+"""
+import os
+import re
+import time
+import html
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Response, stream_with_context
+from link_proxy_cache import proxy_cache, MAX_ENTRY_BYTES
+
+CHUNK_SIZE = 16 * 1024
+
+# Give up looking for <head> after this much HTML and inject at the top instead
+HEAD_SCAN_BYTES = 64 * 1024
+
+DEFAULT_LIMITS = {
+    "max_bytes": int(os.environ.get("LINK_PROXY_MAX_BYTES", str(10 * 1024 * 1024))),
+    "connect_timeout": float(os.environ.get("LINK_PROXY_CONNECT_TIMEOUT", "5")),
+    "read_timeout": float(os.environ.get("LINK_PROXY_READ_TIMEOUT", "15")),
+    "max_seconds": float(os.environ.get("LINK_PROXY_MAX_SECONDS", "60")),
+}
+
+FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "identity",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Cache-Control": "max-age=0",
+}
+
+_HEAD_RE = re.compile(rb"<head\b[^>]*>", re.IGNORECASE)
+_BODY_RE = re.compile(rb"<body\b", re.IGNORECASE)
+
+
+class ProxyTooLarge(Exception):
+    """Upstream declared a body larger than the link's max_bytes."""
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=int(os.environ.get("LINK_PROXY_POOL_HOSTS", "32")),
+        pool_maxsize=int(os.environ.get("LINK_PROXY_POOL_SIZE", "16")),
+        max_retries=0,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_session = None
+_session_pid = None
+
+
+def _get_session() -> requests.Session:
+    # Pools are per process; don't reuse sockets inherited across gunicorn's fork
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = _build_session()
+        _session_pid = os.getpid()
+    return _session
+
+
+def limits_for(link: dict) -> dict:
+    """Effective limits for a link: env defaults overlaid with masked_links.proxy_limits."""
+    limits = dict(DEFAULT_LIMITS)
+    for key, value in (link.get("proxy_limits") or {}).items():
+        if key in limits and isinstance(value, (int, float)) and value > 0:
+            limits[key] = value
+    return limits
+
+
+def fetch_upstream(url: str, limits: dict, headers: dict = None, verify: bool = True) -> requests.Response:
+    """Open a streaming GET on the shared pool. The caller must close the response."""
+    return _get_session().get(
+        url,
+        headers={**FETCH_HEADERS, **(headers or {})},
+        timeout=(limits["connect_timeout"], limits["read_timeout"]),
+        allow_redirects=True,
+        verify=verify,
+        stream=True,
+    )
+
+
+def base_tag(url: str) -> bytes:
+    return f'<base href="{html.escape(url, quote=True)}">'.encode("utf-8")
+
+
+def inject_base_tag(chunks, tag: bytes):
+    """
+    Yield chunks with `tag` inserted right after <head ...>.
+    Only the first chunks are buffered and scanned; once the tag is placed
+    (or <body> / HEAD_SCAN_BYTES is reached without a <head>) the rest of the
+    stream is passed through untouched.
+    """
+    buf = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if buf is None:
+            yield chunk
+            continue
+
+        buf += chunk
+        match = _HEAD_RE.search(buf)
+        if match:
+            yield buf[:match.end()] + tag + buf[match.end():]
+            buf = None
+        elif _BODY_RE.search(buf) or len(buf) >= HEAD_SCAN_BYTES:
+            yield tag + buf
+            buf = None
+
+    if buf is not None:
+        yield tag + buf
+
+
+def _limited(resp: requests.Response, limits: dict, state: dict):
+    """
+    Upstream chunks, stopping at max_bytes or max_seconds; always releases the
+    connection. Sets state["complete"] only if the whole body was read.
+    """
+    started = time.monotonic()
+    sent = 0
+    try:
+        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+            sent += len(chunk)
+            if sent > limits["max_bytes"]:
+                print(f"⚠️ [LinkProxy] {resp.url} exceeded {limits['max_bytes']} bytes, truncated")
+                return
+            yield chunk
+            if time.monotonic() - started > limits["max_seconds"]:
+                print(f"⚠️ [LinkProxy] {resp.url} exceeded {limits['max_seconds']}s, truncated")
+                return
+        state["complete"] = True
+    finally:
+        resp.close()
+
+
+def _tee_to_cache(chunks, state: dict, on_complete):
+    """Pass chunks through while keeping a copy; hand the full body to on_complete."""
+    kept = []
+    size = 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            # Pages larger than a cache entry are streamed but not kept
+            if size <= MAX_ENTRY_BYTES:
+                kept.append(chunk)
+            else:
+                kept = None
+        yield chunk
+    if kept is not None and state.get("complete"):
+        try:
+            on_complete(b"".join(kept))
+        except Exception as e:
+            print(f"⚠️ [LinkProxy] Cache store failed: {e}")
+
+
+def is_html(content_type: str) -> bool:
+    return "text/html" in (content_type or "").lower()
+
+
+def stream_response(resp: requests.Response, limits: dict, on_complete=None) -> Response:
+    """
+    Turn an open upstream response into a streaming Flask response.
+    on_complete(body) receives the rewritten HTML of a fully read 200 page.
+    """
+    content_type = resp.headers.get("Content-Type", "text/html")
+
+    declared = resp.headers.get("Content-Length")
+    if declared and declared.isdigit() and int(declared) > limits["max_bytes"]:
+        resp.close()
+        raise ProxyTooLarge(f"Destination is {declared} bytes, limit is {limits['max_bytes']}")
+
+    state = {}
+    body = _limited(resp, limits, state)
+
+    # Non-HTML assets — pass through directly
+    if not is_html(content_type):
+        return Response(stream_with_context(body), status=resp.status_code, content_type=content_type)
+
+    # Inject <base> tag so all relative URLs (CSS, JS, images) resolve correctly
+    body = inject_base_tag(body, base_tag(resp.url))
+    if on_complete and resp.status_code == 200:
+        body = _tee_to_cache(body, state, on_complete)
+    # Upstream headers (X-Frame-Options, CSP, HSTS, ...) are never copied over
+    response = Response(stream_with_context(body), status=200, content_type=content_type)
+    response.headers["X-Proxy-Cache"] = "MISS"
+    return response
+
+
+def cached_response(entry, status: str) -> Response:
+    response = Response(entry.body, status=200, content_type=entry.content_type)
+    response.headers["X-Proxy-Cache"] = status
+    return response
+
+
+def proxy_link(link: dict) -> Response:
+    """
+    Serve a masked link's destination: from the proxy cache when fresh,
+    after a conditional GET when stale, otherwise streamed from upstream.
+    Raises requests exceptions.
+    """
+    limits = limits_for(link)
+    url = link["original_url"]
+    ttl_override = link.get("cache_ttl_seconds")
+    use_cache = ttl_override != 0
+
+    entry = proxy_cache.lookup(url) if use_cache else None
+    if entry is not None and entry.is_fresh():
+        return cached_response(entry, "HIT")
+
+    validators = entry.validators() if entry is not None else None
+    try:
+        resp = fetch_upstream(url, limits, headers=validators)
+    except requests.exceptions.SSLError:
+        # Retry without SSL verification
+        resp = fetch_upstream(url, limits, headers=validators, verify=False)
+
+    if entry is not None and resp.status_code == 304:
+        resp.close()
+        return cached_response(proxy_cache.refresh(entry, resp.headers, ttl_override), "REVALIDATED")
+
+    on_complete = None
+    if use_cache:
+        final_url, headers = resp.url, resp.headers
+        on_complete = lambda body: proxy_cache.store(url, final_url, headers, body, ttl_override)
+    return stream_response(resp, limits, on_complete)
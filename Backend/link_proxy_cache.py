@@ -0,0 +1,278 @@
+"""
+Masked Link Proxy Cache
+Rewritten destination HTML keyed by final URL, in two tiers.
+
+    memory  per-process LRU of the hottest pages
+    disk    LINK_PROXY_CACHE_DIR, shared by the workers on one instance
+
+Freshness follows the upstream Cache-Control (s-maxage / max-age, minus Age).
+`no-store` and `private` responses are never stored (a 304 carrying them
+evicts the entry it revalidated); `no-cache` and responses
+without a lifetime are stored only when they carry an ETag or Last-Modified,
+and are revalidated with a conditional GET on every hit. A link's
+masked_links.cache_ttl_seconds overrides the upstream lifetime (0 disables
+caching for that link).
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional
+from utils.ttl_cache import TTLCache
+
+CACHE_DIR = os.environ.get("LINK_PROXY_CACHE_DIR", "/tmp/link_proxy_cache")
+MAX_ENTRY_BYTES = int(os.environ.get("LINK_PROXY_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+MAX_DISK_BYTES = int(os.environ.get("LINK_PROXY_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024)))
+
+# Prune the disk tier after this many writes
+_PRUNE_EVERY = 50
+
+
+def _sha(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def _parse_cache_control(value: str) -> dict:
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"')
+    return directives
+
+
+def _forbids_storing(headers) -> bool:
+    cc = _parse_cache_control(headers.get("Cache-Control"))
+    return "no-store" in cc or "private" in cc
+
+
+def lifetime(headers, ttl_override=None) -> Optional[int]:
+    """
+    Seconds a response stays fresh, 0 for store-but-always-revalidate,
+    or None when it must not be stored.
+    """
+    if ttl_override:
+        return int(ttl_override)
+
+    if _forbids_storing(headers):
+        return None
+
+    cc = _parse_cache_control(headers.get("Cache-Control"))
+    ttl = 0
+    if "no-cache" not in cc:
+        for directive in ("s-maxage", "max-age"):
+            if cc.get(directive, "").isdigit():
+                ttl = int(cc[directive])
+                break
+        age = headers.get("Age", "")
+        if age.isdigit():
+            ttl = max(0, ttl - int(age))
+
+    if ttl == 0 and not (headers.get("ETag") or headers.get("Last-Modified")):
+        return None
+    return ttl
+
+
+class CacheEntry:
+    __slots__ = ("final_url", "content_type", "etag", "last_modified", "expires_at", "body")
+
+    def __init__(self, final_url, content_type, etag, last_modified, expires_at, body=b""):
+        self.final_url = final_url
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.body = body
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def meta(self) -> dict:
+        return {
+            "final_url": self.final_url,
+            "content_type": self.content_type,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "expires_at": self.expires_at,
+        }
+
+
+class ProxyCache:
+    def __init__(self, directory: str = CACHE_DIR, memory_entries: int = 64):
+        self.directory = directory
+        self._memory = TTLCache(maxsize=memory_entries)
+        # original URL → final URL after redirects
+        self._aliases = TTLCache(maxsize=4096)
+        self._writes = 0
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._disk = True
+        except OSError as e:
+            print(f"⚠️ [LinkProxyCache] Disk tier disabled: {e}")
+            self._disk = False
+
+    # ── Disk tier ────────────────────────────────────────────
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def _write_file(self, path: str, data: bytes):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _disk_meta(self, key: str) -> Optional[dict]:
+        if not self._disk:
+            return None
+        try:
+            with open(self._path(key, "json"), "rb") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _disk_get(self, key: str) -> Optional[CacheEntry]:
+        meta = self._disk_meta(key)
+        if meta is None:
+            return None
+        try:
+            with open(self._path(key, "body"), "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        return CacheEntry(body=body, **meta)
+
+    def _disk_put(self, key: str, entry: CacheEntry, meta_only: bool = False):
+        if not self._disk:
+            return
+        try:
+            if not meta_only:
+                self._write_file(self._path(key, "body"), entry.body)
+            self._write_file(self._path(key, "json"), json.dumps(entry.meta()).encode("utf-8"))
+        except OSError as e:
+            print(f"⚠️ [LinkProxyCache] Disk write failed: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % _PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+    def _disk_remove(self, key: str):
+        for ext in ("json", "body"):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def _prune(self):
+        """
+        Drop the least recently written keys (page bodies with their metadata,
+        and link aliases, which are metadata only) until the tier fits
+        MAX_DISK_BYTES.
+        """
+        try:
+            keys = {}
+            for name in os.listdir(self.directory):
+                key, _, ext = name.partition(".")
+                if ext not in ("json", "body"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                mtime, size = keys.get(key, (0.0, 0))
+                keys[key] = (max(mtime, st.st_mtime), size + st.st_size)
+            total = sum(size for _, size in keys.values())
+            for key, (_, size) in sorted(keys.items(), key=lambda item: item[1][0]):
+                if total <= MAX_DISK_BYTES:
+                    break
+                self._disk_remove(key)
+                total -= size
+        except OSError as e:
+            print(f"⚠️ [LinkProxyCache] Prune failed: {e}")
+
+    # ── Public API ───────────────────────────────────────────
+
+    def lookup(self, original_url: str) -> Optional[CacheEntry]:
+        """Entry for a link's destination (fresh or stale), or None."""
+        final_url = self._aliases.get(original_url)
+        if final_url is None:
+            alias = self._disk_meta(_sha("alias:" + original_url))
+            if alias is None:
+                return None
+            final_url = alias["final_url"]
+            self._aliases.set(original_url, final_url)
+
+        key = _sha(final_url)
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = self._disk_get(key)
+            if entry is not None:
+                self._memory.set(key, entry)
+        return entry
+
+    def store(self, original_url: str, final_url: str, headers, body: bytes,
+              ttl_override=None) -> Optional[CacheEntry]:
+        """Store a complete rewritten page if its headers allow it."""
+        ttl = lifetime(headers, ttl_override)
+        if ttl is None or len(body) > MAX_ENTRY_BYTES:
+            return None
+
+        entry = CacheEntry(
+            final_url=final_url,
+            content_type=headers.get("Content-Type", "text/html"),
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+            expires_at=time.time() + ttl,
+            body=body,
+        )
+        key = _sha(final_url)
+        self._memory.set(key, entry)
+        self._disk_put(key, entry)
+
+        self._aliases.set(original_url, final_url)
+        self._disk_put(_sha("alias:" + original_url), CacheEntry(final_url, None, None, None, 0), meta_only=True)
+        return entry
+
+    def refresh(self, entry: CacheEntry, headers, ttl_override=None) -> CacheEntry:
+        """
+        Extend an entry after a 304 Not Modified. If the 304 says no-store or
+        private the entry is evicted instead; it is still returned, since the
+        body is valid for the response being served.
+        """
+        if not ttl_override and _forbids_storing(headers):
+            key = _sha(entry.final_url)
+            self._memory.pop(key)
+            if self._disk:
+                self._disk_remove(key)
+            return entry
+        ttl = lifetime(headers, ttl_override) or 0
+        entry = CacheEntry(
+            final_url=entry.final_url,
+            content_type=entry.content_type,
+            etag=headers.get("ETag") or entry.etag,
+            last_modified=headers.get("Last-Modified") or entry.last_modified,
+            expires_at=time.time() + ttl,
+            body=entry.body,
+        )
+        key = _sha(entry.final_url)
+        self._memory.set(key, entry)
+        self._disk_put(key, entry, meta_only=True)
+        return entry
+
+    def stats(self) -> dict:
+        return {"memory": self._memory.stats(), "disk": self._disk, "directory": self.directory}
+
+
+proxy_cache = ProxyCache()
@@ -132,6 +132,9 @@ def set_user_location_access(user_id):
     if result.matched_count == 0:
         return jsonify({'error': 'User not found'}), 404
 
+    from auth_service import invalidate_user_cache
+    invalidate_user_cache(user_id)
+
     return jsonify({'message': f'Location feature {"enabled" if data["enabled"] else "disabled"} for user'})
 
 
@@ -1,28 +1,186 @@
-from pymongo import MongoClient
+"""
+MongoDB connection manager.
+
+`db` is a stand-in for the pepper_database Database: modules keep doing
+`from mongodb_config import db` and `db.surveys.find(...)`, and every access
+resolves to a MongoClient owned by the current process. The client is
+created on first use, so gunicorn's --preload master never opens sockets its
+forked workers would inherit, and a process that finds itself with a
+different pid (after a fork) builds a fresh one.
+
+The pool is sized from the gunicorn thread count plus headroom for
+background threads (write-behind flushers, job watchers, schedulers), and
+checkout wait times are recorded for pool_stats().
+
+Config (env):
+    MONGO_URI / MONGODB_URI      connection string
+    GUNICORN_THREADS             request threads per worker (default 8)
+    MONGO_BACKGROUND_THREADS     pool headroom for background threads (default 4)
+    MONGO_MAX_POOL_SIZE          explicit pool size; overrides the two above
+    MONGO_WAIT_QUEUE_TIMEOUT_MS  fail a checkout after waiting this long (default: wait)
+"""
+from pymongo import MongoClient, monitoring
 from dotenv import load_dotenv
 import os
+import time
+import threading
 
 load_dotenv()
 
 # Try both MONGO_URI and MONGODB_URI for compatibility
 MONGO_URI = os.getenv("MONGO_URI") or os.getenv("MONGODB_URI") or "mongodb://localhost:27017/pepper_database"
+DATABASE_NAME = "pepper_database"
+
+REQUEST_THREADS = int(os.getenv("GUNICORN_THREADS", "8"))
+BACKGROUND_THREADS = int(os.getenv("MONGO_BACKGROUND_THREADS", "4"))
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE") or REQUEST_THREADS + BACKGROUND_THREADS)
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS") or 0) or None
+
+
+class _PoolMetrics(monitoring.ConnectionPoolListener):
+    """Checkout counts and wait times for this process's pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = threading.local()
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.checked_out = 0
+        self.connections = 0
+
+    def _record_wait(self, event, failed: bool):
+        duration = getattr(event, "duration", None)
+        if duration is None:
+            started = getattr(self._started, "at", None)
+            duration = time.perf_counter() - started if started else 0.0
+        wait_ms = duration * 1000
+        with self._lock:
+            if failed:
+                self.failed_checkouts += 1
+            else:
+                self.checkouts += 1
+                self.checked_out += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def connection_check_out_started(self, event):
+        self._started.at = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._record_wait(event, failed=False)
+
+    def connection_check_out_failed(self, event):
+        self._record_wait(event, failed=True)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections -= 1
+
+    # Required by the listener interface; nothing to record
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.failed_checkouts
+            return {
+                "checkouts": self.checkouts,
+                "failed_checkouts": self.failed_checkouts,
+                "checked_out": self.checked_out,
+                "open_connections": self.connections,
+                "avg_wait_ms": round(self.wait_ms_total / attempts, 3) if attempts else 0.0,
+                "max_wait_ms": round(self.wait_ms_max, 3),
+            }
+
+
+_metrics = _PoolMetrics()
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """This process's MongoClient, created on first use (and again after a fork)."""
+    global _client, _client_pid, _metrics
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # Don't ping or verify here: the connection happens lazily on the
+            # first operation, so the app can answer health checks right away
+            # Fresh metrics too: a lock inherited across fork may be held
+            _metrics = _PoolMetrics()
+            _client = MongoClient(
+                MONGO_URI,
+                serverSelectionTimeoutMS=5000,
+                connectTimeoutMS=5000,
+                socketTimeoutMS=10000,
+                maxPoolSize=MAX_POOL_SIZE,
+                waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+                retryWrites=True,
+                event_listeners=[_metrics],
+            )
+            _client_pid = pid
+            print(f"[OK] MongoDB client initialized for pid {pid} (pool {MAX_POOL_SIZE}): {MONGO_URI[:50]}...")
+    return _client
+
+
+def close_client():
+    """Close this process's client; the next access opens a new one."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client, _client_pid = None, None
+
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+
+class _Database:
+    """Forwards everything to get_db(), so `db` is always this process's database."""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+    def __repr__(self):
+        return f"<lazy Database {DATABASE_NAME!r}>"
+
+
+db = _Database()
 
-# Connect without blocking - don't ping or verify at import time
-# This allows the Flask app to start and respond to health checks immediately
-# The actual connection happens lazily when the first DB operation occurs
-try:
-    client = MongoClient(
-        MONGO_URI,
-        serverSelectionTimeoutMS=5000,
-        connectTimeoutMS=5000,
-        socketTimeoutMS=10000,
-        maxPoolSize=10,
-        retryWrites=True
-    )
-    db = client["pepper_database"]
-    print(f"[OK] MongoDB client initialized (lazy connection): {MONGO_URI[:50]}...")
-except Exception as e:
-    print(f"[ERROR] MongoDB client initialization failed: {e}")
-    print("Using fallback - some features may not work")
-    db = None
 
+def pool_stats() -> dict:
+    return {
+        "pid": os.getpid(),
+        "connected": _client is not None and _client_pid == os.getpid(),
+        "max_pool_size": MAX_POOL_SIZE,
+        **_metrics.snapshot(),
+    }
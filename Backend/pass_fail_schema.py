@@ -10,34 +10,12 @@ import os
 from mongodb_config import db
 
 def create_database_indexes():
-    """Create optimized indexes for the pass/fail system"""
+    """Create optimized indexes for the pass/fail system (declared in index_registry)"""
     print("🔧 Creating database indexes...")
-    
-    # Survey configurations indexes
-    try:
-        db.survey_configurations.create_index("survey_id")
-        db.survey_configurations.create_index([("pass_fail_enabled", 1), ("pepperads_redirect_enabled", 1)])
-        
-        # Survey sessions indexes for tracking
-        db.survey_sessions.create_index("survey_id")
-        db.survey_sessions.create_index("user_info.click_id")
-        db.survey_sessions.create_index("step_tracking.timestamp")
-        db.survey_sessions.create_index("evaluation_result.status")
-        
-        # Pass/fail criteria indexes
-        db.pass_fail_criteria.create_index("is_active")
-        db.pass_fail_criteria.create_index("name")
-        
-        # System configuration indexes
-        db.system_config.create_index("config_key")
-        
-        # Enhanced responses indexes
-        db.responses.create_index("session_id")
-        db.responses.create_index([("survey_id", 1), ("evaluation_result.status", 1)])
-        
-        print("✅ Database indexes created successfully")
-    except Exception as e:
-        print(f"❌ Error creating indexes: {e}")
+    from index_registry import ensure_indexes
+    ensure_indexes([
+        "survey_configurations", "survey_sessions", "pass_fail_criteria", "system_config", "responses"
+    ])
 
 def initialize_system_configuration():
     """Initialize global system configuration"""
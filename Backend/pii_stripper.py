@@ -4,17 +4,86 @@ before sending to AI APIs (OpenAI, Gemini, Claude, etc.)
 
 Strips: email addresses, phone numbers, names (when identifiable patterns),
 IP addresses, and other PII patterns.
+
+All patterns are compiled once. One scan for what every rule needs (an @,
+three digits in a row, or digit.digit) clears most survey answers, which are
+returned untouched. The rest are resolved in the original rule order (emails,
+then phones, ...), each rule only scanning the gaps earlier rules left
+unredacted, and only if its guard (a short pattern every match contains) is
+there — the same result as consecutive re.sub passes over the whole text,
+without building a new string per rule. Placeholders are memoized, so a
+value repeated across answers is hashed once.
+
+benchmark_pii_stripper.py checks output parity against pii_parity_corpus.json
+and measures throughput.
 """
 
 import re
 import hashlib
+from functools import lru_cache
+from typing import Iterable, List
+
+_PHONE_SEPARATORS = re.compile(r'[\s\-\(\)\+]')
+
+
+def _long_enough_phone(value: str) -> bool:
+    # International pattern also matches short digit groups; need 10+ digits
+    return len(_PHONE_SEPARATORS.sub('', value)) >= 10
+
+
+# (pattern, guard, accept) in precedence order. `guard` is a cheap pattern every
+# match contains — a text it doesn't find can skip the rule. A match `accept`
+# rejects stays as text.
+_RULES = [
+    # Email addresses
+    (r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', r'@', None),
+    # Phone numbers (various formats)
+    # Indian: +91 XXXXX XXXXX, 91-XXXXXXXXXX, +91XXXXXXXXXX
+    (r'(?:\+?91[\s\-]?)?[6-9]\d{4}[\s\-]?\d{5}', r'[6-9]\d{4}', None),
+    # International: +1-XXX-XXX-XXXX, (XXX) XXX-XXXX, etc.
+    (r'\+?\d{1,3}[\s\-]?\(?\d{2,4}\)?[\s\-]?\d{3,4}[\s\-]?\d{3,4}', r'\d{3}', _long_enough_phone),
+    # IP addresses (IPv4)
+    (r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b', r'\d\.\d', None),
+    # Aadhaar numbers (India): XXXX XXXX XXXX
+    (r'\b[2-9]\d{3}\s?\d{4}\s?\d{4}\b', r'[2-9]\d{3}', None),
+    # PAN numbers (India): ABCDE1234F
+    (r'\b[A-Z]{5}\d{4}[A-Z]\b', r'[A-Z]{5}\d', None),
+]
 
+_COMPILED_RULES = [(re.compile(pattern), re.compile(guard), accept) for pattern, guard, accept in _RULES]
+# Single pass over the whole text: every rule needs an @, three digits in a
+# row or digit.digit, so text without any of them cannot change
+_MAYBE_PII = re.compile(r'[\d@](?:(?<=@)|\d\d|\.\d)')
 
+
+@lru_cache(maxsize=8192)
 def hash_pii(value: str) -> str:
     """Hash a PII value with SHA-256 (first 8 chars for readability)"""
     return "[REDACTED_" + hashlib.sha256(value.encode()).hexdigest()[:8] + "]"
 
 
+def _redact(text: str, rule: int, out: list):
+    """Append text to out with rules[rule:] applied, gap by gap."""
+    if rule == len(_COMPILED_RULES):
+        out.append(text)
+        return
+    pattern, guard, accept = _COMPILED_RULES[rule]
+    if guard.search(text) is None:
+        _redact(text, rule + 1, out)
+        return
+    pos = 0
+    for match in pattern.finditer(text):
+        value = match.group()
+        if accept is not None and not accept(value):
+            continue
+        if match.start() > pos:
+            _redact(text[pos:match.start()], rule + 1, out)
+        out.append(hash_pii(value))
+        pos = match.end()
+    if pos < len(text):
+        _redact(text[pos:] if pos else text, rule + 1, out)
+
+
 def strip_pii(text: str) -> str:
     """
     Strip PII from text before sending to AI APIs.
@@ -22,50 +91,13 @@ def strip_pii(text: str) -> str:
     """
     if not text or not isinstance(text, str):
         return text or ""
-    
-    # Email addresses
-    text = re.sub(
-        r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}',
-        lambda m: hash_pii(m.group()),
-        text
-    )
-    
-    # Phone numbers (various formats)
-    # Indian: +91 XXXXX XXXXX, 91-XXXXXXXXXX, +91XXXXXXXXXX
-    text = re.sub(
-        r'(?:\+?91[\s\-]?)?[6-9]\d{4}[\s\-]?\d{5}',
-        lambda m: hash_pii(m.group()),
-        text
-    )
-    # International: +1-XXX-XXX-XXXX, (XXX) XXX-XXXX, etc.
-    text = re.sub(
-        r'\+?\d{1,3}[\s\-]?\(?\d{2,4}\)?[\s\-]?\d{3,4}[\s\-]?\d{3,4}',
-        lambda m: hash_pii(m.group()) if len(re.sub(r'[\s\-\(\)\+]', '', m.group())) >= 10 else m.group(),
-        text
-    )
-    
-    # IP addresses (IPv4)
-    text = re.sub(
-        r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b',
-        lambda m: hash_pii(m.group()),
-        text
-    )
-    
-    # Aadhaar numbers (India): XXXX XXXX XXXX
-    text = re.sub(
-        r'\b[2-9]\d{3}\s?\d{4}\s?\d{4}\b',
-        lambda m: hash_pii(m.group()),
-        text
-    )
-    
-    # PAN numbers (India): ABCDE1234F
-    text = re.sub(
-        r'\b[A-Z]{5}\d{4}[A-Z]\b',
-        lambda m: hash_pii(m.group()),
-        text
-    )
-    
-    return text
+
+    if _MAYBE_PII.search(text) is None:
+        return text
+
+    out = []
+    _redact(text, 0, out)
+    return "".join(out)
 
 
 def strip_pii_from_answers(answer_text: str) -> str:
@@ -73,6 +105,19 @@ def strip_pii_from_answers(answer_text: str) -> str:
     return strip_pii(str(answer_text))
 
 
+def strip_pii_batch(answers: Iterable) -> List[str]:
+    """strip_pii_from_answers for many answers; repeated answers are scrubbed once"""
+    seen = {}
+    result = []
+    for answer in answers:
+        text = str(answer)
+        scrubbed = seen.get(text)
+        if scrubbed is None:
+            scrubbed = seen[text] = strip_pii(text)
+        result.append(scrubbed)
+    return result
+
+
 def strip_pii_from_prompt(prompt: str) -> str:
     """Strip PII from an AI prompt string"""
     return strip_pii(prompt)
@@ -6,6 +6,9 @@ from flask import Blueprint, request, jsonify, g
 from auth_middleware import requireAdmin
 from mongodb_config import db
 from datetime import datetime
+import os
+import threading
+import time
 
 plan_features_bp = Blueprint('plan_features', __name__, url_prefix='/api/admin/plan-features')
 
@@ -318,29 +321,74 @@ def _get_plan_features_config():
     # Merge: add any new default features that don't exist in the stored doc
     merged = dict(DEFAULT_PLAN_FEATURES)
     for key, val in doc.items():
-        if key not in ("_id", "updated_at", "updated_by"):
+        if key not in ("_id", "updated_at", "updated_by", "version"):
             merged[key] = val
 
     return merged
 
 
-def _config_to_role_features(config: dict) -> dict:
-    """Convert the flat config dict to {role: [features]} format for the frontend."""
-    role_features = {"free": [], "premium": [], "enterprise": [], "admin": []}
+# ── Compiled permission table ─────────────────────────────────────────────────
+# Each plan is an integer bitset over the configured features. The table is
+# rebuilt only when the config document's `version` changes; the version is
+# re-read at most every VERSION_CHECK_SECONDS per process, and writes made
+# through this API rebuild it immediately.
+PLAN_ROLES = ("free", "premium", "enterprise", "admin")
+VERSION_CHECK_SECONDS = float(os.environ.get("PLAN_FEATURES_VERSION_CHECK_SECONDS", "5"))
 
-    for feature_key, feature_data in config.items():
-        if not isinstance(feature_data, dict):
-            continue
-        if feature_data.get("free"):
-            role_features["free"].append(feature_key)
-        if feature_data.get("premium"):
-            role_features["premium"].append(feature_key)
-        if feature_data.get("enterprise"):
-            role_features["enterprise"].append(feature_key)
-        # Admin always gets everything
-        role_features["admin"].append(feature_key)
 
-    return role_features
+class PlanFeatureTable:
+    """Immutable snapshot of the plan features config compiled to bitsets."""
+
+    def __init__(self, config: dict, version: int):
+        self.version = version
+        self.config = config
+        keys = [k for k, v in config.items() if isinstance(v, dict)]
+        self.bits = {key: 1 << i for i, key in enumerate(keys)}
+
+        self.masks = {role: 0 for role in PLAN_ROLES}
+        for key, bit in self.bits.items():
+            for plan in ("free", "premium", "enterprise"):
+                if config[key].get(plan):
+                    self.masks[plan] |= bit
+            # Admin always gets everything
+            self.masks["admin"] |= bit
+
+        self.role_features = {
+            role: [key for key in keys if self.masks[role] & self.bits[key]]
+            for role in PLAN_ROLES
+        }
+
+        # Group by category for the UI
+        self.categories = {}
+        for key in keys:
+            cat = config[key].get("category", "other")
+            self.categories.setdefault(cat, []).append({"key": key, **config[key]})
+
+
+_table = None
+_table_checked_at = 0.0
+_table_lock = threading.Lock()
+
+
+def _stored_version() -> int:
+    doc = db.plan_features_config.find_one({"_id": PLAN_FEATURES_CONFIG_ID}, {"version": 1})
+    return (doc or {}).get("version", 0)
+
+
+def get_plan_feature_table(force: bool = False) -> PlanFeatureTable:
+    """Current compiled table; rebuilt only when the stored version moved."""
+    global _table, _table_checked_at
+
+    table = _table
+    if table is not None and not force and time.monotonic() - _table_checked_at < VERSION_CHECK_SECONDS:
+        return table
+
+    with _table_lock:
+        version = _stored_version()
+        if _table is None or force or version != _table.version:
+            _table = PlanFeatureTable(_get_plan_features_config(), version)
+        _table_checked_at = time.monotonic()
+        return _table
 
 
 @plan_features_bp.route('', methods=['GET'])
@@ -349,27 +397,14 @@ def _config_to_role_features(config: dict) -> dict:
 def get_plan_features():
     """Get the full plan features configuration."""
     try:
-        config = _get_plan_features_config()
-        role_features = _config_to_role_features(config)
-
-        # Group by category for the UI
-        categories = {}
-        for key, data in config.items():
-            if not isinstance(data, dict):
-                continue
-            cat = data.get("category", "other")
-            if cat not in categories:
-                categories[cat] = []
-            categories[cat].append({
-                "key": key,
-                **data
-            })
+        table = get_plan_feature_table()
 
         return jsonify({
-            "features": config,
-            "categories": categories,
-            "role_features": role_features,
-            "default_features": DEFAULT_PLAN_FEATURES
+            "features": table.config,
+            "categories": table.categories,
+            "role_features": table.role_features,
+            "default_features": DEFAULT_PLAN_FEATURES,
+            "version": table.version
         })
     except Exception as e:
         return jsonify({"error": f"Failed to get plan features: {str(e)}"}), 500
@@ -382,9 +417,7 @@ def get_plan_features_public():
     No auth required so the auth check endpoint can call this.
     """
     try:
-        config = _get_plan_features_config()
-        role_features = _config_to_role_features(config)
-        return jsonify({"role_features": role_features})
+        return jsonify({"role_features": get_plan_feature_table().role_features})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -400,7 +433,7 @@ def update_plan_feature():
             return jsonify({"error": "feature_key is required"}), 400
 
         # Validate feature_key exists in defaults or current config
-        config = _get_plan_features_config()
+        config = get_plan_feature_table().config
         if feature_key not in config:
             return jsonify({"error": f"Unknown feature: {feature_key}"}), 400
 
@@ -417,9 +450,10 @@ def update_plan_feature():
 
         db.plan_features_config.update_one(
             {"_id": PLAN_FEATURES_CONFIG_ID},
-            {"$set": updates},
+            {"$set": updates, "$inc": {"version": 1}},
             upsert=True
         )
+        get_plan_feature_table(force=True)
 
         return jsonify({
             "message": f"Feature '{feature_key}' updated successfully",
@@ -439,7 +473,7 @@ def bulk_update_plan_features():
         if not updates_list:
             return jsonify({"error": "updates array is required"}), 400
 
-        config = _get_plan_features_config()
+        config = get_plan_feature_table().config
         mongo_updates = {}
 
         for update in updates_list:
@@ -458,9 +492,10 @@ def bulk_update_plan_features():
 
         db.plan_features_config.update_one(
             {"_id": PLAN_FEATURES_CONFIG_ID},
-            {"$set": mongo_updates},
+            {"$set": mongo_updates, "$inc": {"version": 1}},
             upsert=True
         )
+        get_plan_feature_table(force=True)
 
         return jsonify({
             "message": f"Updated {len(updates_list)} features",
@@ -476,15 +511,22 @@ def reset_to_defaults():
     """Reset all plan features to the default configuration."""
     try:
         seed = dict(DEFAULT_PLAN_FEATURES)
-        seed["_id"] = PLAN_FEATURES_CONFIG_ID
         seed["updated_at"] = datetime.utcnow().isoformat()
         seed["updated_by"] = str(g.current_user.get("email", "admin"))
 
-        db.plan_features_config.replace_one(
+        # $inc keeps the version moving even when resets and edits race
+        update = {"$set": seed, "$inc": {"version": 1}}
+        stored = db.plan_features_config.find_one({"_id": PLAN_FEATURES_CONFIG_ID}) or {}
+        extra = [key for key in stored if key not in seed and key not in ("_id", "version")]
+        if extra:
+            update["$unset"] = {key: "" for key in extra}
+
+        db.plan_features_config.update_one(
             {"_id": PLAN_FEATURES_CONFIG_ID},
-            seed,
+            update,
             upsert=True
         )
+        get_plan_feature_table(force=True)
 
         return jsonify({"message": "Plan features reset to defaults"})
     except Exception as e:
@@ -5,9 +5,12 @@ Handles: promoter registration, summary, activity, admin views, payouts
 from flask import Blueprint, request, jsonify, g
 from auth_middleware import requireAuth, requireAdmin
 from mongodb_config import db
+from id_allocator import id_allocator
+from referral_ledger import (
+    record_referral_event, transition_event, attach_available_to_payout,
+    settle_payout, payout_event_ids, get_balance, total_balances,
+)
 from datetime import datetime, timedelta
-import random
-import string
 from bson import ObjectId
 
 referral_bp = Blueprint('referral', __name__)
@@ -22,18 +25,6 @@ def handle_options():
 
 # ─── Helpers ──────────────────────────────────────────────────────────────────
 
-SAFE_CHARS = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'   # no 0/O 1/I/L
-
-def _gen_code(length=7):
-    return ''.join(random.choices(SAFE_CHARS, k=length))
-
-def _unique_code():
-    for _ in range(10):
-        code = _gen_code()
-        if not db.promoters.find_one({'ref_code': code}):
-            return code
-    raise RuntimeError('Could not generate unique ref_code after 10 attempts')
-
 def _oid(doc):
     """Safely convert _id to str in a dict."""
     if doc and '_id' in doc:
@@ -44,39 +35,6 @@ def _fmt_user_id(user):
     """Return consistent string user id from a user doc."""
     return str(user.get('_id', ''))
 
-# ─── Ensure indexes exist (called at startup) ─────────────────────────────────
-
-def setup_referral_indexes():
-    try:
-        db.promoters.create_index('ref_code', unique=True)
-        db.promoters.create_index('user_id', unique=True)
-        db.referral_attributions.create_index('visitor_id', unique=True)
-        db.referral_attributions.create_index([('ref_code', 1), ('first_seen', -1)])
-        db.referral_attributions.create_index('user_id')
-        db.referral_events.create_index([('ref_code', 1), ('status', 1)])
-        db.referral_events.create_index(
-            [('status', 1), ('eligible_at', 1)],
-            partialFilterExpression={'status': 'pending'}
-        )
-        # Idempotency: one credit per subscription per billing month
-        db.referral_events.create_index(
-            [('subscription_id', 1), ('billing_period', 1)],
-            unique=True,
-            partialFilterExpression={'type': {'$in': ['subscription_monthly', 'subscription_annual']},
-                                     'subscription_id': {'$exists': True},
-                                     'billing_period': {'$exists': True}}
-        )
-        # One signup credit per user ever
-        db.referral_events.create_index(
-            [('user_id', 1)],
-            unique=True,
-            partialFilterExpression={'type': 'signup'}
-        )
-        db.referral_payouts.create_index('ref_code')
-        print('✅ Referral indexes ensured')
-    except Exception as e:
-        print(f'⚠️ Referral index setup warning: {e}')
-
 # ─── Partner (promoter-facing) endpoints ──────────────────────────────────────
 
 @referral_bp.route('/api/partner/join', methods=['POST', 'OPTIONS'])
@@ -97,16 +55,14 @@ def join_program():
             'already_member': True
         }), 200
 
-    ref_code = _unique_code()
     doc = {
         'user_id':      uid,
-        'ref_code':     ref_code,
         'display_name': user.get('name') or user.get('email', '').split('@')[0],
         'payout_method': {},
         'status':       'active',
         'created_at':   datetime.utcnow(),
     }
-    db.promoters.insert_one(doc)
+    ref_code = id_allocator.insert_with_id('ref_code', 'promoters', doc, 'ref_code')
     return jsonify({'ref_code': ref_code, 'link': _make_link(ref_code), 'already_member': False}), 201
 
 
@@ -139,9 +95,8 @@ def partner_summary():
         {'ref_code': rc, 'type': 'subscription_monthly', 'status': {'$in': ['pending', 'approved']}})
     mrr_cents = subs_active * 400
 
-    # Balance
-    bal_available = _available_balance(rc)
-    bal_pending   = _pending_balance(rc)
+    # Balance (materialized running totals on the promoter doc)
+    balance = get_balance(promo)
 
     return jsonify({
         'ref_code':               rc,
@@ -152,8 +107,10 @@ def partner_summary():
         'signups_pending':        signups_pending,
         'subscriptions_active':   subs_active,
         'mrr_cents':              mrr_cents,
-        'balance_available_cents': bal_available,
-        'balance_pending_cents':  bal_pending,
+        'balance_available_cents': balance['available_cents'],
+        'balance_pending_cents':  balance['pending_cents'],
+        'balance_requested_cents': balance['requested_cents'],
+        'balance_paid_cents':     balance['paid_cents'],
     })
 
 
@@ -223,21 +180,10 @@ def request_payout():
         return jsonify({'error': 'Please add a payment method before requesting payout'}), 400
 
     rc      = promo['ref_code']
-    amount  = _available_balance(rc)
+    amount  = get_balance(promo)['available_cents']
     if amount < 2500:   # €25 minimum
         return jsonify({'error': 'Minimum payout is €25.00. Keep earning!'}), 400
 
-    # Find all approved unpaid events
-    paid_event_ids = set(
-        pe['event_id'] for pe in db.referral_payout_events.find({}, {'event_id': 1})
-    )
-    eligible = list(db.referral_events.find({
-        'ref_code': rc, 'status': 'approved',
-        '_id': {'$nin': list(paid_event_ids)}
-    }))
-    if not eligible:
-        return jsonify({'error': 'No approved earnings available'}), 400
-
     payout_doc = {
         'ref_code':     rc,
         'amount_cents': amount,
@@ -248,9 +194,17 @@ def request_payout():
     payout_res = db.referral_payouts.insert_one(payout_doc)
     payout_id  = payout_res.inserted_id
 
-    # Link events to payout
+    # Claim every available event for this payout; the amount is whatever was
+    # actually claimed, so a concurrent request can't pay the same events twice
+    amount = attach_available_to_payout(rc, payout_id)
+    if amount <= 0:
+        db.referral_payouts.delete_one({'_id': payout_id})
+        return jsonify({'error': 'No approved earnings available'}), 400
+    db.referral_payouts.update_one({'_id': payout_id}, {'$set': {'amount_cents': amount}})
+
+    # Keep the payout ↔ event link table for audit
     db.referral_payout_events.insert_many([
-        {'payout_id': payout_id, 'event_id': ev['_id']} for ev in eligible
+        {'payout_id': payout_id, 'event_id': eid} for eid in payout_event_ids(payout_id)
     ])
 
     return jsonify({
@@ -268,14 +222,9 @@ def admin_liability():
     if request.method == 'OPTIONS':
         return '', 200
 
-    # Payable now
-    paid_ids   = set(pe['event_id'] for pe in db.referral_payout_events.find({}, {'event_id': 1}))
-    payable_pipeline = [
-        {'$match': {'status': 'approved', '_id': {'$nin': list(paid_ids)}}},
-        {'$group': {'_id': None, 'total': {'$sum': '$amount_cents'}}}
-    ]
-    payable_res = list(db.referral_events.aggregate(payable_pipeline))
-    payable_now = payable_res[0]['total'] if payable_res else 0
+    # Payable now (sum of promoters' running balances)
+    totals      = total_balances()
+    payable_now = totals['available_cents']
 
     # Recurring liability (active monthly sub events × 400)
     active_monthly = db.referral_events.count_documents({
@@ -300,6 +249,7 @@ def admin_liability():
 
     return jsonify({
         'payable_now_cents':          payable_now,
+        'requested_payouts_cents':    totals['requested_cents'],
         'recurring_liability_cents':  active_monthly * 400,
         'signups_on_hold_cents':      signups_hold_cents,
         'signups_on_hold_count':      signups_hold_count,
@@ -369,8 +319,7 @@ def admin_promoters():
             if pm.get('crypto', {}).get('wallet_address'):
                 methods_saved.append('crypto')
 
-            bal_available = _available_balance(rc)
-            bal_pending   = _pending_balance(rc)
+            balance = get_balance(p)
 
             total_clicks  = db.referral_events.count_documents({'ref_code': rc, 'type': 'session'})
             total_signups = db.referral_events.count_documents({'ref_code': rc, 'type': 'signup'})
@@ -392,8 +341,8 @@ def admin_promoters():
                 'created_at':              created.isoformat() if isinstance(created, datetime) else str(created or ''),
                 'methods_saved':           methods_saved,
                 'has_payment':             len(methods_saved) > 0,
-                'balance_available_cents': bal_available,
-                'balance_pending_cents':   bal_pending,
+                'balance_available_cents': balance['available_cents'],
+                'balance_pending_cents':   balance['pending_cents'],
                 'total_clicks':            total_clicks,
                 'total_signups':           total_signups,
                 'link':                    _make_link(rc),
@@ -450,12 +399,10 @@ def admin_promoter_payment(ref_code):
         return jsonify({'error': 'Already reversed'}), 409
 
     # Mark original as reversed
-    db.referral_events.update_one({'_id': oid}, {
-        '$set': {
-            'status':      'reversed',
-            'reviewed_at': datetime.utcnow(),
-            'reject_reason': reason,
-        }
+    transition_event(oid, {
+        'status':      'reversed',
+        'reviewed_at': datetime.utcnow(),
+        'reject_reason': reason,
     })
     # Insert compensating row
     compensating = {
@@ -475,7 +422,7 @@ def admin_promoter_payment(ref_code):
         'flags':          [],
         'created_at':     datetime.utcnow(),
     }
-    db.referral_events.insert_one(compensating)
+    record_referral_event(compensating)
     return jsonify({'success': True})
 
 
@@ -488,7 +435,7 @@ def admin_restore_event(event_id):
         oid = ObjectId(event_id)
     except Exception:
         return jsonify({'error': 'Invalid event id'}), 400
-    db.referral_events.update_one({'_id': oid}, {'$set': {'status': 'pending', 'reviewed_at': datetime.utcnow()}})
+    transition_event(oid, {'status': 'pending', 'reviewed_at': datetime.utcnow()})
     return jsonify({'success': True})
 
 
@@ -504,11 +451,12 @@ def admin_bulk_reverse():
     for eid in ids:
         try:
             oid = ObjectId(eid)
-            ev  = db.referral_events.find_one({'_id': oid})
-            if ev and ev.get('status') != 'reversed':
-                db.referral_events.update_one({'_id': oid}, {
-                    '$set': {'status': 'reversed', 'reviewed_at': datetime.utcnow(), 'reject_reason': reason}
-                })
+            moved = transition_event(
+                oid,
+                {'status': 'reversed', 'reviewed_at': datetime.utcnow(), 'reject_reason': reason},
+                expect={'status': {'$ne': 'reversed'}}
+            )
+            if moved:
                 count += 1
         except Exception:
             pass
@@ -530,8 +478,7 @@ def admin_promoter_view(ref_code):
     clicks_unique = db.referral_attributions.count_documents({'ref_code': ref_code})
     subs_active   = db.referral_events.count_documents(
         {'ref_code': ref_code, 'type': 'subscription_monthly', 'status': {'$in': ['pending', 'approved']}})
-    bal_available = _available_balance(ref_code)
-    bal_pending   = _pending_balance(ref_code)
+    balance = get_balance(promo)
 
     events = list(db.referral_events.find({'ref_code': ref_code}).sort('occurred_at', -1).limit(100))
     activity = []
@@ -555,11 +502,27 @@ def admin_promoter_view(ref_code):
         'clicks_unique':          clicks_unique,
         'subscriptions_active':   subs_active,
         'mrr_cents':              subs_active * 400,
-        'balance_available_cents': bal_available,
-        'balance_pending_cents':  bal_pending,
+        'balance_available_cents': balance['available_cents'],
+        'balance_pending_cents':  balance['pending_cents'],
         'activity':               activity,
     })
 
+
+@referral_bp.route('/api/admin/referrals/promoters/<ref_code>/rebuild-balance', methods=['POST', 'OPTIONS'])
+@requireAdmin
+def admin_rebuild_balance(ref_code):
+    """Recompute a promoter's running balances from their events (repairs drift)."""
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    promo = db.promoters.find_one({'ref_code': ref_code}, {'ref_code': 1, 'balance': 1})
+    if not promo:
+        return jsonify({'error': 'Promoter not found'}), 404
+
+    before  = {**promo.get('balance', {})}
+    balance = get_balance(promo, rebuild=True)
+    return jsonify({'ref_code': ref_code, 'previous': before, 'balance': balance})
+
 # ─── Private helpers ──────────────────────────────────────────────────────────
 
 def _make_link(ref_code):
@@ -567,23 +530,6 @@ def _make_link(ref_code):
     base = os.getenv('FRONTEND_URL', 'https://survey.pepperwahl.com')
     return f'{base}/signup?ref={ref_code}'
 
-def _available_balance(ref_code):
-    paid_ids = set(pe['event_id'] for pe in db.referral_payout_events.find({}, {'event_id': 1}))
-    pipeline = [
-        {'$match': {'ref_code': ref_code, 'status': 'approved', '_id': {'$nin': list(paid_ids)}}},
-        {'$group': {'_id': None, 'total': {'$sum': '$amount_cents'}}}
-    ]
-    res = list(db.referral_events.aggregate(pipeline))
-    return res[0]['total'] if res else 0
-
-def _pending_balance(ref_code):
-    pipeline = [
-        {'$match': {'ref_code': ref_code, 'status': 'pending'}},
-        {'$group': {'_id': None, 'total': {'$sum': '$amount_cents'}}}
-    ]
-    res = list(db.referral_events.aggregate(pipeline))
-    return res[0]['total'] if res else 0
-
 def _signup_status(ev):
     if ev.get('type') != 'signup':
         return None
@@ -688,7 +634,7 @@ def _record_signup_attribution(user_id, ref_code, req):
 
     # 5. Insert signup event (idempotent via unique index on user_id/type=signup)
     try:
-        db.referral_events.insert_one({
+        record_referral_event({
             'ref_code':      ref_code,
             'attribution_id': attr_id,
             'type':          'signup',
@@ -787,7 +733,7 @@ def track_referral_click():
 
     # Insert session event
     try:
-        db.referral_events.insert_one({
+        record_referral_event({
             'ref_code':      ref_code,
             'attribution_id': attr_id,
             'type':          'session',
@@ -1016,10 +962,13 @@ def admin_mark_payout_paid(payout_id):
     if not transaction_id:
         return jsonify({'error': 'transaction_id is required'}), 400
 
-    db.referral_payouts.update_one({'_id': oid}, {'$set': {
+    # Only the first mark-paid settles the ledger
+    marked = db.referral_payouts.update_one({'_id': oid, 'status': {'$ne': 'paid'}}, {'$set': {
         'status':         'paid',
         'paid_at':        datetime.utcnow(),
         'transaction_id': transaction_id,
         'admin_message':  data.get('message', ''),
     }})
+    if marked.modified_count:
+        settle_payout(payout['ref_code'], oid)
     return jsonify({'success': True})
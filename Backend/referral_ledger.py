@@ -0,0 +1,267 @@
+"""
+Referral Ledger
+Materialized running balances for promoters.
+
+Every referral_event carries a payout_state (unpaid → requested → paid) and a
+ledger_bucket naming the balance it currently counts toward. Each promoter
+document holds the running totals under `balance`:
+
+    balance.available_cents  approved, not yet in a payout
+    balance.pending_cents    still in review
+    balance.requested_cents  attached to a requested payout
+    balance.paid_cents       attached to a paid payout
+
+Every state change moves an event between buckets with a guarded update on the
+event and a single $inc on the promoter, so balance reads are one document
+lookup instead of an aggregation over all events and payouts.
+
+An event write and its $inc are two operations, so each write first pushes a
+lease onto `balance_leases` and pulls it again together with the $inc, which
+also bumps `balance_version`. A rebuild only stores its aggregate if no
+unexpired lease was held when it read the promoter and no write has finished
+since; otherwise it tries again. A writer that dies between the two leaves a
+lease that simply expires after WRITE_LEASE_SECONDS (and an $inc that never
+happened, which an admin rebuild repairs).
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from pymongo import ReturnDocument
+from mongodb_config import db
+
+BUCKETS = ('available', 'pending', 'requested', 'paid')
+
+PAYOUT_UNPAID = 'unpaid'
+PAYOUT_REQUESTED = 'requested'
+PAYOUT_PAID = 'paid'
+
+# Attempts at storing a rebuilt balance before giving up on concurrent writes
+REBUILD_ATTEMPTS = 5
+# How long an event write may hold off rebuilds; covers a writer that died mid-write
+WRITE_LEASE_SECONDS = 30
+
+
+def _empty_balance() -> Dict[str, int]:
+    return {f'{b}_cents': 0 for b in BUCKETS}
+
+
+def bucket_of(event: dict) -> Optional[str]:
+    """Which balance an event counts toward, or None if it no longer counts."""
+    payout_state = event.get('payout_state') or PAYOUT_UNPAID
+    if payout_state in (PAYOUT_REQUESTED, PAYOUT_PAID):
+        return payout_state
+    return {'approved': 'available', 'pending': 'pending'}.get(event.get('status'))
+
+
+def _apply_delta(ref_code: str, deltas: Dict[Optional[str], int], lease_id: str):
+    """$inc the promoter's running balances and release the write lease; None buckets are ignored."""
+    inc = {f'balance.{b}_cents': amount for b, amount in deltas.items() if b and amount}
+    release = {'balance_leases': {'id': lease_id}}
+    if inc:
+        result = db.promoters.update_one(
+            {'ref_code': ref_code, 'balance': {'$exists': True}},
+            {
+                '$inc': {**inc, 'balance_version': 1},
+                '$set': {'balance_updated_at': datetime.utcnow()},
+                '$pull': release,
+            }
+        )
+        if result.matched_count:
+            return
+    # Not materialized yet (or nothing moved): a rebuild still has to see the write
+    db.promoters.update_one({'ref_code': ref_code}, {'$inc': {'balance_version': 1}, '$pull': release})
+
+
+@contextmanager
+def _ledger_write(ref_code: str):
+    """Bracket an event write; the bucket deltas collected in the yielded dict are applied on exit."""
+    lease = {'id': uuid.uuid4().hex, 'until': datetime.utcnow() + timedelta(seconds=WRITE_LEASE_SECONDS)}
+    db.promoters.update_one({'ref_code': ref_code}, {'$push': {'balance_leases': lease}})
+    deltas: Dict[Optional[str], int] = {}
+    try:
+        yield deltas
+    finally:
+        _apply_delta(ref_code, deltas, lease['id'])
+
+
+# ─── Writes ───────────────────────────────────────────────────────────────────
+
+def record_referral_event(doc: dict):
+    """Insert a referral_event and credit its bucket. Raises on duplicate like insert_one."""
+    doc = dict(doc)
+    doc.setdefault('payout_state', PAYOUT_UNPAID)
+    doc['ledger_bucket'] = bucket_of(doc)
+    with _ledger_write(doc['ref_code']) as deltas:
+        result = db.referral_events.insert_one(doc)
+        deltas[doc['ledger_bucket']] = doc.get('amount_cents', 0)
+    return result
+
+
+def transition_event(event_id, set_fields: dict, expect: Optional[dict] = None) -> Optional[dict]:
+    """
+    Change an event's status/payout_state and move its amount between buckets.
+
+    The update only applies if the event is still in the state we read, so two
+    concurrent transitions can never both move the same amount. Returns the
+    updated event, or None if it was missing, did not match `expect`, or changed
+    underneath us.
+    """
+    before = db.referral_events.find_one({'_id': event_id, **(expect or {})})
+    if not before:
+        return None
+
+    old_bucket = before.get('ledger_bucket', bucket_of(before))
+    new_bucket = bucket_of({**before, **set_fields})
+    with _ledger_write(before['ref_code']) as deltas:
+        after = db.referral_events.find_one_and_update(
+            {
+                '_id': event_id,
+                'status': before.get('status'),
+                'payout_state': before.get('payout_state'),
+            },
+            {'$set': {**set_fields, 'ledger_bucket': new_bucket}},
+            return_document=ReturnDocument.AFTER
+        )
+        if after and old_bucket != new_bucket:
+            amount = before.get('amount_cents', 0)
+            deltas.update({old_bucket: -amount, new_bucket: amount})
+    return after
+
+
+def attach_available_to_payout(ref_code: str, payout_id) -> int:
+    """
+    Move every available event of a promoter into a payout.
+    Returns the total amount moved, computed from the events actually claimed.
+    """
+    with _ledger_write(ref_code) as deltas:
+        db.referral_events.update_many(
+            {'ref_code': ref_code, 'ledger_bucket': 'available'},
+            {'$set': {
+                'payout_state': PAYOUT_REQUESTED,
+                'payout_id': payout_id,
+                'ledger_bucket': PAYOUT_REQUESTED,
+            }}
+        )
+        amount = _sum_events({'payout_id': payout_id, 'ledger_bucket': PAYOUT_REQUESTED})
+        deltas.update({'available': -amount, 'requested': amount})
+    return amount
+
+
+def settle_payout(ref_code: str, payout_id) -> int:
+    """Move a payout's events from requested to paid. Returns the amount settled."""
+    with _ledger_write(ref_code) as deltas:
+        amount = _sum_events({'payout_id': payout_id, 'ledger_bucket': PAYOUT_REQUESTED})
+        db.referral_events.update_many(
+            {'payout_id': payout_id, 'ledger_bucket': PAYOUT_REQUESTED},
+            {'$set': {'payout_state': PAYOUT_PAID, 'ledger_bucket': PAYOUT_PAID}}
+        )
+        deltas.update({'requested': -amount, 'paid': amount})
+    return amount
+
+
+def payout_event_ids(payout_id) -> List:
+    return [ev['_id'] for ev in db.referral_events.find({'payout_id': payout_id}, {'_id': 1})]
+
+
+# ─── Reads ────────────────────────────────────────────────────────────────────
+
+def _sum_events(match: dict) -> int:
+    res = list(db.referral_events.aggregate([
+        {'$match': match},
+        {'$group': {'_id': None, 'total': {'$sum': '$amount_cents'}}}
+    ]))
+    return res[0]['total'] if res else 0
+
+
+def rebuild_promoter_balance(ref_code: str) -> Dict[str, int]:
+    """
+    Recompute a promoter's balances from their events and store them.
+    Also backfills payout_state/ledger_bucket on events written before the ledger
+    existed, using only this promoter's payouts.
+
+    The store is fenced on balance_leases/balance_version (see module
+    docstring). If writes keep racing it, the computed balance is returned
+    without being stored. Safe to call on a materialized balance, which is how
+    admins repair one that has drifted.
+    """
+    payouts = list(db.referral_payouts.find({'ref_code': ref_code}, {'status': 1}))
+    for payout in payouts:
+        state = PAYOUT_PAID if payout.get('status') == 'paid' else PAYOUT_REQUESTED
+        linked = [pe['event_id'] for pe in db.referral_payout_events.find(
+            {'payout_id': payout['_id']}, {'event_id': 1})]
+        if linked:
+            db.referral_events.update_many(
+                {'_id': {'$in': linked}, 'payout_state': {'$exists': False}},
+                {'$set': {'payout_state': state, 'payout_id': payout['_id'], 'ledger_bucket': state}}
+            )
+
+    legacy = {'ref_code': ref_code, 'payout_state': {'$exists': False}}
+    db.referral_events.update_many({**legacy, 'status': 'approved'},
+                                   {'$set': {'payout_state': PAYOUT_UNPAID, 'ledger_bucket': 'available'}})
+    db.referral_events.update_many({**legacy, 'status': 'pending'},
+                                   {'$set': {'payout_state': PAYOUT_UNPAID, 'ledger_bucket': 'pending'}})
+    db.referral_events.update_many(legacy, {'$set': {'payout_state': PAYOUT_UNPAID, 'ledger_bucket': None}})
+
+    for attempt in range(REBUILD_ATTEMPTS):
+        now = datetime.utcnow()
+        fence = db.promoters.find_one({'ref_code': ref_code}, {'balance_leases': 1, 'balance_version': 1})
+        if fence is None:
+            return _aggregate_balance(ref_code)
+        live = [lease for lease in fence.get('balance_leases') or [] if lease.get('until', now) > now]
+        if not live:
+            balance = _aggregate_balance(ref_code)
+            stored = db.promoters.update_one(
+                {
+                    'ref_code': ref_code,
+                    'balance_version': fence.get('balance_version'),
+                    'balance_leases': {'$not': {'$elemMatch': {'until': {'$gt': now}}}},
+                },
+                {
+                    '$set': {'balance': balance, 'balance_updated_at': datetime.utcnow()},
+                    # Leases left behind by writers that died
+                    '$pull': {'balance_leases': {'until': {'$lte': now}}},
+                }
+            )
+            if stored.matched_count:
+                return balance
+        time.sleep(0.05 * (attempt + 1))
+
+    balance = _aggregate_balance(ref_code)
+
+    print(f"⚠️ [ReferralLedger] Balance rebuild for {ref_code} kept racing event writes; not stored")
+    return balance
+
+
+def _aggregate_balance(ref_code: str) -> Dict[str, int]:
+    balance = _empty_balance()
+    for row in db.referral_events.aggregate([
+        {'$match': {'ref_code': ref_code, 'ledger_bucket': {'$in': list(BUCKETS)}}},
+        {'$group': {'_id': '$ledger_bucket', 'total': {'$sum': '$amount_cents'}}}
+    ]):
+        balance[f"{row['_id']}_cents"] = row['total']
+    return balance
+
+
+def get_balance(promoter: dict, rebuild: bool = False) -> Dict[str, int]:
+    """Running balances for a promoter document, rebuilding if never materialized or asked to."""
+    balance = promoter.get('balance')
+    if balance is None or rebuild:
+        balance = rebuild_promoter_balance(promoter['ref_code'])
+    return {**_empty_balance(), **balance}
+
+
+def total_balances() -> Dict[str, int]:
+    """Sum of every promoter's running balances (admin liability)."""
+    for promoter in db.promoters.find({'balance': {'$exists': False}}, {'ref_code': 1}):
+        rebuild_promoter_balance(promoter['ref_code'])
+
+    group = {'_id': None}
+    for b in BUCKETS:
+        group[f'{b}_cents'] = {'$sum': f'$balance.{b}_cents'}
+    res = list(db.promoters.aggregate([{'$group': group}]))
+    if not res:
+        return _empty_balance()
+    res[0].pop('_id', None)
+    return res[0]
@@ -73,6 +73,12 @@ class RoleManager:
         }
     }
     
+    # Compiled from ROLE_FEATURES below the class: one bit per feature and a
+    # bitset per role, so a feature check is a single AND
+    FEATURE_BITS: Dict[str, int] = {}
+    ROLE_MASKS: Dict[str, int] = {}
+    ROLE_FEATURE_LISTS: Dict[str, List[str]] = {}
+    
     # Status messages for blocked users
     STATUS_MESSAGES: Dict[UserStatus, StatusMessage] = {
         UserStatus.DISAPPROVED: StatusMessage(
@@ -106,32 +112,32 @@ class RoleManager:
     @classmethod
     def has_feature_access(cls, role: str, feature: str) -> bool:
         """Check if user role has access to specific feature"""
-        try:
-            user_role = UserRole(role)
-            feature_enum = Feature(feature)
-        except ValueError:
-            return False
-        
-        return feature_enum in cls.ROLE_FEATURES.get(user_role, set())
+        return bool(cls.ROLE_MASKS.get(role, 0) & cls.FEATURE_BITS.get(feature, 0))
     
     @classmethod
     def get_user_features(cls, role: str) -> List[str]:
         """Get list of features available to user role"""
-        try:
-            user_role = UserRole(role)
-        except ValueError:
-            return []
-        
-        features = cls.ROLE_FEATURES.get(user_role, set())
-        return [feature.value for feature in features]
+        return list(cls.ROLE_FEATURE_LISTS.get(role, []))
     
     @classmethod
     def get_role_hierarchy(cls) -> Dict[str, List[str]]:
         """Get role hierarchy with features for frontend"""
-        return {
-            role.value: [feature.value for feature in features]
-            for role, features in cls.ROLE_FEATURES.items()
-        }
+        return {role: list(features) for role, features in cls.ROLE_FEATURE_LISTS.items()}
+    
+    @classmethod
+    def compile_permissions(cls):
+        """Rebuild the feature bits and role bitsets from ROLE_FEATURES"""
+        cls.FEATURE_BITS = {feature.value: 1 << i for i, feature in enumerate(Feature)}
+        cls.ROLE_MASKS = {}
+        cls.ROLE_FEATURE_LISTS = {}
+        for role, features in cls.ROLE_FEATURES.items():
+            mask = 0
+            for feature in features:
+                mask |= cls.FEATURE_BITS[feature.value]
+            cls.ROLE_MASKS[role.value] = mask
+            cls.ROLE_FEATURE_LISTS[role.value] = [
+                feature.value for feature in Feature if mask & cls.FEATURE_BITS[feature.value]
+            ]
     
     @classmethod
     def is_valid_role(cls, role: str) -> bool:
@@ -191,3 +197,6 @@ class RoleManager:
             UserRole.ADMIN.value: "Administrator"
         }
         return display_names.get(role, role.title())
+
+
+RoleManager.compile_permissions()
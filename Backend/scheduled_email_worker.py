@@ -0,0 +1,63 @@
+"""
+Scheduled Email Worker
+Sends delayed trigger emails (scheduled_emails) once they are due.
+
+    python scheduled_email_worker.py
+
+Each pass claims a batch of due emails with find_one_and_update leases (see
+EmailTriggerService.process_scheduled_emails), so any number of schedulers —
+plus the /api/process-scheduled-emails endpoint — can run at once without
+sending an email twice. An email whose scheduler died mid-batch is picked up
+again once its lease expires. funnel_worker.py also runs this loop on a
+thread, so the existing worker service delivers scheduled emails.
+
+Config (env):
+    SCHEDULED_EMAIL_POLL_SECONDS    idle wait between passes (default 30)
+    SCHEDULED_EMAIL_BATCH           emails claimed per pass (default 50)
+    SCHEDULED_EMAIL_LEASE_SECONDS   claim length (default 300)
+"""
+import os
+import signal
+import threading
+from index_registry import warn_missing_indexes
+
+POLL_SECONDS = float(os.environ.get("SCHEDULED_EMAIL_POLL_SECONDS", "30"))
+
+
+def run_scheduler(stop: threading.Event = None, poll_seconds: float = POLL_SECONDS):
+    """Send due scheduled emails until `stop` is set."""
+    from job_queue import worker_id
+    from email_trigger_service import email_trigger_service, SCHEDULED_EMAIL_BATCH
+
+    me = worker_id()
+    stop = stop or threading.Event()
+    print(f"📬 [ScheduledEmails] {me} polling every {poll_seconds:g}s")
+    while not stop.is_set():
+        results = email_trigger_service.process_scheduled_emails(worker=me)
+        # A full batch means more are probably due; go again straight away
+        if results.get("error") or results["processed"] < SCHEDULED_EMAIL_BATCH:
+            stop.wait(poll_seconds)
+
+
+def start_scheduler_thread(stop: threading.Event = None) -> threading.Thread:
+    thread = threading.Thread(target=run_scheduler, args=(stop,), daemon=True, name="scheduled-emails")
+    thread.start()
+    return thread
+
+
+def main():
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        print(f"🛑 [ScheduledEmails] Signal {signum}, stopping after the current batch")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    warn_missing_indexes(["scheduled_emails"])
+    run_scheduler(stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Segment Analytics Engine
+Cross-tabulations and segment filters over a survey's responses.
+
+Responses are loaded once into a columnar index where every (field, value)
+pair is stored as a bitmask (a Python int, bit i = response row i). Filters
+combine masks with AND / OR / NOT and counts are popcounts, so a query over
+hundreds of thousands of responses is a handful of big-int operations instead
+of a Python loop per response.
+"""
+
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from mongodb_config import db
+from utils.ttl_cache import TTLCache
+
+# Non-question fields that can be filtered and cross-tabulated
+META_FIELDS = ("device", "country", "pace", "status")
+
+FILTER_OPS = ("eq", "in", "not_in", "answered", "not_answered")
+
+# Built indexes per survey; validated against a cheap fingerprint on every query
+_index_cache = TTLCache(maxsize=32, ttl=600)
+_build_locks: Dict[str, threading.Lock] = {}
+_build_locks_guard = threading.Lock()
+
+_RESPONSE_PROJECTION = {
+    "responses": 1,
+    "question_timings": 1,
+    "user_info.user_agent": 1,
+    "user_info.location": 1,
+    "user_agent": 1,
+    "location": 1,
+    "status": 1,
+}
+
+
+def _bits_to_mask(rows: List[int], size: int) -> int:
+    """Pack a list of row numbers into an int bitmask in O(size)."""
+    buf = bytearray((size + 7) // 8)
+    for i in rows:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _answer_values(answer) -> List[str]:
+    """Normalise a stored answer into the list of values it selects."""
+    if answer is None or answer == "":
+        return []
+    if isinstance(answer, (list, tuple, set)):
+        return [str(a) for a in answer if a is not None and a != ""]
+    return [str(answer)]
+
+
+def _country_of(resp: dict) -> str:
+    location = resp.get("location") or (resp.get("user_info") or {}).get("location")
+    if isinstance(location, dict):
+        return location.get("country") or "Unknown"
+    if isinstance(location, str) and location.strip():
+        # Stored as "City, Country" by the analytics location lookup
+        return location.split(",")[-1].strip() or "Unknown"
+    return "Unknown"
+
+
+class ResponseIndex:
+    """Columnar bitmask index of one survey's responses."""
+
+    def __init__(self, survey_id: str, questions: List[dict]):
+        self.survey_id = survey_id
+        self.questions = {q["question_id"]: q for q in questions}
+        self.question_order = [q["question_id"] for q in questions]
+        self.size = 0
+        self.columns: Dict[str, Dict[str, int]] = {}
+        self.answered: Dict[str, int] = {}
+        self.fingerprint = None
+        self.built_at = None
+        self.build_ms = 0
+
+    @property
+    def full_mask(self) -> int:
+        return (1 << self.size) - 1
+
+    def fields(self) -> List[str]:
+        return self.question_order + list(META_FIELDS)
+
+    def build(self, responses, rushed_threshold: float, device_of):
+        """Build column masks from an iterable of projected response documents."""
+        start = time.perf_counter()
+        rows: Dict[str, Dict[str, List[int]]] = {f: {} for f in self.fields()}
+        answered_rows: Dict[str, List[int]] = {q: [] for q in self.question_order}
+        n = 0
+
+        for resp in responses:
+            answers = resp.get("responses") or {}
+            for q_id in self.question_order:
+                values = _answer_values(answers.get(q_id))
+                if not values:
+                    continue
+                answered_rows[q_id].append(n)
+                col = rows[q_id]
+                for v in values:
+                    col.setdefault(v, []).append(n)
+
+            user_info = resp.get("user_info") or {}
+            ua = user_info.get("user_agent") or resp.get("user_agent") or ""
+            rows["device"].setdefault(device_of(ua), []).append(n)
+            rows["country"].setdefault(_country_of(resp), []).append(n)
+            rows["status"].setdefault(resp.get("status") or "submitted", []).append(n)
+
+            timings = resp.get("question_timings") or {}
+            if timings:
+                avg = sum(timings.values()) / max(len(timings), 1)
+                pace = "rushed" if avg < rushed_threshold else "careful"
+            else:
+                pace = "untimed"
+            rows["pace"].setdefault(pace, []).append(n)
+            n += 1
+
+        self.size = n
+        self.columns = {
+            field: {value: _bits_to_mask(idx, n) for value, idx in values.items()}
+            for field, values in rows.items()
+        }
+        self.answered = {q_id: _bits_to_mask(idx, n) for q_id, idx in answered_rows.items()}
+        self.built_at = datetime.utcnow()
+        self.build_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    # ── Filters ──────────────────────────────────────────────
+
+    def _column(self, field: str) -> Dict[str, int]:
+        if field not in self.columns:
+            raise ValueError(f"Unknown field '{field}'. Use a question id or one of: {', '.join(META_FIELDS)}")
+        return self.columns[field]
+
+    def mask_for(self, spec) -> int:
+        """
+        Resolve a filter spec into a bitmask.
+
+        A spec is either a list (all must match), a combinator
+        {"all": [...]}, {"any": [...]}, {"not": spec}, or a leaf
+        {"field": "q2", "op": "in", "values": ["Yes"]}.
+        """
+        if not spec:
+            return self.full_mask
+        if isinstance(spec, list):
+            spec = {"all": spec}
+        if not isinstance(spec, dict):
+            raise ValueError("Filter must be an object or a list of filters")
+
+        if "all" in spec:
+            mask = self.full_mask
+            for sub in spec["all"]:
+                mask &= self.mask_for(sub)
+            return mask
+        if "any" in spec:
+            mask = 0
+            for sub in spec["any"]:
+                mask |= self.mask_for(sub)
+            return mask
+        if "not" in spec:
+            return ~self.mask_for(spec["not"]) & self.full_mask
+
+        field = spec.get("field") or spec.get("question_id")
+        op = spec.get("op", "in")
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unknown filter op '{op}'. Use one of: {', '.join(FILTER_OPS)}")
+        column = self._column(field)
+
+        if op in ("answered", "not_answered"):
+            answered = self.answered.get(field, self.full_mask)
+            return answered if op == "answered" else ~answered & self.full_mask
+
+        values = spec.get("values")
+        if values is None:
+            values = [spec.get("value")]
+        if not isinstance(values, list):
+            values = [values]
+
+        mask = 0
+        for v in values:
+            mask |= column.get(str(v), 0)
+        return mask if op in ("eq", "in") else ~mask & self.full_mask
+
+    # ── Aggregations ─────────────────────────────────────────
+
+    def labels(self, field: str, mask: int) -> List[str]:
+        """Values of a field in display order: question options first, then by count."""
+        column = self._column(field)
+        ordered = []
+        question = self.questions.get(field)
+        if question:
+            ordered = [str(o) for o in question.get("options") or []]
+        seen = set(ordered)
+        extra = sorted(
+            (v for v in column if v not in seen),
+            key=lambda v: (column[v] & mask).bit_count(),
+            reverse=True,
+        )
+        return ordered + extra
+
+    def distribution(self, field: str, mask: int) -> List[dict]:
+        column = self._column(field)
+        counts = [(label, (column.get(label, 0) & mask).bit_count()) for label in self.labels(field, mask)]
+        total = sum(c for _, c in counts)
+        return [
+            {
+                "answer": label,
+                "count": count,
+                "percentage": round((count / total) * 100) if total > 0 else 0,
+            }
+            for label, count in counts
+        ]
+
+    def crosstab(self, row_field: str, col_field: str, mask: int) -> dict:
+        row_col = self._column(row_field)
+        col_col = self._column(col_field)
+        row_labels = self.labels(row_field, mask)
+        col_labels = self.labels(col_field, mask)
+
+        col_masks = [col_col.get(c, 0) & mask for c in col_labels]
+        cells = []
+        row_percentages = []
+        for r in row_labels:
+            r_mask = row_col.get(r, 0) & mask
+            counts = [(r_mask & c_mask).bit_count() for c_mask in col_masks]
+            row_total = r_mask.bit_count()
+            cells.append(counts)
+            row_percentages.append([
+                round((c / row_total) * 100) if row_total > 0 else 0 for c in counts
+            ])
+
+        return {
+            "rows": row_field,
+            "columns": col_field,
+            "row_labels": row_labels,
+            "column_labels": col_labels,
+            "cells": cells,
+            "row_percentages": row_percentages,
+            "row_totals": [(row_col.get(r, 0) & mask).bit_count() for r in row_labels],
+            "column_totals": [c_mask.bit_count() for c_mask in col_masks],
+        }
+
+
+# ─────────────────────────────────────────────
+#  INDEX LIFECYCLE
+# ─────────────────────────────────────────────
+
+def _survey_fingerprint(survey_id: str, questions: List[dict]) -> tuple:
+    """Cheap change detector: response count, newest submission and question set."""
+    count = db.responses.count_documents({"survey_id": survey_id})
+    latest = db.responses.find_one(
+        {"survey_id": survey_id}, {"submitted_at": 1}, sort=[("submitted_at", -1)]
+    )
+    latest_at = latest.get("submitted_at") if latest else None
+    return (count, str(latest_at), tuple(q["question_id"] for q in questions))
+
+
+def _build_lock(survey_id: str) -> threading.Lock:
+    with _build_locks_guard:
+        lock = _build_locks.get(survey_id)
+        if lock is None:
+            lock = _build_locks[survey_id] = threading.Lock()
+        return lock
+
+
+def get_response_index(survey_id: str, survey: dict) -> Tuple[ResponseIndex, bool]:
+    """
+    Return an up-to-date index for a survey and whether it came from cache.
+    Rebuilds only when the response count, latest submission or questions changed.
+    """
+    from analytics_api import RUSHED_THRESHOLD_SECONDS, detect_device, get_question_metadata
+
+    questions = get_question_metadata(survey)
+    fingerprint = _survey_fingerprint(survey_id, questions)
+
+    cached = _index_cache.get(survey_id)
+    if cached is not None and cached.fingerprint == fingerprint:
+        return cached, True
+
+    with _build_lock(survey_id):
+        # Another thread may have finished the same build while we waited
+        cached = _index_cache.get(survey_id)
+        if cached is not None and cached.fingerprint == fingerprint:
+            return cached, True
+
+        index = ResponseIndex(survey_id, questions)
+        cursor = db.responses.find(
+            {"survey_id": survey_id}, _RESPONSE_PROJECTION, batch_size=2000
+        ).sort("_id", 1)
+        index.build(cursor, RUSHED_THRESHOLD_SECONDS, detect_device)
+        index.fingerprint = fingerprint
+        _index_cache.set(survey_id, index)
+        print(f"📊 [SegmentAnalytics] Indexed {index.size} responses for survey {survey_id} in {index.build_ms}ms")
+        return index, False
+
+
+def invalidate_response_index(survey_id: Optional[str] = None):
+    """Drop a cached index (or all of them) so the next query rebuilds."""
+    if survey_id is None:
+        _index_cache.clear()
+    else:
+        _index_cache.pop(survey_id)
+
+
+def run_segment_query(survey_id: str, survey: dict, query: dict) -> dict:
+    """
+    Run a segment query against a survey.
+
+    Args:
+        survey_id: The survey id responses are stored under
+        survey: The survey document (for question metadata)
+        query: {"filters": spec, "distributions": [field, ...],
+                "crosstab": {"rows": field, "columns": field}}
+
+    Returns:
+        Dict with segment size, requested distributions and crosstab
+    """
+    start = time.perf_counter()
+    index, cached = get_response_index(survey_id, survey)
+    query = query or {}
+
+    mask = index.mask_for(query.get("filters"))
+    segment_size = mask.bit_count()
+
+    result = {
+        "survey_id": survey_id,
+        "total_responses": index.size,
+        "segment_size": segment_size,
+        "segment_percentage": round((segment_size / index.size) * 100, 1) if index.size else 0,
+        "fields": [
+            {"field": f, "label": index.questions[f]["question_text"], "kind": "question"}
+            for f in index.question_order
+        ] + [{"field": f, "label": f.title(), "kind": "meta"} for f in META_FIELDS],
+    }
+
+    distributions = query.get("distributions") or []
+    if distributions:
+        result["distributions"] = {f: index.distribution(f, mask) for f in distributions}
+
+    crosstab = query.get("crosstab")
+    if crosstab:
+        rows, columns = crosstab.get("rows"), crosstab.get("columns")
+        if not rows or not columns:
+            raise ValueError("crosstab requires both 'rows' and 'columns'")
+        result["crosstab"] = index.crosstab(rows, columns, mask)
+
+    result["index"] = {
+        "cached": cached,
+        "rows": index.size,
+        "built_at": index.built_at.isoformat() if index.built_at else None,
+        "build_ms": index.build_ms,
+    }
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
@@ -1,14 +1,31 @@
 """
 Enhanced Session Tracking System
 Tracks every step of the survey completion process
+
+Step updates go through a WriteCoalescer: events for the same session are
+merged into one $push/$set/$inc update and flushed with bulk_write a
+fraction of a second later (see click_aggregator). Progress is computed from
+a cached question count and the answers this process has seen for the
+session, so answering a question costs no reads.
 """
 
 from datetime import datetime, timezone
 from mongodb_config import db
+from click_aggregator import WriteCoalescer, register
+from utils.ttl_cache import TTLCache
+from utils.user_agent import classify
 import uuid
 from typing import Dict, List, Any, Optional
 from flask import request
 
+# Pending step updates, merged per session
+survey_session_writes = register(WriteCoalescer("survey_sessions"))
+
+# session_id -> {"survey_id", "answered": set of question ids}
+_session_progress = TTLCache(maxsize=20000, ttl=3 * 3600)
+# survey_id -> number of questions
+_question_counts = TTLCache(maxsize=2048, ttl=300)
+
 class SurveySessionTracker:
     """Enhanced session tracking for comprehensive survey monitoring"""
     
@@ -197,6 +214,7 @@ class SurveySessionTracker:
             
             # Save to database
             self.db.survey_sessions.insert_one(session_doc)
+            _session_progress.set(session_id, {"survey_id": survey_id, "answered": set()})
             
             print(f"✅ Session started: {session_id} for survey {survey_id}")
             print(f"👤 User: {user_data.get('username', 'anonymous')} ({user_data.get('email', 'no email')})")
@@ -218,17 +236,15 @@ class SurveySessionTracker:
                 "data": page_info or {}
             }
             
-            self.db.survey_sessions.update_one(
+            survey_session_writes.add(
                 {"_id": session_id},
-                {
-                    "$push": {"step_tracking": step_data},
-                    "$set": {
-                        "timestamps.last_activity": datetime.now(timezone.utc),
-                        "timestamps.survey_started": datetime.now(timezone.utc),
-                        "behavior_tracking.last_active_time": datetime.now(timezone.utc)
-                    },
-                    "$inc": { "behavior_tracking.pages_visited": 1 }
-                }
+                push={"step_tracking": step_data},
+                set={
+                    "timestamps.last_activity": datetime.now(timezone.utc),
+                    "timestamps.survey_started": datetime.now(timezone.utc),
+                    "behavior_tracking.last_active_time": datetime.now(timezone.utc)
+                },
+                inc={"behavior_tracking.pages_visited": 1}
             )
             
             print(f"📄 Page load tracked for session: {session_id}")
@@ -255,26 +271,27 @@ class SurveySessionTracker:
                 "data": question_info or {}
             }
             
-            # Update step tracking and responses
+            # Update step tracking, responses and progress percentage
             update_data = {
-                "$push": {"step_tracking": step_data},
-                "$set": {
-                    f"responses.{question_id}": answer,
-                    "timestamps.last_activity": datetime.now(timezone.utc),
-                    "behavior_tracking.last_active_time": datetime.now(timezone.utc)
-                },
-                "$inc": { "behavior_tracking.total_clicks": 1 },
-                "$addToSet": {"progress_tracking.questions_answered": question_id}
+                f"responses.{question_id}": answer,
+                "timestamps.last_activity": datetime.now(timezone.utc),
+                "behavior_tracking.last_active_time": datetime.now(timezone.utc)
             }
+            progress = self._progress(session_id, question_id)
+            if progress:
+                percentage, total_questions = progress
+                update_data["progress_tracking.total_questions"] = total_questions
             
-            self.db.survey_sessions.update_one(
+            survey_session_writes.add(
                 {"_id": session_id},
-                update_data
+                push={"step_tracking": step_data},
+                set=update_data,
+                inc={"behavior_tracking.total_clicks": 1},
+                add_to_set={"progress_tracking.questions_answered": question_id},
+                # Never lower it: another worker may have counted more answers
+                max={"progress_tracking.completion_percentage": percentage} if progress else None
             )
             
-            # Update progress percentage
-            self._update_progress_percentage(session_id)
-            
             print(f"❓ Question answered: {question_id} = '{answer}' for session {session_id}")
             return True
             
@@ -296,19 +313,17 @@ class SurveySessionTracker:
                 "data": completion_info or {"total_responses": len(all_responses)}
             }
             
-            self.db.survey_sessions.update_one(
+            survey_session_writes.add(
                 {"_id": session_id},
-                {
-                    "$push": {"step_tracking": step_data},
-                    "$set": {
-                        "responses": all_responses,
-                        "timestamps.survey_completed": datetime.now(timezone.utc),
-                        "timestamps.last_activity": datetime.now(timezone.utc),
-                        "progress_tracking.completion_percentage": 100.0,
-                        "behavior_tracking.last_active_time": datetime.now(timezone.utc),
-                        "completion_time": datetime.now(timezone.utc)
-                    }
-                }
+                push={"step_tracking": step_data},
+                set={
+                    "responses": all_responses,
+                    "timestamps.survey_completed": datetime.now(timezone.utc),
+                    "timestamps.last_activity": datetime.now(timezone.utc),
+                    "behavior_tracking.last_active_time": datetime.now(timezone.utc),
+                    "completion_time": datetime.now(timezone.utc)
+                },
+                max={"progress_tracking.completion_percentage": 100.0}
             )
             
             print(f"🏁 Survey completion tracked for session: {session_id}")
@@ -336,14 +351,12 @@ class SurveySessionTracker:
                 }
             }
             
-            self.db.survey_sessions.update_one(
+            survey_session_writes.add(
                 {"_id": session_id},
-                {
-                    "$push": {"step_tracking": step_data},
-                    "$set": {
-                        "evaluation_result": evaluation_result,
-                        "timestamps.last_activity": datetime.now(timezone.utc)
-                    }
+                push={"step_tracking": step_data},
+                set={
+                    "evaluation_result": evaluation_result,
+                    "timestamps.last_activity": datetime.now(timezone.utc)
                 }
             )
             
@@ -379,15 +392,13 @@ class SurveySessionTracker:
                 **(redirect_info or {})
             }
             
-            self.db.survey_sessions.update_one(
+            survey_session_writes.add(
                 {"_id": session_id},
-                {
-                    "$push": {"step_tracking": step_data},
-                    "$set": {
-                        "redirect_info": redirect_data,
-                        "timestamps.redirected_at": datetime.now(timezone.utc),
-                        "timestamps.last_activity": datetime.now(timezone.utc)
-                    }
+                push={"step_tracking": step_data},
+                set={
+                    "redirect_info": redirect_data,
+                    "timestamps.redirected_at": datetime.now(timezone.utc),
+                    "timestamps.last_activity": datetime.now(timezone.utc)
                 }
             )
             
@@ -423,17 +434,13 @@ class SurveySessionTracker:
                 "data": postback_result
             }
             
-            self.db.survey_sessions.update_one(
+            survey_session_writes.add(
                 {"_id": session_id},
-                {
-                    "$push": {
-                        "step_tracking": step_data,
-                        "postback_results": postback_result
-                    },
-                    "$set": {
-                        "timestamps.last_activity": datetime.now(timezone.utc)
-                    }
-                }
+                push={
+                    "step_tracking": step_data,
+                    "postback_results": postback_result
+                },
+                set={"timestamps.last_activity": datetime.now(timezone.utc)}
             )
             
             print(f"📡 Postback result tracked: {partner_name} ({status_code}) for session {session_id}")
@@ -446,6 +453,8 @@ class SurveySessionTracker:
     def get_session_data(self, session_id: str) -> Optional[Dict]:
         """Get complete session data"""
         try:
+            # Include steps still waiting in the write buffer
+            survey_session_writes.flush()
             session_doc = self.db.survey_sessions.find_one({"_id": session_id})
             if session_doc:
                 # Convert ObjectId to string for JSON serialization
@@ -497,79 +506,63 @@ class SurveySessionTracker:
             print(f"❌ Error getting session summary: {e}")
             return {"error": str(e)}
     
-    def _update_progress_percentage(self, session_id: str):
-        """Update completion percentage based on questions answered"""
+    def _question_count(self, survey_id: str) -> int:
+        total = _question_counts.get(survey_id)
+        if total is None:
+            survey = self.db.surveys.find_one(
+                {"$or": [{"_id": survey_id}, {"id": survey_id}]}, {"questions.id": 1}
+            )
+            total = len(survey.get("questions", [])) if survey else 0
+            _question_counts.set(survey_id, total)
+        return total
+    
+    def _progress(self, session_id: str, question_id: str):
+        """(completion percentage, total questions) after answering question_id"""
         try:
-            session_doc = self.db.survey_sessions.find_one({"_id": session_id})
-            if not session_doc:
-                return
-            
-            # Get survey to count total questions
-            survey_id = session_doc["survey_id"]
-            survey = self.db.surveys.find_one({"$or": [{"_id": survey_id}, {"id": survey_id}]})
-            
-            if survey:
-                total_questions = len(survey.get("questions", []))
-                questions_answered = len(session_doc["progress_tracking"]["questions_answered"])
-                
-                percentage = (questions_answered / total_questions * 100) if total_questions > 0 else 0
-                
-                self.db.survey_sessions.update_one(
-                    {"_id": session_id},
-                    {
-                        "$set": {
-                            "progress_tracking.completion_percentage": round(percentage, 2),
-                            "progress_tracking.total_questions": total_questions
-                        }
-                    }
+            state = _session_progress.get(session_id)
+            if state is None:
+                # Started in another process (or evicted): read it once
+                session_doc = self.db.survey_sessions.find_one(
+                    {"_id": session_id}, {"survey_id": 1, "progress_tracking.questions_answered": 1}
                 )
+                if not session_doc:
+                    return None
+                state = {
+                    "survey_id": session_doc["survey_id"],
+                    "answered": set(session_doc.get("progress_tracking", {}).get("questions_answered", [])),
+                }
+                _session_progress.set(session_id, state)
+            
+            state["answered"].add(question_id)
+            total_questions = self._question_count(state["survey_id"])
+            percentage = (len(state["answered"]) / total_questions * 100) if total_questions > 0 else 0
+            return round(percentage, 2), total_questions
         except Exception as e:
             print(f"❌ Error updating progress percentage: {e}")
+            return None
     
     def _detect_device_type(self, user_agent: str) -> str:
         """Detect device type from user agent"""
-        user_agent = user_agent.lower()
-        if 'mobile' in user_agent or 'android' in user_agent or 'iphone' in user_agent:
-            return 'mobile'
-        elif 'tablet' in user_agent or 'ipad' in user_agent:
-            return 'tablet'
-        else:
-            return 'desktop'
+        return classify(user_agent).device.value
     
     def _detect_browser(self, user_agent: str) -> str:
         """Detect browser from user agent"""
-        user_agent = user_agent.lower()
-        if 'chrome' in user_agent:
-            return 'chrome'
-        elif 'firefox' in user_agent:
-            return 'firefox'
-        if 'safari' in user_agent and 'chrome' not in user_agent:
-            return 'safari'
-        elif 'edge' in user_agent:
-            return 'edge'
-        else:
-            return 'unknown'
+        return classify(user_agent).browser.value
             
     def _detect_os(self, user_agent: str) -> str:
         """Detect OS from user agent"""
-        user_agent = user_agent.lower()
-        if 'windows nt 10.0' in user_agent: return 'Windows 10/11'
-        elif 'windows nt' in user_agent: return 'Windows'
-        elif 'mac os x' in user_agent: return 'macOS'
-        elif 'android' in user_agent: return 'Android'
-        elif 'iphone' in user_agent or 'ipad' in user_agent: return 'iOS'
-        elif 'linux' in user_agent: return 'Linux'
-        else: return 'Unknown OS'
+        return classify(user_agent).os.value
+
+# Convenience functions for external use; the tracker holds no per-call state
+_tracker = SurveySessionTracker()
 
-# Convenience functions for external use
 def start_survey_session(survey_id: str, user_info: Dict = None, request_data: Dict = None) -> str:
     """Start a new survey session"""
-    tracker = SurveySessionTracker()
-    return tracker.start_session(survey_id, user_info, request_data)
+    return _tracker.start_session(survey_id, user_info, request_data)
 
 def track_step(session_id: str, step_type: str, **kwargs) -> bool:
     """Generic step tracking function"""
-    tracker = SurveySessionTracker()
+    tracker = _tracker
     
     if step_type == "page_load":
         return tracker.track_page_load(session_id, kwargs.get("page_info"))
@@ -609,8 +602,7 @@ def track_step(session_id: str, step_type: str, **kwargs) -> bool:
 
 def get_session_summary(session_id: str) -> Dict:
     """Get session summary"""
-    tracker = SurveySessionTracker()
-    return tracker.get_session_summary(session_id)
+    return _tracker.get_session_summary(session_id)
 
 # Test function
 def test_session_tracking():
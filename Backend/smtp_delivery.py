@@ -0,0 +1,320 @@
+"""
+SMTP Delivery
+Pooled, rate-limited SMTP sending for trigger emails and survey invites.
+
+    connections  up to SMTP_POOL_SIZE logged-in connections per account,
+                 reused across sends; one idle longer than SMTP_IDLE_SECONDS
+                 is checked with NOOP first, and a send that fails because the
+                 connection dropped is retried once on a fresh connection
+    rate         messages per minute per provider (SMTP host), shared by every
+                 account on it; PROVIDER_RATES has defaults for common hosts
+    bulk         send_bulk queues many messages on SMTP_WORKERS threads and
+                 returns at once; wait() on the result to block for a while
+
+Pools, limits and workers are per process.
+
+Config (env):
+    SMTP_POOL_SIZE          connections per account (default 4)
+    SMTP_WORKERS            bulk send threads (default 4)
+    SMTP_RATE_PER_MINUTE    overrides the provider default for every host
+    SMTP_IDLE_SECONDS       idle time before a connection is re-checked (default 60)
+"""
+import os
+import time
+import atexit
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "4"))
+WORKERS = int(os.environ.get("SMTP_WORKERS", "4"))
+IDLE_SECONDS = float(os.environ.get("SMTP_IDLE_SECONDS", "60"))
+CONNECT_TIMEOUT = 20
+
+# Messages per minute; conservative versions of each provider's published limits
+PROVIDER_RATES = {
+    "smtp.gmail.com": 1200,
+    "smtp.office365.com": 30,
+    "smtp-mail.outlook.com": 30,
+    "smtp.sendgrid.net": 6000,
+}
+DEFAULT_RATE = 600
+
+# The connection is unusable. SMTPException subclasses OSError, so these are
+# caught before the other SMTP errors, which are verdicts on the message, and
+# plain OSError (socket errors) is caught after them.
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)
+
+
+def _rate_for(host: str) -> float:
+    override = os.environ.get("SMTP_RATE_PER_MINUTE")
+    if override:
+        return float(override)
+    if host.startswith("email-smtp."):
+        return 840  # Amazon SES default, 14/s
+    return PROVIDER_RATES.get(host, DEFAULT_RATE)
+
+
+class _RateLimiter:
+    """Token bucket holding one second's worth of sends."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SmtpPool:
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 limiter: _RateLimiter, size: int = POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.limiter = limiter
+        self.size = size
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self.sent = 0
+        self.failed = 0
+        self.reconnects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.port == 465:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=CONNECT_TIMEOUT)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=CONNECT_TIMEOUT)
+            conn.ehlo()
+            conn.starttls()
+            conn.ehlo()
+        conn.login(self.username, self.password)
+        return conn
+
+    def _borrow(self) -> smtplib.SMTP:
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                self._cond.wait()
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                self._open += 1
+                conn, last_used = None, None
+        if conn is not None and time.monotonic() - last_used > IDLE_SECONDS:
+            try:
+                if conn.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP failed")
+            except Exception:
+                self._close(conn)
+                conn = None
+                self._count("reconnects")
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._discard(None)
+                raise
+        return conn
+
+    def _release(self, conn: smtplib.SMTP):
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _close(self, conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _discard(self, conn: Optional[smtplib.SMTP]):
+        if conn is not None:
+            self._close(conn)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def send(self, from_addr: str, to_addr: str, message: str) -> bool:
+        self.limiter.acquire()
+        for attempt in range(2):
+            try:
+                conn = self._borrow()
+            except Exception as e:
+                print(f"❌ [SMTP] Could not connect to {self.host}:{self.port}: {e}")
+                break
+            try:
+                conn.sendmail(from_addr, to_addr, message)
+            except _CONNECTION_ERRORS as e:
+                error = e
+            except smtplib.SMTPException as e:
+                # Rejected message or recipient; the connection itself is fine
+                self._release(conn)
+                print(f"❌ [SMTP] {self.host} rejected mail to {to_addr}: {e}")
+                break
+            except OSError as e:
+                error = e
+            else:
+                self._release(conn)
+                self._count("sent")
+                return True
+            self._discard(conn)
+            if attempt == 0:
+                self._count("reconnects")
+                print(f"⚠️ [SMTP] Connection to {self.host} dropped ({error}), retrying on a new one")
+                continue
+            print(f"❌ [SMTP] Send to {to_addr} failed: {error}")
+            break
+        self._count("failed")
+        return False
+
+    def _count(self, name: str):
+        with self._cond:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def close_idle(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "open": self._open,
+                "idle": len(self._idle),
+                "sent": self.sent,
+                "failed": self.failed,
+                "reconnects": self.reconnects,
+            }
+
+
+_pools: Dict[tuple, SmtpPool] = {}
+_limiters: Dict[str, _RateLimiter] = {}
+_executor = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Sockets and threads inherited across gunicorn's fork are not ours to use
+    global _pools, _limiters, _executor, _pid
+    if _pid != os.getpid():
+        _pools, _limiters, _executor, _pid = {}, {}, None, os.getpid()
+
+
+def get_pool(host: str, port: int, username: str, password: str) -> SmtpPool:
+    with _lock:
+        _reset_after_fork()
+        key = (host, port, username, password)
+        pool = _pools.get(key)
+        if pool is None:
+            limiter = _limiters.get(host)
+            if limiter is None:
+                limiter = _limiters[host] = _RateLimiter(_rate_for(host))
+            pool = _pools[key] = SmtpPool(host, port, username, password, limiter)
+        return pool
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        _reset_after_fork()
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="smtp-send")
+        return _executor
+
+
+def send_message(pool: SmtpPool, from_addr: str, to_addr: str, message) -> bool:
+    """Send one email.message now on a pooled connection."""
+    return pool.send(from_addr, to_addr, message.as_string())
+
+
+class BulkSend:
+    """Progress of a send_bulk call."""
+
+    def __init__(self, total: int, on_complete: Callable[["BulkSend"], None] = None):
+        self.total = total
+        self.sent: List[str] = []
+        self.failed: List[str] = []
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        if total == 0:
+            self._finish()
+
+    def _record(self, to_addr: str, ok: bool):
+        with self._lock:
+            (self.sent if ok else self.failed).append(to_addr)
+            finished = len(self.sent) + len(self.failed) == self.total
+        if finished:
+            self._finish()
+
+    def _finish(self):
+        self._done.set()
+        if self.on_complete:
+            try:
+                self.on_complete(self)
+            except Exception as e:
+                print(f"⚠️ [SMTP] Bulk completion callback failed: {e}")
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+
+def send_bulk(pool: SmtpPool, from_addr: str, messages: List[tuple],
+              on_complete: Callable[[BulkSend], None] = None) -> BulkSend:
+    """
+    Queue (to_addr, email.message) pairs for background delivery and return
+    immediately. on_complete runs on a send thread once every message has
+    been sent or has failed.
+    """
+    bulk = BulkSend(len(messages), on_complete)
+    executor = _get_executor()
+
+    def deliver(to_addr, message):
+        try:
+            ok = pool.send(from_addr, to_addr, message.as_string())
+        except Exception as e:
+            print(f"❌ [SMTP] Send to {to_addr} failed: {e}")
+            ok = False
+        bulk._record(to_addr, ok)
+
+    for to_addr, message in messages:
+        executor.submit(deliver, to_addr, message)
+    return bulk
+
+
+def _close_idle_connections():
+    for pool in list(_pools.values()):
+        pool.close_idle()
+
+
+atexit.register(_close_idle_connections)
+
+
+def delivery_stats() -> dict:
+    with _lock:
+        return {f"{host}:{port}/{username}": pool.stats() for (host, port, username, _), pool in _pools.items()}
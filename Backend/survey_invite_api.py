@@ -8,10 +8,12 @@ from flask_cors import cross_origin
 from auth_middleware import requireAuth
 from mongodb_config import db
 import os
-import smtplib
+import uuid
+from datetime import datetime, timezone
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import logging
+from smtp_delivery import get_pool, send_bulk
 
 survey_invite_bp = Blueprint('survey_invite', __name__)
 logger = logging.getLogger(__name__)
@@ -23,23 +25,33 @@ SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
 FROM_EMAIL    = os.getenv('FROM_EMAIL',    'business@moustacheleads.com')
 FRONTEND_URL  = os.getenv('FRONTEND_URL',  'https://surevy-pepperwahl.onrender.com')
 
+# The request answers with per-recipient results if sending finishes within
+# this long; bigger lists keep sending in the background (see invite status)
+INVITE_WAIT_SECONDS = 8
 
-def _send_email(to_email: str, subject: str, html_body: str) -> bool:
+
+def _build_message(to_email: str, subject: str, html_body: str) -> MIMEMultipart:
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
     msg['From']    = f'Pepperwahl Surveys <{FROM_EMAIL}>'
     msg['To']      = to_email
     msg.attach(MIMEText(html_body, 'html'))
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.ehlo()
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.sendmail(FROM_EMAIL, to_email, msg.as_string())
-        return True
-    except Exception as e:
-        logger.error(f"SMTP error: {e}")
-        return False
+    return msg
+
+
+def _record_invite_batch(batch_id: str):
+    def on_complete(bulk):
+        db.invite_batches.update_one(
+            {'batch_id': batch_id},
+            {'$set': {
+                'status': 'done',
+                'sent': bulk.sent,
+                'failed': bulk.failed,
+                'completed_at': datetime.now(timezone.utc),
+            }}
+        )
+        logger.info(f"Invite batch {batch_id}: {len(bulk.sent)} sent, {len(bulk.failed)} failed")
+    return on_complete
 
 
 def _build_premium_template(survey_title: str, survey_link: str, message: str, template_id: str) -> str:
@@ -210,21 +222,42 @@ def send_survey_invite(survey_id):
 
         subject = f"📋 You've been invited to take a survey: {survey_title}"
 
-        sent, failed = [], []
-        for email in emails:
-            email = email.strip()
-            if not email:
-                continue
-            if template_id == 'bold':
-                html = _build_template_bold(survey_title, survey_link, message, sender_name)
-            else:
-                html = _build_template_minimal(survey_title, survey_link, message, sender_name)
-
-            ok = _send_email(email, subject, html)
-            (sent if ok else failed).append(email)
+        # Every recipient gets the same body
+        if template_id == 'bold':
+            html = _build_template_bold(survey_title, survey_link, message, sender_name)
+        else:
+            html = _build_template_minimal(survey_title, survey_link, message, sender_name)
+
+        recipients = list(dict.fromkeys(e.strip() for e in emails if e and e.strip()))
+        batch_id = f"inv_{uuid.uuid4().hex[:12]}"
+        db.invite_batches.insert_one({
+            'batch_id': batch_id,
+            'survey_id': survey_id,
+            'status': 'sending',
+            'total': len(recipients),
+            'created_at': datetime.now(timezone.utc),
+        })
 
+        pool = get_pool(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD)
+        bulk = send_bulk(
+            pool,
+            FROM_EMAIL,
+            [(email, _build_message(email, subject, html)) for email in recipients],
+            on_complete=_record_invite_batch(batch_id),
+        )
+
+        if not bulk.wait(INVITE_WAIT_SECONDS):
+            return jsonify({
+                "success": True,
+                "batch_id": batch_id,
+                "queued": len(recipients),
+                "message": f"Sending to {len(recipients)} recipient(s) in the background"
+            }), 202
+
+        sent, failed = bulk.sent, bulk.failed
         return jsonify({
             "success": True,
+            "batch_id": batch_id,
             "sent": sent,
             "failed": failed,
             "message": f"Sent to {len(sent)} recipient(s){', ' + str(len(failed)) + ' failed' if failed else ''}"
@@ -233,3 +266,16 @@ def send_survey_invite(survey_id):
     except Exception as e:
         logger.error(f"send_survey_invite error: {e}")
         return jsonify({"error": str(e)}), 500
+
+
+@survey_invite_bp.route('/api/surveys/<survey_id>/send-invite/<batch_id>', methods=['GET', 'OPTIONS'])
+@cross_origin(supports_credentials=True, origins="*")
+@requireAuth
+def get_invite_batch(survey_id, batch_id):
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    batch = db.invite_batches.find_one({'batch_id': batch_id, 'survey_id': survey_id}, {'_id': 0})
+    if not batch:
+        return jsonify({"error": "Invite batch not found"}), 404
+    return jsonify(batch)
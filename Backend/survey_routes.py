@@ -7,7 +7,8 @@ from mongodb_config import db
 from bson import ObjectId
 from datetime import datetime
 import json
-from utils.short_id import generate_short_id, is_valid_short_id
+from utils.short_id import is_valid_short_id
+from id_allocator import id_allocator
 
 survey_bp = Blueprint('surveys', __name__, url_prefix='/api/surveys')
 
@@ -116,12 +117,8 @@ def create_survey():
         if not data:
             return jsonify({'error': 'Survey data is required'}), 400
         
-        # Generate short ID for the survey
-        short_id = generate_short_id()
-        
         # Create survey document
         survey_doc = {
-            'short_id': short_id,
             'ownerUserId': str(user['_id']),  # Link to user
             'title': data.get('title', 'Untitled Survey'),
             'description': data.get('description', ''),
@@ -132,9 +129,9 @@ def create_survey():
             'status': 'draft'
         }
         
-        # Insert survey
-        result = db.surveys.insert_one(survey_doc)
-        survey_doc['_id'] = str(result.inserted_id)
+        # Insert survey under a fresh short ID (the unique index catches legacy clashes)
+        id_allocator.insert_with_id('survey', 'surveys', survey_doc, 'short_id')
+        survey_doc['_id'] = str(survey_doc['_id'])
         
         return jsonify({
             'message': 'Survey created successfully',
@@ -463,11 +460,8 @@ def clone_survey(survey_id):
         import copy
         clone = copy.deepcopy(source)
 
-        # Generate a fresh identity
-        new_short_id = generate_short_id()
+        # Fresh identity: short_id (and id, kept equal) are allocated on insert below
         clone.pop('_id', None)
-        clone['short_id'] = new_short_id
-        clone['id'] = new_short_id          # keep id == short_id for consistency
         clone['ownerUserId'] = user_id      # new owner is the cloning user
         clone['shared_with'] = []           # do not carry over collaborators
 
@@ -483,8 +477,8 @@ def clone_survey(survey_id):
         # Remove any response-level data that may have been accidentally stored on the survey doc
         clone.pop('response_count', None)
 
-        result = db.surveys.insert_one(clone)
-        clone['_id'] = str(result.inserted_id)
+        new_short_id = id_allocator.insert_with_id('survey', 'surveys', clone, 'short_id', mirror=('id',))
+        clone['_id'] = str(clone['_id'])
 
         # Also deep-copy branching rules if stored separately in branch_rules collection
         branch_rules = db.branch_rules.find_one({'survey_id': survey_id})
@@ -8,11 +8,11 @@ from flask import Blueprint, request, jsonify, g
 from flask_cors import cross_origin
 from auth_middleware import requireAuth, requireAdmin
 from mongodb_config import db
+from referral_ledger import record_referral_event
+from id_allocator import id_allocator
 from datetime import datetime, timedelta
 from bson import ObjectId
 import hashlib
-import random
-import string
 
 survey_sharing_bp = Blueprint('survey_sharing', __name__)
 
@@ -42,20 +42,13 @@ def _ensure_promoter(user_id: str, display_name: str = ''):
     if existing:
         return existing['ref_code']
 
-    SAFE_CHARS = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
-    for _ in range(15):
-        code = ''.join(random.choices(SAFE_CHARS, k=7))
-        if not db.promoters.find_one({'ref_code': code}):
-            db.promoters.insert_one({
-                'user_id': user_id,
-                'ref_code': code,
-                'display_name': display_name or user_id,
-                'payout_method': {},
-                'status': 'active',
-                'created_at': datetime.utcnow(),
-            })
-            return code
-    raise RuntimeError('Could not generate unique ref_code')
+    return id_allocator.insert_with_id('ref_code', 'promoters', {
+        'user_id': user_id,
+        'display_name': display_name or user_id,
+        'payout_method': {},
+        'status': 'active',
+        'created_at': datetime.utcnow(),
+    }, 'ref_code')
 
 
 def _get_earnings_config():
@@ -361,7 +354,7 @@ def record_share_completion(survey_id):
 
     # Immediately credit the sharer's withdrawable balance
     try:
-        db.referral_events.insert_one({
+        record_referral_event({
             'ref_code':      sharer_code,
             'type':          'survey_share_completion',
             'status':        'approved',
@@ -806,13 +799,13 @@ def admin_approve_completion(completion_id):
 
     # ── Credit the sharer's withdrawable balance ──────────────────────────────
     # Insert a referral_event of type 'survey_share_completion' so it appears
-    # in _available_balance() and shows up in the partner summary.
+    # in the promoter's available balance and shows up in the partner summary.
     ref_code   = completion.get('sharer_ref_code', '')
     earn_cents = completion.get('earned_cents', 0)
 
     if ref_code and earn_cents > 0:
         try:
-            db.referral_events.insert_one({
+            record_referral_event({
                 'ref_code':       ref_code,
                 'type':           'survey_share_completion',
                 'status':         'approved',
@@ -864,7 +857,7 @@ def admin_reject_completion(completion_id):
     earn_cents = completion.get('earned_cents', 0)
     if ref_code and earn_cents > 0:
         try:
-            db.referral_events.insert_one({
+            record_referral_event({
                 'ref_code':       ref_code,
                 'type':           'survey_share_completion_reversal',
                 'status':         'approved',
@@ -952,7 +945,7 @@ def _record_completion_for_response(survey, survey_id, response_id, session_id,
 
     # Immediately credit the owner's withdrawable balance
     try:
-        db.referral_events.insert_one({
+        record_referral_event({
             'ref_code':      ref_code,
             'type':          'survey_share_completion',
             'status':        'approved',
@@ -1053,7 +1046,7 @@ def admin_sync_completions(survey_id):
 
         # Credit balance immediately
         try:
-            db.referral_events.insert_one({
+            record_referral_event({
                 'ref_code':     ref_code,
                 'type':         'survey_share_completion',
                 'status':       'approved',
@@ -1082,14 +1075,3 @@ def admin_sync_completions(survey_id):
 
 
 # ─── Setup indexes ────────────────────────────────────────────────────────────
-
-def setup_sharing_indexes():
-    try:
-        db.survey_share_clicks.create_index([('survey_id', 1), ('sharer_ref_code', 1)])
-        db.survey_share_clicks.create_index([('visitor_id', 1), ('survey_id', 1), ('day_key', 1)])
-        db.survey_share_completions.create_index([('survey_id', 1), ('sharer_ref_code', 1)])
-        db.survey_share_completions.create_index('status')
-        db.survey_share_completions.create_index('completed_at')
-        print('✅ Survey sharing indexes ensured')
-    except Exception as e:
-        print(f'⚠️  Survey sharing index warning: {e}')
@@ -456,6 +456,8 @@ def update_user_profile():
             {"_id": ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id},
             {"$set": update_data}
         )
+        from auth_service import invalidate_user_cache
+        invalidate_user_cache(user_id)
         
         print(f"✅ User profile updated: {user['email']}")
         
@@ -561,6 +563,8 @@ def admin_update_user_postback(user_id):
             {"_id": ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id},
             {"$set": update_data}
         )
+        from auth_service import invalidate_user_cache
+        invalidate_user_cache(user_id)
         
         print(f"✅ Admin updated postback for user: {user['email']}")
         
@@ -9,48 +9,12 @@ from datetime import datetime, timezone, timedelta
 from flask import Blueprint, request, jsonify, g
 from mongodb_config import db
 from auth_middleware import requireAuth, requireAdmin
+from utils.user_agent import classify
 import uuid
 import requests as http_requests
 
 user_tracking_bp = Blueprint('user_tracking', __name__, url_prefix='/api/tracking')
 
-# ==================== TTL Index Setup ====================
-def setup_tracking_indexes():
-    """Setup TTL indexes for 15-day auto-delete on all tracking collections"""
-    try:
-        collections_with_ttl = [
-            'login_events',
-            'page_visits',
-            'pricing_clicks',
-            'user_sessions',
-            'user_geolocations',
-            'button_clicks',
-            'premium_feature_attempts'
-        ]
-        
-        for collection_name in collections_with_ttl:
-            collection = db[collection_name]
-            # Create TTL index - documents expire after 15 days (1296000 seconds)
-            collection.create_index(
-                "created_at",
-                expireAfterSeconds=1296000  # 15 days
-            )
-            # Create useful query indexes
-            collection.create_index("user_id")
-            collection.create_index("user_email")
-        
-        # Additional indexes for specific collections
-        db.page_visits.create_index("page")
-        db.button_clicks.create_index("button_id")
-        db.pricing_clicks.create_index("source")
-        db.user_sessions.create_index("session_id")
-        db.user_geolocations.create_index([("latitude", 1), ("longitude", 1)])
-        
-        print("✅ Tracking TTL indexes created (15-day auto-delete)")
-    except Exception as e:
-        print(f"⚠️ TTL index setup warning: {e}")
-
-
 # ==================== Helper Functions ====================
 def get_ip_from_request():
     """Get client IP from request"""
@@ -107,24 +71,9 @@ def get_geo_from_ip(ip_address):
 
 def get_device_info():
     """Extract device info from user agent"""
-    ua = request.headers.get('User-Agent', '').lower()
-    device = 'desktop'
-    if 'mobile' in ua or 'android' in ua or 'iphone' in ua:
-        device = 'mobile'
-    elif 'tablet' in ua or 'ipad' in ua:
-        device = 'tablet'
-    
-    browser = 'unknown'
-    if 'chrome' in ua and 'edg' not in ua:
-        browser = 'chrome'
-    elif 'firefox' in ua:
-        browser = 'firefox'
-    elif 'safari' in ua and 'chrome' not in ua:
-        browser = 'safari'
-    elif 'edg' in ua:
-        browser = 'edge'
-    
-    return {"device": device, "browser": browser, "user_agent": request.headers.get('User-Agent', '')}
+    user_agent = request.headers.get('User-Agent', '')
+    info = classify(user_agent)
+    return {"device": info.device.value, "browser": info.browser.value, "user_agent": user_agent}
 
 
 # ==================== Tracking Endpoints (Data Collection) ====================
@@ -1350,6 +1299,8 @@ def admin_execute_deletion():
         
         # Delete the user account
         db.users.delete_one({"_id": user["_id"]})
+        from auth_service import invalidate_user_cache
+        invalidate_user_cache(user["_id"])
         
         # Mark deletion request as completed
         db.account_deletions.update_one(
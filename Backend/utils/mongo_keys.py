@@ -0,0 +1,26 @@
+"""
+Field names built from outside values.
+
+Update paths like `checkpoints.jobs.<id>` or `job_matches.<id>` split on
+every ".", and a name starting with "$" is read as an operator, so an ID that
+comes from AI output or user input (e.g. "sr.engineer") cannot be used as a
+key as is. encode_key percent-escapes "%", "." and a leading "$"; IDs without
+them are unchanged, so documents written before keep working.
+"""
+from typing import Dict
+
+
+def encode_key(value) -> str:
+    key = str(value).replace("%", "%25").replace(".", "%2E")
+    if key.startswith("$"):
+        key = "%24" + key[1:]
+    return key
+
+
+def decode_key(key: str) -> str:
+    return key.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+
+def decode_keys(mapping: Dict[str, object]) -> Dict[str, object]:
+    """Copy of a mapping with encode_key'd keys turned back into the original values."""
+    return {decode_key(key): value for key, value in (mapping or {}).items()}
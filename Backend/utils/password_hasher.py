@@ -0,0 +1,106 @@
+"""
+Bounded bcrypt executor.
+
+bcrypt releases the GIL, so hashing on a small dedicated pool lets the rest of
+a threaded worker keep serving while logins and signups burn CPU. Admission is
+bounded: at most `workers` hashes run and `queue_size` more wait; anything
+beyond that is rejected with HasherBusy so the route can answer 429 instead of
+piling requests up behind bcrypt.
+
+Config (env):
+    BCRYPT_ROUNDS                cost for new hashes (default 12)
+    PASSWORD_HASH_WORKERS        concurrent hashes per process (default 2)
+    PASSWORD_HASH_QUEUE          extra hashes allowed to wait (default 8)
+    PASSWORD_HASH_WAIT_SECONDS   max wait for a queued hash (default 10)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full; callers should answer 429."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Too many login attempts in progress, please retry shortly")
+        self.retry_after = retry_after
+
+
+def _cost_of(hashed: str) -> int:
+    # $2b$12$<salt+hash>
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, workers: int = 2, queue_size: int = 8,
+                 wait_seconds: float = 10.0):
+        self.rounds = rounds
+        self.workers = workers
+        self.wait_seconds = wait_seconds
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Created lazily and per process: threads do not survive gunicorn's fork
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='bcrypt'
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.wait_seconds)
+        except FutureTimeout:
+            raise HasherBusy()
+
+    def hash(self, password: str) -> str:
+        return self._run(self._hash_sync, password)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(self._verify_sync, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True when a stored hash was made with a different cost than configured."""
+        return _cost_of(hashed) != self.rounds
+
+    def _hash_sync(self, password: str) -> str:
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+    @staticmethod
+    def _verify_sync(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def stats(self) -> dict:
+        return {
+            'rounds': self.rounds,
+            'workers': self.workers,
+            # BoundedSemaphore keeps its counter in _value
+            'free_slots': self._slots._value,
+        }
+
+
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv('BCRYPT_ROUNDS', '12')),
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', '2')),
+    queue_size=int(os.getenv('PASSWORD_HASH_QUEUE', '8')),
+    wait_seconds=float(os.getenv('PASSWORD_HASH_WAIT_SECONDS', '10')),
+)
@@ -1,26 +1,32 @@
-import random
-import string
 from typing import Optional
 
 def generate_short_id(length: int = 5) -> str:
-    """Generate a random alphanumeric ID of specified length.
+    """Generate a unique alphanumeric survey ID of specified length.
+    
+    IDs come from the survey namespace of the ID allocator and never repeat.
     
     Args:
-        length: Length of the ID
+        length: Length of the ID; only the survey namespace width (5) exists
         
     Returns:
-        A random string of the specified length containing uppercase letters and digits
+        A string of the specified length containing uppercase letters and digits
+        
+    Raises:
+        ValueError: For any other length
     """
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choices(chars, k=length))
+    from id_allocator import NAMESPACES, allocate_id
+    if length != NAMESPACES['survey'].length:
+        raise ValueError(f"Survey IDs are {NAMESPACES['survey'].length} characters, not {length}")
+    return allocate_id('survey')
 
 def generate_simple_user_id() -> int:
-    """Generate a simple numeric user ID.
+    """Generate a unique simple numeric user ID.
     
     Returns:
-        A random 6-digit integer
+        A 6-digit integer from the user namespace of the ID allocator
     """
-    return random.randint(100000, 999999)
+    from id_allocator import allocate_id
+    return allocate_id('user')
 
 def is_valid_short_id(short_id: str, length: int = 5) -> bool:
     """Check if a string is a valid short ID.
@@ -0,0 +1,52 @@
+"""
+Server-sent events helpers.
+
+Producers put (event, data) tuples on a queue.Queue and finally CLOSE;
+`drain` turns the queue into SSE frames, sending a comment while idle so
+proxies (Render drops connections idle for 60 s) keep the stream open.
+Streams tie up a gunicorn thread for their whole length, so the web service
+runs gthread workers.
+"""
+import json
+import time
+import queue
+from flask import Response, request
+
+KEEPALIVE_SECONDS = 15
+
+# Put on a queue to end the stream
+CLOSE = object()
+
+
+def wants_event_stream() -> bool:
+    """The client asked for SSE (Accept: text/event-stream or ?stream=1)."""
+    return (
+        "text/event-stream" in request.headers.get("Accept", "")
+        or request.args.get("stream") in ("1", "true")
+    )
+
+
+def format_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def drain(events: queue.Queue, max_seconds: float = None):
+    """Yield SSE frames for queued events until CLOSE (or max_seconds passes)."""
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    while deadline is None or time.monotonic() < deadline:
+        try:
+            item = events.get(timeout=KEEPALIVE_SECONDS)
+        except queue.Empty:
+            yield ": keepalive\n\n"
+            continue
+        if item is CLOSE:
+            return
+        yield format_event(*item)
+
+
+def sse_response(body) -> Response:
+    return Response(
+        body,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,112 @@
+"""
+User-agent classification shared by click tracking, session tracking, link
+masking, user tracking and analytics.
+
+Real traffic comes from a small set of distinct user-agent strings, so
+results are memoized per string in a bounded LRU cache; classify_many
+resolves a batch (e.g. every response row of an analytics table) with one
+lookup per distinct string.
+"""
+from enum import Enum
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple
+
+
+class Device(str, Enum):
+    MOBILE = "mobile"
+    TABLET = "tablet"
+    DESKTOP = "desktop"
+
+
+class Browser(str, Enum):
+    EDGE = "edge"
+    CHROME = "chrome"
+    FIREFOX = "firefox"
+    SAFARI = "safari"
+    UNKNOWN = "unknown"
+
+
+class OS(str, Enum):
+    WINDOWS_10 = "Windows 10/11"
+    WINDOWS = "Windows"
+    MACOS = "macOS"
+    ANDROID = "Android"
+    IOS = "iOS"
+    LINUX = "Linux"
+    UNKNOWN = "Unknown OS"
+
+
+class UserAgentInfo(NamedTuple):
+    device: Device
+    browser: Browser
+    os: OS
+
+
+def _device(ua: str) -> Device:
+    if 'mobile' in ua or 'android' in ua or 'iphone' in ua:
+        return Device.MOBILE
+    if 'tablet' in ua or 'ipad' in ua:
+        return Device.TABLET
+    return Device.DESKTOP
+
+
+def _browser(ua: str) -> Browser:
+    # Edge and Chrome both say "chrome" (and Chrome says "safari"); check the
+    # more specific token first
+    if 'edg' in ua:
+        return Browser.EDGE
+    if 'chrome' in ua:
+        return Browser.CHROME
+    if 'firefox' in ua:
+        return Browser.FIREFOX
+    if 'safari' in ua:
+        return Browser.SAFARI
+    return Browser.UNKNOWN
+
+
+def _os(ua: str) -> OS:
+    if 'windows nt 10.0' in ua:
+        return OS.WINDOWS_10
+    if 'windows nt' in ua:
+        return OS.WINDOWS
+    # iOS user agents say "like Mac OS X"
+    if 'iphone' in ua or 'ipad' in ua:
+        return OS.IOS
+    if 'mac os x' in ua:
+        return OS.MACOS
+    if 'android' in ua:
+        return OS.ANDROID
+    if 'linux' in ua:
+        return OS.LINUX
+    return OS.UNKNOWN
+
+
+@lru_cache(maxsize=4096)
+def classify(user_agent: str) -> UserAgentInfo:
+    """Device, browser and OS for a user-agent string (memoized)."""
+    ua = (user_agent or "").lower()
+    return UserAgentInfo(_device(ua), _browser(ua), _os(ua))
+
+
+def classify_many(user_agents: Iterable[str]) -> List[UserAgentInfo]:
+    """classify() for many strings, in order; each distinct string is looked up once."""
+    seen = {}
+    result = []
+    for user_agent in user_agents:
+        info = seen.get(user_agent)
+        if info is None:
+            info = seen[user_agent] = classify(user_agent or "")
+        result.append(info)
+    return result
+
+
+def cache_stats() -> dict:
+    info = classify.cache_info()
+    total = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / total, 3) if total else 0.0,
+    }
@@ -241,7 +241,58 @@ const FunnelCreator: React.FC<Props> = ({ onFunnelCreated, onCancel, isDarkMode
 
       const { job_id } = await res.json();
 
-      // Poll for status every 3 seconds
+      let finished = false;
+      const applyStatus = (statusData: any) => {
+        setGenerationProgress(statusData.progress || 0);
+        setGeneratingStep(statusData.current_step || 'Generating...');
+        setGeneratedSurveys(statusData.generated_surveys || []);
+
+        if (statusData.status === 'done') {
+          finished = true;
+          setFunnelId(statusData.funnel_id);
+          setGenerationProgress(100);
+          setGeneratingStep('Done!');
+          setStep('done');
+        } else if (statusData.status === 'error') {
+          finished = true;
+          setError(statusData.error || 'Generation failed');
+          setStep('plan');
+        }
+      };
+
+      // Progress is pushed as server-sent events (fetch, since EventSource can't send auth headers)
+      try {
+        const streamRes = await fetch(`${apiBase}/api/funnels/generate-status/${job_id}/stream`, {
+          headers: authHeaders()
+        });
+        if (streamRes.ok && streamRes.body) {
+          const reader = streamRes.body.getReader();
+          const decoder = new TextDecoder();
+          let buffer = '';
+          while (!finished) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+              const frame = buffer.slice(0, boundary);
+              buffer = buffer.slice(boundary + 2);
+              const data = frame
+                .split('\n')
+                .filter(line => line.startsWith('data:'))
+                .map(line => line.slice(5).trim())
+                .join('\n');
+              if (data) applyStatus(JSON.parse(data));
+            }
+          }
+          reader.cancel().catch(() => {});
+        }
+      } catch (streamErr) {
+        console.error('Progress stream error:', streamErr);
+      }
+      if (finished) return;
+
+      // Stream unavailable or dropped early — poll for status every 3 seconds
       const pollInterval = setInterval(async () => {
         try {
           const statusRes = await fetch(`${apiBase}/api/funnels/generate-status/${job_id}`, {
@@ -249,28 +300,15 @@ const FunnelCreator: React.FC<Props> = ({ onFunnelCreated, onCancel, isDarkMode
           });
           if (!statusRes.ok) return;
 
-          const statusData = await statusRes.json();
-          setGenerationProgress(statusData.progress || 0);
-          setGeneratingStep(statusData.current_step || 'Generating...');
-          setGeneratedSurveys(statusData.generated_surveys || []);
-
-          if (statusData.status === 'done') {
-            clearInterval(pollInterval);
-            setFunnelId(statusData.funnel_id);
-            setGenerationProgress(100);
-            setGeneratingStep('Done!');
-            setStep('done');
-          } else if (statusData.status === 'error') {
-            clearInterval(pollInterval);
-            setError(statusData.error || 'Generation failed');
-            setStep('plan');
-          }
+          applyStatus(await statusRes.json());
+          if (finished) clearInterval(pollInterval);
         } catch (pollErr) {
           console.error('Poll error:', pollErr);
         }
       }, 3000);
 
-      // Safety: stop polling after 10 minutes
+      // Safety: stop polling 10 minutes after the fallback started (the stream
+      // may already have used up its own window before dropping)
       setTimeout(() => clearInterval(pollInterval), 600000);
 
     } catch (e: any) {